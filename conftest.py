@@ -0,0 +1,33 @@
+import pytest
+from openg2p_g2p_bridge_example_bank_models.models import Account
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def bank_database(tmp_path):
+    """
+    Path of a SQLite database with every table of the bank, holding one USD
+    account 1001 with 1000 available. The api and celery tests open their
+    own engines on it.
+    """
+    path = tmp_path / "bank.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Account.metadata.create_all(engine)
+    with sessionmaker(engine)() as session:
+        session.add(
+            Account(
+                account_holder_name="Program",
+                account_number="1001",
+                account_currency="USD",
+                book_balance=1000,
+                available_balance=1000,
+                blocked_amount=0,
+                account_holder_phone="100",
+                account_holder_email="program@example.org",
+                active=True,
+            )
+        )
+        session.commit()
+    engine.dispose()
+    return path
@@ -5,13 +5,23 @@ import logging
 from openg2p_g2p_bridge_example_bank_api.config import Settings
 
 _config = Settings.get_config()
+from fastapi import FastAPI
 from openg2p_fastapi_common.app import Initializer as BaseInitializer
+from openg2p_fastapi_common.context import dbengine
 from openg2p_g2p_bridge_example_bank_models.models import (
     Account,
+    AccountBalanceCheckpoint,
+    AccountingLog,
+    AccountStatement,
+    AccountStatementPage,
     FundBlock,
+    IdempotencyKey,
+    InitiatePaymentBatchPartition,
+    InitiatePaymentBatchRequest,
     InitiatePaymentRequest,
+    StatementDelivery,
 )
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 
 from openg2p_g2p_bridge_example_bank_api.controllers import (
     AccountStatementController,
@@ -20,6 +30,13 @@ from openg2p_g2p_bridge_example_bank_api.controllers import (
     PaymentController,
     USSDController,
 )
+from openg2p_g2p_bridge_example_bank_api.utils import (
+    AccountCache,
+    AccountingLogService,
+    BalanceSnapshot,
+    IdempotencyStore,
+    create_db_engine,
+)
 
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
@@ -28,24 +45,121 @@ class Initializer(BaseInitializer):
     def initialize(self, **kwargs):
         super().initialize()
 
+        AccountCache()
+        AccountingLogService()
+        BalanceSnapshot()
+        IdempotencyStore()
         BlockFundsController().post_init()
         FundAvailabilityController().post_init()
         PaymentController().post_init()
         AccountStatementController().post_init()
         USSDController().post_init()
 
+    def init_db(self):
+        if _config.db_datasource:
+            dbengine.set(create_db_engine())
+
+    async def fastapi_app_startup(self, app: FastAPI):
+        await super().fastapi_app_startup(app)
+        await AccountCache.get_component().start_listener()
+
+    async def fastapi_app_shutdown(self, app: FastAPI):
+        await AccountCache.get_component().stop_listener()
+        await BalanceSnapshot.get_component().close()
+        await super().fastapi_app_shutdown(app)
+
     def migrate_database(self, args):
         super().migrate_database(args)
 
         async def migrate():
             _logger.info("Migrating database")
             await Account.create_migrate()
+            await add_missing_columns(Account)
             await FundBlock.create_migrate()
             await InitiatePaymentRequest.create_migrate()
+            await InitiatePaymentBatchRequest.create_migrate()
+            await add_missing_columns(InitiatePaymentBatchRequest)
+            await add_missing_enum_values(InitiatePaymentBatchRequest.payment_status)
+            await InitiatePaymentBatchPartition.create_migrate()
+            await AccountingLog.create_migrate()
+            await AccountStatement.create_migrate()
+            await add_missing_columns(AccountStatement)
+            await AccountStatementPage.create_migrate()
+            await AccountBalanceCheckpoint.create_migrate()
+            await IdempotencyKey.create_migrate()
+            await StatementDelivery.create_migrate()
+            # create_migrate only creates missing tables; indexes added to
+            # existing tables are created here
+            await create_missing_indexes(AccountingLog)
+            await create_missing_indexes(AccountStatement)
 
         asyncio.run(migrate())
 
 
+async def add_missing_columns(model):
+    """
+    Adds columns declared on the model but missing from its existing table.
+    Columns added this way must be nullable or have a server default.
+    """
+
+    def add_columns(sync_connection):
+        table = model.__table__
+        existing_columns = {
+            column["name"]
+            for column in inspect(sync_connection).get_columns(table.name)
+        }
+        preparer = sync_connection.dialect.identifier_preparer
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_ddl = (
+                f"{preparer.format_column(column)} "
+                f"{column.type.compile(dialect=sync_connection.dialect)}"
+            )
+            if column.server_default is not None:
+                column_ddl += f" DEFAULT {column.server_default.arg}"
+            if not column.nullable:
+                column_ddl += " NOT NULL"
+            _logger.info(f"Adding column {table.name}.{column.name}")
+            sync_connection.execute(
+                text(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_ddl}"
+                )
+            )
+
+    async with dbengine.get().begin() as connection:
+        await connection.run_sync(add_columns)
+
+
+async def add_missing_enum_values(column):
+    """
+    Adds values declared on a column's enum but missing from its existing
+    PostgreSQL enum type. Other databases keep enums as plain strings.
+    """
+    enum_type = column.type
+    engine = dbengine.get()
+    if engine.dialect.name != "postgresql" or not enum_type.native_enum:
+        return
+    type_name = engine.dialect.identifier_preparer.format_type(enum_type)
+    # Before PostgreSQL 12 an enum value cannot be added in a transaction
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        for value in enum_type.enums:
+            await connection.execute(
+                text(f"ALTER TYPE {type_name} ADD VALUE IF NOT EXISTS '{value}'")
+            )
+
+
+async def create_missing_indexes(model):
+    async with dbengine.get().begin() as connection:
+        await connection.run_sync(
+            lambda sync_connection: [
+                index.create(sync_connection, checkfirst=True)
+                for index in model.__table__.indexes
+            ]
+        )
+
+
 def get_engine():
     if _config.db_datasource:
         db_engine = create_engine(_config.db_datasource)
@@ -21,3 +21,38 @@ class Settings(BaseSettings):
 
     celery_broker_url: str = "redis://localhost:6379/0"
     celery_backend_url: str = "redis://localhost:6379/0"
+
+    payment_dispatch_on_initiate: bool = True
+    payment_ingest_chunk_size: int = 1000
+
+    # Statement requests for an account within this window are merged
+    statement_debounce_seconds: int = 10
+    # A statement pending for longer than this lost its generation task, which
+    # the next request for the account sends again
+    statement_redispatch_after_seconds: int = 60
+
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_query_cache_size: int = 500
+    db_prepared_statement_cache_size: int = 500
+    db_command_timeout: float = 30
+
+    ussd_cache_max_size: int = 10000
+    ussd_cache_ttl_seconds: float = 30
+
+    account_updates_redis_url: str = "redis://localhost:6379/0"
+    account_updates_channel: str = "example_bank_account_updates"
+    account_updates_redis_timeout: float = 1
+    account_updates_retry_seconds: float = 5
+
+    balance_snapshot_enabled: bool = False
+    # Defaults to the celery broker Redis when empty
+    balance_snapshot_redis_url: str = ""
+    balance_snapshot_ttl_seconds: int = 300
+    balance_snapshot_redis_timeout: float = 1
+
+    idempotency_cache_max_size: int = 10000
+    idempotency_cache_ttl_seconds: float = 3600
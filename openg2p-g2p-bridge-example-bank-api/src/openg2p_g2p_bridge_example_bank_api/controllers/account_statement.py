@@ -1,21 +1,45 @@
 import logging
+from datetime import datetime, time, timedelta
 
-from openg2p_fastapi_common.context import dbengine
+from fastapi import Depends
 from openg2p_fastapi_common.controller import BaseController
-from openg2p_g2p_bridge_example_bank_models.models import Account, AccountStatement
+from openg2p_g2p_bridge_example_bank_models.models import (
+    Account,
+    AccountStatement,
+    AccountStatementStatus,
+)
 from openg2p_g2p_bridge_example_bank_models.schemas import (
     AccountStatementRequest,
     AccountStatementResponse,
 )
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from openg2p_g2p_bridge_example_bank_models.utils import (
+    get_or_create_pending_statement,
+)
+from sqlalchemy import bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from ..celery_app import celery_app
 from ..config import Settings
+from ..utils import get_db_session
 
 _config = Settings.get_config()
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
+# Only a statement requested after its range ended holds all of its postings
+_closed_range_statement_stmt = (
+    select(AccountStatement.id)
+    .where(
+        AccountStatement.account_number == bindparam("account_number"),
+        AccountStatement.from_date == bindparam("from_date"),
+        AccountStatement.to_date == bindparam("to_date"),
+        AccountStatement.statement_status == AccountStatementStatus.COMPLETED,
+        AccountStatement.created_at >= bindparam("range_end"),
+    )
+    .order_by(AccountStatement.id.desc())
+    .limit(1)
+)
+
 
 class AccountStatementController(BaseController):
     def __init__(self, **kwargs):
@@ -31,39 +55,114 @@ class AccountStatementController(BaseController):
         )
 
     async def generate_account_statement(
-        self, account_statement_request: AccountStatementRequest
+        self,
+        account_statement_request: AccountStatementRequest,
+        session: AsyncSession = Depends(get_db_session),
     ) -> AccountStatementResponse:
         _logger.info("Generating account statement")
-        session_maker = async_sessionmaker(dbengine.get(), expire_on_commit=False)
-        async with session_maker() as session:
-            stmt = select(Account).where(
-                Account.account_number
-                == account_statement_request.program_account_number
+        stmt = select(Account).where(
+            Account.account_number == account_statement_request.program_account_number
+        )
+        result = await session.execute(stmt)
+        account = result.scalars().first()
+
+        if not account:
+            _logger.error("Account not found")
+            return AccountStatementResponse(
+                status="failed",
+                error_message="Account not found",
             )
-            result = await session.execute(stmt)
-            account = result.scalars().first()
 
-            if not account:
-                _logger.error("Account not found")
-                return AccountStatementResponse(
-                    status="failed",
-                    error_message="Account not found",
-                )
+        from_date = account_statement_request.from_date
+        to_date = account_statement_request.to_date
+        if (from_date is None) != (to_date is None) or (
+            from_date is not None and from_date > to_date
+        ):
+            _logger.error("Invalid statement date range")
+            return AccountStatementResponse(
+                status="failed",
+                error_message="Invalid statement date range",
+            )
 
-            account_statement = AccountStatement(
-                account_number=account_statement_request.program_account_number,
-                active=True,
+        if from_date is None:
+            account_statement_id = await self.request_pending_statement(
+                account.account_number, session
             )
-            session.add(account_statement)
-            await session.commit()
-
-            # Create a new task to generate the account statement
-            _logger.info("Account statement generation task created")
-            celery_app.send_task(
-                "account_statement_generator",
-                args=(account_statement.id,),
+            return AccountStatementResponse(
+                status="success", account_statement_id=str(account_statement_id)
             )
 
-            return AccountStatementResponse(
-                status="success", account_statement_id=str(account_statement.id)
+        from_date = datetime.combine(from_date, time.min)
+        to_date = datetime.combine(to_date, time.min)
+        # A range that has ended gets no new postings, so a statement
+        # already generated for it is delivered again instead of rebuilt
+        range_end = to_date + timedelta(days=1)
+        if range_end <= datetime.utcnow():
+            account_statement_id = await session.scalar(
+                _closed_range_statement_stmt,
+                {
+                    "account_number": account.account_number,
+                    "from_date": from_date,
+                    "to_date": to_date,
+                    "range_end": range_end,
+                },
             )
+            if account_statement_id:
+                _logger.info("Delivering stored account statement")
+                celery_app.send_task(
+                    "account_statement_generator",
+                    args=(account_statement_id,),
+                )
+                return AccountStatementResponse(
+                    status="success", account_statement_id=str(account_statement_id)
+                )
+        account_statement = AccountStatement(
+            account_number=account_statement_request.program_account_number,
+            account_statement_date=to_date,
+            from_date=from_date,
+            to_date=to_date,
+            active=True,
+        )
+        session.add(account_statement)
+        await session.commit()
+
+        # Create a new task to generate the account statement
+        _logger.info("Account statement generation task created")
+        celery_app.send_task(
+            "account_statement_generator",
+            args=(account_statement.id,),
+        )
+
+        return AccountStatementResponse(
+            status="success", account_statement_id=str(account_statement.id)
+        )
+
+    async def request_pending_statement(
+        self, account_number: str, session: AsyncSession
+    ) -> int:
+        """
+        Returns the id of the account's pending statement of its unreported
+        postings. If there is none, creates one and schedules its generation
+        after statement_debounce_seconds, so that requests arriving in the
+        meantime are merged into the same statement. A statement pending for
+        longer than statement_redispatch_after_seconds has its generation
+        scheduled again, in case sending the task failed.
+        """
+        account_statement_id, dispatch = await session.run_sync(
+            get_or_create_pending_statement,
+            account_number,
+            timedelta(seconds=_config.statement_redispatch_after_seconds),
+        )
+        if not dispatch:
+            _logger.info(
+                f"Merged into pending account statement {account_statement_id}"
+            )
+            return account_statement_id
+
+        _logger.info("Account statement generation task created")
+        celery_app.send_task(
+            "account_statement_generator",
+            args=(account_statement_id,),
+            countdown=_config.statement_debounce_seconds,
+        )
+        return account_statement_id
@@ -1,28 +1,61 @@
 import logging
 import uuid
+from typing import Annotated, Optional
 
-from openg2p_fastapi_common.context import dbengine
+from fastapi import Depends, Header
 from openg2p_fastapi_common.controller import BaseController
 from openg2p_g2p_bridge_example_bank_models.models import Account, FundBlock
 from openg2p_g2p_bridge_example_bank_models.schemas import (
     BlockFundsRequest,
     BlockFundsResponse,
 )
-from sqlalchemy import update
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy import bindparam, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from ..config import Settings
+from ..utils import (
+    AccountCache,
+    BalanceSnapshot,
+    IdempotencyStore,
+    get_db_session,
+)
 
 _config = Settings.get_config()
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
+# Built once so the compiled form is reused from the statement cache
+_account_id_stmt = select(Account.id).where(
+    (Account.account_number == bindparam("block_account_number"))
+    & (Account.account_currency == bindparam("block_currency"))
+)
+# Checks the balance and reserves the funds in one statement, so concurrent
+# blocks on the same account cannot overdraw it
+_reserve_funds_stmt = (
+    update(Account)
+    .where(
+        (Account.account_number == bindparam("block_account_number"))
+        & (Account.account_currency == bindparam("block_currency"))
+        & (Account.available_balance >= bindparam("block_amount"))
+    )
+    .values(
+        available_balance=Account.available_balance - bindparam("block_amount"),
+        blocked_amount=Account.blocked_amount + bindparam("block_amount"),
+        balance_version=Account.balance_version + 1,
+    )
+    .returning(Account.available_balance, Account.balance_version)
+    .execution_options(synchronize_session=False)
+)
+
 
 class BlockFundsController(BaseController):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self.router.tags += ["Funds Management"]
+        self.account_cache = AccountCache.get_component()
+        self.balance_snapshot = BalanceSnapshot.get_component()
+        self.idempotency_store = IdempotencyStore.get_component()
 
         self.router.add_api_route(
             "/block_funds",
@@ -31,56 +64,68 @@ class BlockFundsController(BaseController):
             methods=["POST"],
         )
 
-    async def block_funds(self, request: BlockFundsRequest) -> BlockFundsResponse:
+    async def block_funds(
+        self,
+        request: BlockFundsRequest,
+        session: AsyncSession = Depends(get_db_session),
+        idempotency_key: Annotated[Optional[str], Header()] = None,
+    ) -> BlockFundsResponse:
         _logger.info("Blocking funds")
-        session_maker = async_sessionmaker(dbengine.get(), expire_on_commit=False)
-        async with session_maker() as session:
-            stmt = select(Account).where(
-                (Account.account_number == request.account_number)
-                & (Account.account_currency == request.currency)
-            )
-            result = await session.execute(stmt)
-            account = result.scalars().first()
-
-            if not account:
-                _logger.error("Account not found")
-                return BlockFundsResponse(
-                    status="failed",
-                    block_reference_no="",
-                    error_message="Account not found",
-                )
-            if account.available_balance < request.amount:
-                _logger.error("Insufficient funds")
-                return BlockFundsResponse(
-                    status="failed",
-                    block_reference_no="",
-                    error_message="Insufficient funds",
-                )
+        stored_response = await self.idempotency_store.get_response(
+            "block_funds", idempotency_key, session
+        ) or await self.idempotency_store.claim_key(
+            "block_funds", idempotency_key, session
+        )
+        if stored_response:
+            _logger.info(f"Returning stored response for key {idempotency_key}")
+            return BlockFundsResponse.model_validate_json(stored_response)
 
-            await session.execute(
-                update(Account)
-                .where(Account.account_number == request.account_number)
-                .values(
-                    available_balance=account.book_balance
-                    - (account.blocked_amount + request.amount),
-                    blocked_amount=account.blocked_amount + request.amount,
-                )
+        block_params = {
+            "block_account_number": request.account_number,
+            "block_currency": request.currency,
+            "block_amount": request.amount,
+        }
+        result = await session.execute(_reserve_funds_stmt, block_params)
+        account = result.first()
+        if account is None:
+            account_id = await session.scalar(_account_id_stmt, block_params)
+            error_message = "Insufficient funds" if account_id else "Account not found"
+            _logger.error(error_message)
+            return BlockFundsResponse(
+                status="failed",
+                block_reference_no="",
+                error_message=error_message,
             )
 
-            block_reference_no = str(uuid.uuid4())
-            fund_block = FundBlock(
-                block_reference_no=block_reference_no,
-                account_number=request.account_number,
-                amount=request.amount,
-                currency=request.currency,
-                active=True,
-            )
-            session.add(fund_block)
+        block_reference_no = str(uuid.uuid4())
+        fund_block = FundBlock(
+            block_reference_no=block_reference_no,
+            account_number=request.account_number,
+            amount=request.amount,
+            currency=request.currency,
+            active=True,
+        )
+        session.add(fund_block)
+        # Readers must not be served the old balance once this commits
+        await self.balance_snapshot.invalidate(
+            request.account_number, account.balance_version
+        )
 
-            await session.commit()
-            _logger.info("Funds blocked successfully")
-            return BlockFundsResponse(
-                status="success",
-                block_reference_no=block_reference_no,
-                error_message="",
-            )
+        response = BlockFundsResponse(
+            status="success",
+            block_reference_no=block_reference_no,
+            error_message="",
+        )
+        await self.idempotency_store.commit_with_response(
+            "block_funds", idempotency_key, response, session
+        )
+
+        _logger.info("Funds blocked successfully")
+        await self.account_cache.publish_account_updates([request.account_number])
+        await self.balance_snapshot.store(
+            request.account_number,
+            request.currency,
+            account.available_balance,
+            account.balance_version,
+        )
+        return response
@@ -1,26 +1,38 @@
 import logging
+from typing import List, Optional
 
-from openg2p_fastapi_common.context import dbengine
+from fastapi import Depends
 from openg2p_fastapi_common.controller import BaseController
 from openg2p_g2p_bridge_example_bank_models.models import Account
 from openg2p_g2p_bridge_example_bank_models.schemas import (
     CheckFundRequest,
     CheckFundResponse,
 )
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy import bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from ..config import Settings
+from ..utils import BalanceSnapshot, get_db_session
 
 _config = Settings.get_config()
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
+# Built once so the compiled form is reused from the statement cache
+_account_balance_stmt = select(
+    Account.available_balance, Account.balance_version
+).where(
+    (Account.account_number == bindparam("check_account_number"))
+    & (Account.account_currency == bindparam("check_account_currency"))
+)
+
 
 class FundAvailabilityController(BaseController):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self.router.tags += ["Fund Availability"]
+        self.balance_snapshot = BalanceSnapshot.get_component()
 
         self.router.add_api_route(
             "/check_funds",
@@ -28,41 +40,124 @@ class FundAvailabilityController(BaseController):
             response_model=CheckFundResponse,
             methods=["POST"],
         )
+        self.router.add_api_route(
+            "/check_funds_bulk",
+            self.check_available_funds_bulk,
+            response_model=List[CheckFundResponse],
+            methods=["POST"],
+        )
 
     async def check_available_funds(
-        self, request: CheckFundRequest
+        self, request: CheckFundRequest, session: AsyncSession = Depends(get_db_session)
     ) -> CheckFundResponse:
         _logger.info("Checking available funds")
-        session_maker = async_sessionmaker(dbengine.get(), expire_on_commit=False)
-        async with session_maker() as session:
-            stmt = select(Account).where(
-                Account.account_number == request.account_number
+        snapshot = await self.balance_snapshot.get(request.account_number)
+        if snapshot and snapshot["currency"] == request.account_currency:
+            return self.construct_check_fund_response(
+                request, snapshot["available_balance"]
             )
+
+        result = await session.execute(
+            _account_balance_stmt,
+            {
+                "check_account_number": request.account_number,
+                "check_account_currency": request.account_currency,
+            },
+        )
+        account = result.first()
+        if not account:
+            return self.construct_check_fund_response(request, None)
+
+        await self.balance_snapshot.store(
+            request.account_number,
+            request.account_currency,
+            account.available_balance,
+            account.balance_version,
+        )
+        return self.construct_check_fund_response(request, account.available_balance)
+
+    async def check_available_funds_bulk(
+        self,
+        requests: List[CheckFundRequest],
+        session: AsyncSession = Depends(get_db_session),
+    ) -> List[CheckFundResponse]:
+        _logger.info(f"Checking available funds for {len(requests)} accounts")
+        snapshots = await self.balance_snapshot.get_many(
+            {request.account_number for request in requests}
+        )
+        available_balances = {
+            (account_number, snapshot["currency"]): snapshot["available_balance"]
+            for account_number, snapshot in snapshots.items()
+        }
+
+        missing_account_numbers = {
+            request.account_number
+            for request in requests
+            if (request.account_number, request.account_currency)
+            not in available_balances
+        }
+        if missing_account_numbers:
+            stmt = select(
+                Account.account_number,
+                Account.account_currency,
+                Account.available_balance,
+                Account.balance_version,
+            ).where(Account.account_number.in_(missing_account_numbers))
             result = await session.execute(stmt)
-            account = result.scalars().first()
-
-            if not account:
-                _logger.error("Account not found")
-                return CheckFundResponse(
-                    status="failed",
-                    account_number=request.account_number,
-                    has_sufficient_funds=False,
-                    error_message="Account not found",
+            accounts = result.all()
+            available_balances.update(
+                {
+                    (account.account_number, account.account_currency): (
+                        account.available_balance
+                    )
+                    for account in accounts
+                }
+            )
+            await self.balance_snapshot.store_many(
+                (
+                    account.account_number,
+                    account.account_currency,
+                    account.available_balance,
+                    account.balance_version,
                 )
+                for account in accounts
+            )
 
-            if account.available_balance >= request.total_funds_needed:
-                _logger.info("Sufficient funds")
-                return CheckFundResponse(
-                    status="success",
-                    account_number=account.account_number,
-                    has_sufficient_funds=True,
-                    error_message="",
-                )
-            else:
-                _logger.error("Insufficient funds")
-                return CheckFundResponse(
-                    status="failed",
-                    account_number=account.account_number,
-                    has_sufficient_funds=False,
-                    error_message="Insufficient funds",
-                )
+        return [
+            self.construct_check_fund_response(
+                request,
+                available_balances.get(
+                    (request.account_number, request.account_currency)
+                ),
+            )
+            for request in requests
+        ]
+
+    def construct_check_fund_response(
+        self, request: CheckFundRequest, available_balance: Optional[float]
+    ) -> CheckFundResponse:
+        if available_balance is None:
+            _logger.error(f"Account not found: {request.account_number}")
+            return CheckFundResponse(
+                status="failed",
+                account_number=request.account_number,
+                has_sufficient_funds=False,
+                error_message="Account not found",
+            )
+
+        if available_balance >= request.total_funds_needed:
+            _logger.info(f"Sufficient funds: {request.account_number}")
+            return CheckFundResponse(
+                status="success",
+                account_number=request.account_number,
+                has_sufficient_funds=True,
+                error_message="",
+            )
+        else:
+            _logger.error(f"Insufficient funds: {request.account_number}")
+            return CheckFundResponse(
+                status="failed",
+                account_number=request.account_number,
+                has_sufficient_funds=False,
+                error_message="Insufficient funds",
+            )
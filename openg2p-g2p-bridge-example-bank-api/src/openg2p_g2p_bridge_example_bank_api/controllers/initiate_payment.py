@@ -1,8 +1,8 @@
 import logging
 import uuid
-from typing import List
+from typing import Annotated, Dict, List, Optional, Set
 
-from openg2p_fastapi_common.context import dbengine
+from fastapi import Depends, Header, Request
 from openg2p_fastapi_common.controller import BaseController
 from openg2p_g2p_bridge_example_bank_models.models import (
     FundBlock,
@@ -13,20 +13,34 @@ from openg2p_g2p_bridge_example_bank_models.schemas import (
     InitiatePaymentPayload,
     InitiatePaymentResponse,
 )
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy import bindparam, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from ..celery_app import celery_app
 from ..config import Settings
+from ..utils import IdempotencyStore, get_db_session, iter_json_objects
 
 _config = Settings.get_config()
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
+# Served by the unique index on payment_reference_number
+_existing_references_stmt = select(
+    InitiatePaymentRequest.payment_reference_number
+).where(
+    InitiatePaymentRequest.payment_reference_number.in_(
+        bindparam("payment_reference_numbers", expanding=True)
+    )
+)
+
 
 class PaymentController(BaseController):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self.router.tags += ["Payments Management"]
+        self.idempotency_store = IdempotencyStore.get_component()
 
         self.router.add_api_route(
             "/initiate_payment",
@@ -34,71 +48,363 @@ class PaymentController(BaseController):
             response_model=InitiatePaymentResponse,
             methods=["POST"],
         )
+        self.router.add_api_route(
+            "/initiate_payment_stream",
+            self.initiate_payment_stream,
+            response_model=InitiatePaymentResponse,
+            methods=["POST"],
+        )
 
     async def initiate_payment(
-        self, initiate_payment_payloads: List[InitiatePaymentPayload]
+        self,
+        initiate_payment_payloads: List[InitiatePaymentPayload],
+        session: AsyncSession = Depends(get_db_session),
+        idempotency_key: Annotated[Optional[str], Header()] = None,
     ) -> InitiatePaymentResponse:
         _logger.info("Initiating payment")
-        session_maker = async_sessionmaker(dbengine.get(), expire_on_commit=False)
-        async with session_maker() as session:
-            batch_id = str(uuid.uuid4())
-            initiate_payment_batch_request = InitiatePaymentBatchRequest(
-                batch_id=batch_id,
-                active=True,
-            )
-            session.add(initiate_payment_batch_request)
-            initiate_payment_requests = []
-            for initiate_payment_payload in initiate_payment_payloads:
-                fund_block_stmt = select(FundBlock).where(
-                    FundBlock.block_reference_no
-                    == initiate_payment_payload.funds_blocked_reference_number
+        stored_response = await self.idempotency_store.get_response(
+            "initiate_payment", idempotency_key, session
+        ) or await self.idempotency_store.claim_key(
+            "initiate_payment", idempotency_key, session
+        )
+        if stored_response:
+            _logger.info(f"Returning stored response for key {idempotency_key}")
+            return InitiatePaymentResponse.model_validate_json(stored_response)
+
+        batch_id = str(uuid.uuid4())
+        initiate_payment_batch_request = InitiatePaymentBatchRequest(
+            batch_id=batch_id,
+            active=True,
+        )
+        session.add(initiate_payment_batch_request)
+
+        fund_block_totals: Dict[str, float] = {}
+        payment_references: Set[str] = set()
+        duplicate_payment_references: List[str] = []
+        chunk_size = _config.payment_ingest_chunk_size
+        for start in range(0, len(initiate_payment_payloads), chunk_size):
+            if not await self.ingest_payment_chunk(
+                batch_id,
+                initiate_payment_payloads[start : start + chunk_size],
+                fund_block_totals,
+                payment_references,
+                duplicate_payment_references,
+                session,
+            ):
+                return InitiatePaymentResponse(
+                    status="failed",
+                    error_message="Invalid funds block reference or mismatch in details",
+                )
+
+        return await self.complete_payment_batch(
+            "initiate_payment",
+            batch_id,
+            payment_references,
+            duplicate_payment_references,
+            idempotency_key,
+            session,
+        )
+
+    async def initiate_payment_stream(
+        self,
+        request: Request,
+        session: AsyncSession = Depends(get_db_session),
+        idempotency_key: Annotated[Optional[str], Header()] = None,
+    ) -> InitiatePaymentResponse:
+        """
+        Accepts the payloads of a batch as NDJSON or a JSON array and writes
+        them in chunks while the body is still being received, so the batch
+        never has to be held in memory as a whole. The batch is committed
+        only once the entire body has been read and validated.
+        """
+        _logger.info("Initiating payment from stream")
+        stored_response = await self.idempotency_store.get_response(
+            "initiate_payment_stream", idempotency_key, session
+        ) or await self.idempotency_store.claim_key(
+            "initiate_payment_stream", idempotency_key, session
+        )
+        if stored_response:
+            _logger.info(f"Returning stored response for key {idempotency_key}")
+            return InitiatePaymentResponse.model_validate_json(stored_response)
+
+        batch_id = str(uuid.uuid4())
+        initiate_payment_batch_request = InitiatePaymentBatchRequest(
+            batch_id=batch_id,
+            active=True,
+        )
+        session.add(initiate_payment_batch_request)
+
+        fund_block_totals: Dict[str, float] = {}
+        payment_references: Set[str] = set()
+        duplicate_payment_references: List[str] = []
+        initiate_payment_payloads: List[InitiatePaymentPayload] = []
+        try:
+            async for item in iter_json_objects(request.stream()):
+                initiate_payment_payloads.append(
+                    InitiatePaymentPayload.model_validate(item)
                 )
-                fund_block_result = await session.execute(fund_block_stmt)
-                fund_block = fund_block_result.scalars().first()
-
-                if (
-                    not fund_block
-                    or initiate_payment_payload.payment_amount > fund_block.amount
-                    or fund_block.currency
-                    != initiate_payment_payload.remitting_account_currency
+                if len(initiate_payment_payloads) < _config.payment_ingest_chunk_size:
+                    continue
+                if not await self.ingest_payment_chunk(
+                    batch_id,
+                    initiate_payment_payloads,
+                    fund_block_totals,
+                    payment_references,
+                    duplicate_payment_references,
+                    session,
                 ):
-                    _logger.error(
-                        "Invalid funds block reference or mismatch in details"
-                    )
                     return InitiatePaymentResponse(
                         status="failed",
                         error_message="Invalid funds block reference or mismatch in details",
                     )
+                initiate_payment_payloads = []
+        except ValueError as e:
+            # Covers malformed JSON as well as pydantic validation errors
+            _logger.error(f"Invalid payment payload in stream: {e}")
+            return InitiatePaymentResponse(
+                status="failed",
+                error_message=f"Invalid payment payload: {e}",
+            )
+
+        if initiate_payment_payloads:
+            if not await self.ingest_payment_chunk(
+                batch_id,
+                initiate_payment_payloads,
+                fund_block_totals,
+                payment_references,
+                duplicate_payment_references,
+                session,
+            ):
+                return InitiatePaymentResponse(
+                    status="failed",
+                    error_message="Invalid funds block reference or mismatch in details",
+                )
+
+        return await self.complete_payment_batch(
+            "initiate_payment_stream",
+            batch_id,
+            payment_references,
+            duplicate_payment_references,
+            idempotency_key,
+            session,
+        )
+
+    async def complete_payment_batch(
+        self,
+        endpoint: str,
+        batch_id: str,
+        payment_references: Set[str],
+        duplicate_payment_references: List[str],
+        idempotency_key: Optional[str],
+        session,
+    ) -> InitiatePaymentResponse:
+        if not payment_references:
+            _logger.error("No new payment payloads in request")
+            return InitiatePaymentResponse(
+                status="failed",
+                error_message=(
+                    "All payment reference numbers are duplicates"
+                    if duplicate_payment_references
+                    else "No payment payloads received"
+                ),
+                duplicate_payment_reference_numbers=duplicate_payment_references,
+            )
+
+        response = InitiatePaymentResponse(
+            status="success",
+            error_message="",
+            duplicate_payment_reference_numbers=duplicate_payment_references,
+        )
+        await self.idempotency_store.commit_with_response(
+            endpoint, idempotency_key, response, session
+        )
+        _logger.info(
+            f"Payment initiated successfully for {len(payment_references)} payloads,"
+            f" skipped {len(duplicate_payment_references)} duplicates"
+        )
+        self.dispatch_payment_batch(batch_id)
+        return response
+
+    async def ingest_payment_chunk(
+        self,
+        batch_id: str,
+        initiate_payment_payloads: List[InitiatePaymentPayload],
+        fund_block_totals: Dict[str, float],
+        payment_references: Set[str],
+        duplicate_payment_references: List[str],
+        session,
+    ) -> bool:
+        initiate_payment_payloads = await self.remove_duplicate_payments(
+            initiate_payment_payloads,
+            payment_references,
+            duplicate_payment_references,
+            session,
+        )
+        if not await self.validate_payment_payloads(
+            initiate_payment_payloads, session, fund_block_totals
+        ):
+            _logger.error("Invalid funds block reference or mismatch in details")
+            return False
+        while True:
+            try:
+                async with session.begin_nested():
+                    await self.insert_payment_payloads(
+                        batch_id, initiate_payment_payloads, session
+                    )
+                return True
+            except IntegrityError:
+                # A concurrent request stored some of these reference numbers
+                # after they were looked up; they are rejected as duplicates
+                duplicate_count = len(duplicate_payment_references)
+                payment_references.difference_update(
+                    initiate_payment_payload.payment_reference_number
+                    for initiate_payment_payload in initiate_payment_payloads
+                )
+                attempted_payloads = initiate_payment_payloads
+                initiate_payment_payloads = await self.remove_duplicate_payments(
+                    attempted_payloads,
+                    payment_references,
+                    duplicate_payment_references,
+                    session,
+                )
+                if len(duplicate_payment_references) == duplicate_count:
+                    raise
+                rejected_references = set(
+                    duplicate_payment_references[duplicate_count:]
+                )
+                _logger.info(
+                    f"Rejected {len(rejected_references)} payment reference"
+                    " numbers stored by a concurrent request"
+                )
+                for initiate_payment_payload in attempted_payloads:
+                    if (
+                        initiate_payment_payload.payment_reference_number
+                        in rejected_references
+                    ):
+                        fund_block_totals[
+                            initiate_payment_payload.funds_blocked_reference_number
+                        ] -= initiate_payment_payload.payment_amount
+
+    async def remove_duplicate_payments(
+        self,
+        initiate_payment_payloads: List[InitiatePaymentPayload],
+        payment_references: Set[str],
+        duplicate_payment_references: List[str],
+        session,
+    ) -> List[InitiatePaymentPayload]:
+        """
+        Drops the payloads whose payment reference number is already stored
+        or was accepted earlier in the same request, using one indexed lookup
+        for the whole chunk. The dropped reference numbers are appended to
+        duplicate_payment_references and the accepted ones are added to
+        payment_references.
+        """
+        existing_references = set(
+            await session.scalars(
+                _existing_references_stmt,
+                {
+                    "payment_reference_numbers": [
+                        initiate_payment_payload.payment_reference_number
+                        for initiate_payment_payload in initiate_payment_payloads
+                    ]
+                },
+            )
+        )
+        unique_payloads = []
+        for initiate_payment_payload in initiate_payment_payloads:
+            payment_reference = initiate_payment_payload.payment_reference_number
+            if (
+                payment_reference in existing_references
+                or payment_reference in payment_references
+            ):
+                duplicate_payment_references.append(payment_reference)
+                continue
+            payment_references.add(payment_reference)
+            unique_payloads.append(initiate_payment_payload)
+        return unique_payloads
 
-                initiate_payment_request = InitiatePaymentRequest(
-                    batch_id=batch_id,
-                    payment_reference_number=initiate_payment_payload.payment_reference_number,
-                    remitting_account=initiate_payment_payload.remitting_account,
-                    remitting_account_currency=initiate_payment_payload.remitting_account_currency,
-                    payment_amount=initiate_payment_payload.payment_amount,
-                    funds_blocked_reference_number=initiate_payment_payload.funds_blocked_reference_number,
-                    beneficiary_name=initiate_payment_payload.beneficiary_name,
-                    beneficiary_account=initiate_payment_payload.beneficiary_account,
-                    beneficiary_account_currency=initiate_payment_payload.beneficiary_account_currency,
-                    beneficiary_account_type=initiate_payment_payload.beneficiary_account_type,
-                    beneficiary_bank_code=initiate_payment_payload.beneficiary_bank_code,
-                    beneficiary_branch_code=initiate_payment_payload.beneficiary_branch_code,
-                    beneficiary_mobile_wallet_provider=initiate_payment_payload.beneficiary_mobile_wallet_provider,
-                    beneficiary_phone_no=initiate_payment_payload.beneficiary_phone_no,
-                    beneficiary_email=initiate_payment_payload.beneficiary_email,
-                    beneficiary_email_wallet_provider=initiate_payment_payload.beneficiary_email_wallet_provider,
-                    payment_date=initiate_payment_payload.payment_date,
-                    narrative_1=initiate_payment_payload.narrative_1,
-                    narrative_2=initiate_payment_payload.narrative_2,
-                    narrative_3=initiate_payment_payload.narrative_3,
-                    narrative_4=initiate_payment_payload.narrative_4,
-                    narrative_5=initiate_payment_payload.narrative_5,
-                    narrative_6=initiate_payment_payload.narrative_6,
-                    active=True,
+    async def validate_payment_payloads(
+        self,
+        initiate_payment_payloads: List[InitiatePaymentPayload],
+        session,
+        fund_block_totals: Optional[Dict[str, float]] = None,
+    ) -> bool:
+        """
+        Resolves every referenced fund block with one query and checks the
+        payloads against them in memory. fund_block_totals accumulates the
+        amount claimed per block, so the combined total of all payments
+        against a block can be checked across several calls.
+        """
+        if fund_block_totals is None:
+            fund_block_totals = {}
+        fund_block_result = await session.execute(
+            select(FundBlock).where(
+                FundBlock.block_reference_no.in_(
+                    {
+                        initiate_payment_payload.funds_blocked_reference_number
+                        for initiate_payment_payload in initiate_payment_payloads
+                    }
                 )
-                initiate_payment_requests.append(initiate_payment_request)
+            )
+        )
+        fund_blocks = {
+            fund_block.block_reference_no: fund_block
+            for fund_block in fund_block_result.scalars()
+        }
 
-            session.add_all(initiate_payment_requests)
-            await session.commit()
-            _logger.info("Payment initiated successfully")
-            return InitiatePaymentResponse(status="success", error_message="")
+        for initiate_payment_payload in initiate_payment_payloads:
+            fund_block = fund_blocks.get(
+                initiate_payment_payload.funds_blocked_reference_number
+            )
+            if (
+                not fund_block
+                or initiate_payment_payload.payment_amount > fund_block.amount
+                or fund_block.currency
+                != initiate_payment_payload.remitting_account_currency
+            ):
+                return False
+
+            fund_block_total = (
+                fund_block_totals.get(fund_block.block_reference_no, 0)
+                + initiate_payment_payload.payment_amount
+            )
+            if fund_block_total > fund_block.amount:
+                return False
+            fund_block_totals[fund_block.block_reference_no] = fund_block_total
+        return True
+
+    async def insert_payment_payloads(
+        self,
+        batch_id: str,
+        initiate_payment_payloads: List[InitiatePaymentPayload],
+        session,
+    ):
+        if not initiate_payment_payloads:
+            return
+        await session.execute(
+            insert(InitiatePaymentRequest),
+            [
+                {
+                    **initiate_payment_payload.model_dump(),
+                    "batch_id": batch_id,
+                    "active": True,
+                }
+                for initiate_payment_payload in initiate_payment_payloads
+            ],
+        )
+
+    def dispatch_payment_batch(self, batch_id: str):
+        if not _config.payment_dispatch_on_initiate:
+            return
+        # The worker leases the batch itself, so a concurrent beat sweep that
+        # picks up the same batch cannot process it twice. If the broker is
+        # unreachable the batch stays PENDING for the next sweep.
+        try:
+            celery_app.send_task(
+                "process_payments_worker",
+                args=[batch_id],
+                queue="g2p_bridge_celery_worker_tasks",
+            )
+            _logger.info(f"Payment processing task created for batch: {batch_id}")
+        except Exception as e:
+            _logger.error(f"Failed to dispatch payment batch {batch_id}: {e}")
@@ -1,30 +1,45 @@
 import logging
 from typing import Optional
 
-from fastapi import Form
+from fastapi import Depends, Form
 from fastapi.responses import PlainTextResponse
-from openg2p_fastapi_common.context import dbengine
 from openg2p_fastapi_common.controller import BaseController
 from openg2p_g2p_bridge_example_bank_models.models import (
     Account,
-    AccountingLog,
     DebitCreditTypes,
 )
-from sqlalchemy import desc
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy import bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from ..config import Settings
+from ..utils import (
+    AccountCache,
+    AccountingLogService,
+    BalanceSnapshot,
+    get_db_session,
+)
 
 _config = Settings.get_config()
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
+# Built once so the compiled form is reused from the statement cache
+_account_by_phone_stmt = select(
+    Account.account_number, Account.available_balance
+).where(Account.account_holder_phone == bindparam("phone_number"))
+_balance_by_account_stmt = select(
+    Account.account_currency, Account.available_balance, Account.balance_version
+).where(Account.account_number == bindparam("account_number"))
+
 
 class USSDController(BaseController):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self.router.tags += ["USSD Controller"]
+        self.account_cache = AccountCache.get_component()
+        self.accounting_log_service = AccountingLogService.get_component()
+        self.balance_snapshot = BalanceSnapshot.get_component()
 
         self.router.add_api_route(
             "/ussd",
@@ -33,6 +48,12 @@ class USSDController(BaseController):
             response_model=str,
             methods=["POST"],
         )
+        self.router.add_api_route(
+            "/ussd/cache_stats",
+            self.get_cache_stats,
+            response_model=dict,
+            methods=["GET"],
+        )
 
     async def ussd(
         self,
@@ -41,6 +62,7 @@ class USSDController(BaseController):
         phoneNumber: str = Form(),
         networkCode: str = Form(),
         text: Optional[str] = Form(""),
+        session: AsyncSession = Depends(get_db_session),
     ):
         response: str = ""
         _logger.info(f"Your input is {text}")
@@ -50,78 +72,138 @@ class USSDController(BaseController):
             response += "2. Initiate transfer \n"
             response += "3. See recent transactions"
         elif text == "1":
-            response = await self.get_account_balance(phoneNumber)
+            response = await self.get_account_balance(phoneNumber, session)
         elif text == "2":
             response = "END Bye!"
         elif text == "3":
-            response = await self.get_recent_transactions(phoneNumber)
+            response = await self.get_recent_transactions(phoneNumber, session)
         else:
             response = "END Invalid choice selected!"
 
         return response
 
-    async def get_account_balance(self, phone_number: str) -> str:
+    async def get_account_balance(
+        self, phone_number: str, session: AsyncSession
+    ) -> str:
         _logger.info("Fetching account balance through USSD")
         _logger.info(f"Phone Number: {phone_number}")
         phone_number_parsed = phone_number[1:]
         _logger.info(f"Parsed Phone Number: {phone_number_parsed}")
 
-        session_maker = async_sessionmaker(dbengine.get(), expire_on_commit=False)
-        async with session_maker() as session:
-            account_db_query = select(Account).where(
-                Account.account_holder_phone == phone_number_parsed
-            )
-            result = await session.execute(account_db_query)
-            account = result.scalars().first()
-
-            if not account:
-                _logger.error("Account not found")
-                return f"END Account not found for this phone number: {phone_number}"
+        account_number = await self.get_account_number(phone_number_parsed, session)
+        if not account_number:
+            _logger.error("Account not found")
+            return f"END Account not found for this phone number: {phone_number}"
 
-            return (
-                f"END Available balance in account ending with {account.account_number[-4:]} is"
-                f" ${account.available_balance:,.2f}"
+        available_balance = self.account_cache.balances.get(account_number)
+        if available_balance is None:
+            generation = self.account_cache.balances.generation()
+            available_balance = await self.get_available_balance(
+                account_number, session
+            )
+            self.account_cache.balances.set_if_unchanged(
+                account_number, available_balance, generation
             )
 
-    async def get_recent_transactions(self, phone_number: str) -> str:
+        return (
+            f"END Available balance in account ending with {account_number[-4:]} is"
+            f" ${available_balance:,.2f}"
+        )
+
+    async def get_recent_transactions(
+        self, phone_number: str, session: AsyncSession
+    ) -> str:
         _logger.info("Fetching account transactions through USSD")
         _logger.info(f"Phone Number: {phone_number}")
         phone_number_parsed = phone_number[1:]
         _logger.info(f"Parsed Phone Number: {phone_number_parsed}")
 
-        session_maker = async_sessionmaker(dbengine.get(), expire_on_commit=False)
-        async with session_maker() as session:
-            account_db_query = select(Account).where(
-                Account.account_holder_phone == phone_number_parsed
+        account_number = self.account_cache.accounts_by_phone.get(phone_number_parsed)
+        if account_number is None:
+            generation = self.account_cache.recent_transactions.generation()
+            (
+                account_number,
+                accounting_logs,
+            ) = await self.accounting_log_service.get_recent_postings_by_phone(
+                phone_number_parsed, session
             )
-            account_result = await session.execute(account_db_query)
-            account = account_result.scalars().first()
-
-            if not account:
+            if not account_number:
                 _logger.error("Account not found")
                 return f"END Account not found for this phone number: {phone_number}"
-
-            accounting_logs_query = (
-                select(AccountingLog)
-                .where(AccountingLog.account_number == account.account_number)
-                .order_by(desc(AccountingLog.id))
-                .limit(3)
+            self.account_cache.accounts_by_phone.set(
+                phone_number_parsed, account_number
+            )
+            self.account_cache.recent_transactions.set_if_unchanged(
+                account_number, accounting_logs, generation
             )
-            accounting_log_result = await session.execute(accounting_logs_query)
-            accounting_logs = accounting_log_result.scalars()
-            transaction_text = ""
-            for accounting_log in accounting_logs:
-                date_formatted = accounting_log.transaction_date.strftime(
-                    "%d/%b"
-                ).upper()  # Format and convert to uppercase
-                credit_debit_type = (
-                    "CR"
-                    if accounting_log.debit_credit == DebitCreditTypes.CREDIT
-                    else "DR"
+        else:
+            accounting_logs = self.account_cache.recent_transactions.get(account_number)
+            if accounting_logs is None:
+                generation = self.account_cache.recent_transactions.generation()
+                accounting_logs = await self.accounting_log_service.get_recent_postings(
+                    account_number, session
                 )
-                transaction_text += (
-                    f"{credit_debit_type} - ${accounting_log.transaction_amount:,.2f} "
-                    f"- {date_formatted} - {accounting_log.narrative_3} "
-                    f"- {accounting_log.narrative_4} \n"
+                self.account_cache.recent_transactions.set_if_unchanged(
+                    account_number, accounting_logs, generation
                 )
-            return f"END {transaction_text}"
+
+        transaction_text = ""
+        for accounting_log in accounting_logs:
+            date_formatted = accounting_log.transaction_date.strftime(
+                "%d/%b"
+            ).upper()  # Format and convert to uppercase
+            credit_debit_type = (
+                "CR" if accounting_log.debit_credit == DebitCreditTypes.CREDIT else "DR"
+            )
+            transaction_text += (
+                f"{credit_debit_type} - ${accounting_log.transaction_amount:,.2f} "
+                f"- {date_formatted} - {accounting_log.narrative_3} "
+                f"- {accounting_log.narrative_4} \n"
+            )
+        return f"END {transaction_text}"
+
+    async def get_account_number(
+        self, phone_number_parsed: str, session: AsyncSession
+    ) -> Optional[str]:
+        account_number = self.account_cache.accounts_by_phone.get(phone_number_parsed)
+        if account_number is not None:
+            return account_number
+
+        generation = self.account_cache.balances.generation()
+        result = await session.execute(
+            _account_by_phone_stmt, {"phone_number": phone_number_parsed}
+        )
+        account = result.first()
+        if not account:
+            # Not cached, the account may be created by a later payment
+            return None
+
+        self.account_cache.accounts_by_phone.set(
+            phone_number_parsed, account.account_number
+        )
+        self.account_cache.balances.set_if_unchanged(
+            account.account_number, account.available_balance, generation
+        )
+        return account.account_number
+
+    async def get_available_balance(
+        self, account_number: str, session: AsyncSession
+    ) -> float:
+        snapshot = await self.balance_snapshot.get(account_number)
+        if snapshot:
+            return snapshot["available_balance"]
+
+        result = await session.execute(
+            _balance_by_account_stmt, {"account_number": account_number}
+        )
+        account = result.first()
+        await self.balance_snapshot.store(
+            account_number,
+            account.account_currency,
+            account.available_balance,
+            account.balance_version,
+        )
+        return account.available_balance
+
+    async def get_cache_stats(self) -> dict:
+        return self.account_cache.stats()
@@ -0,0 +1,7 @@
+from .account_cache import AccountCache
+from .accounting_log_service import AccountingLogService
+from .balance_snapshot import BalanceSnapshot
+from .db import create_db_engine, get_db_session, get_session_maker
+from .idempotency import IdempotencyStore
+from .json_stream import iter_json_objects
+from .ttl_cache import TTLCache
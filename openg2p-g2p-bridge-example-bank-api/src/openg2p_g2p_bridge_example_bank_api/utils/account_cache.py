@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+from typing import Iterable
+
+from openg2p_fastapi_common.service import BaseService
+from redis import asyncio as aioredis
+
+from ..config import Settings
+from .ttl_cache import TTLCache
+
+_config = Settings.get_config()
+_logger = logging.getLogger(_config.logging_default_logger_name)
+
+
+class AccountCache(BaseService):
+    """
+    In-process caches for the USSD account lookups.
+
+    accounts_by_phone maps a phone number to its account number, which does
+    not change once the account exists. balances and recent_transactions are
+    keyed by account number and are dropped whenever the celery worker or
+    another API process publishes a posting to that account on the account
+    updates channel.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.accounts_by_phone = TTLCache(
+            _config.ussd_cache_max_size, _config.ussd_cache_ttl_seconds
+        )
+        self.balances = TTLCache(
+            _config.ussd_cache_max_size, _config.ussd_cache_ttl_seconds
+        )
+        self.recent_transactions = TTLCache(
+            _config.ussd_cache_max_size, _config.ussd_cache_ttl_seconds
+        )
+        self._redis = None
+        self._listener_task = None
+
+    def invalidate_accounts(self, account_numbers: Iterable[str]):
+        for account_number in account_numbers:
+            self.balances.pop(account_number)
+            self.recent_transactions.pop(account_number)
+
+    def clear(self):
+        self.accounts_by_phone.clear()
+        self.balances.clear()
+        self.recent_transactions.clear()
+
+    def stats(self) -> dict:
+        return {
+            "accounts_by_phone": self.accounts_by_phone.stats(),
+            "balances": self.balances.stats(),
+            "recent_transactions": self.recent_transactions.stats(),
+        }
+
+    def get_redis(self):
+        if self._redis is None and _config.account_updates_redis_url:
+            self._redis = aioredis.from_url(
+                _config.account_updates_redis_url,
+                socket_connect_timeout=_config.account_updates_redis_timeout,
+            )
+        return self._redis
+
+    async def publish_account_updates(self, account_numbers: Iterable[str]):
+        account_numbers = list(account_numbers)
+        self.invalidate_accounts(account_numbers)
+        redis = self.get_redis()
+        if redis is None:
+            return
+        try:
+            await asyncio.wait_for(
+                redis.publish(
+                    _config.account_updates_channel, json.dumps(account_numbers)
+                ),
+                _config.account_updates_redis_timeout,
+            )
+        except Exception as e:
+            _logger.error(f"Failed to publish account updates: {e}")
+
+    async def start_listener(self):
+        if self.get_redis() is not None and self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop_listener(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def _listen(self):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(_config.account_updates_channel)
+                # Updates published while unsubscribed were missed
+                self.balances.clear()
+                self.recent_transactions.clear()
+                _logger.info("Listening for account updates")
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.invalidate_accounts(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _logger.error(f"Account updates listener failed, retrying: {e}")
+                await asyncio.sleep(_config.account_updates_retry_seconds)
+            finally:
+                await pubsub.aclose()
@@ -0,0 +1,72 @@
+from typing import List, Optional, Tuple
+
+from openg2p_fastapi_common.service import BaseService
+from openg2p_g2p_bridge_example_bank_models.models import Account, AccountingLog
+from sqlalchemy import Row, bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+_posting_columns = (
+    AccountingLog.id,
+    AccountingLog.reference_no,
+    AccountingLog.debit_credit,
+    AccountingLog.transaction_amount,
+    AccountingLog.transaction_date,
+    AccountingLog.transaction_currency,
+    AccountingLog.narrative_1,
+    AccountingLog.narrative_2,
+    AccountingLog.narrative_3,
+    AccountingLog.narrative_4,
+)
+
+_account_number_by_phone_stmt = select(Account.account_number).where(
+    Account.account_holder_phone == bindparam("phone_number")
+)
+# Both read the newest rows straight off the (account_number, id DESC) index;
+# the account number is resolved once, before the postings are scanned
+_postings_by_account_stmt = (
+    select(*_posting_columns)
+    .where(AccountingLog.account_number == bindparam("account_number"))
+    .order_by(AccountingLog.id.desc())
+    .limit(bindparam("limit"))
+)
+_postings_by_phone_stmt = (
+    select(AccountingLog.account_number, *_posting_columns)
+    .where(
+        AccountingLog.account_number == _account_number_by_phone_stmt.scalar_subquery()
+    )
+    .order_by(AccountingLog.id.desc())
+    .limit(bindparam("limit"))
+)
+
+
+class AccountingLogService(BaseService):
+    async def get_recent_postings(
+        self, account_number: str, session: AsyncSession, limit: int = 3
+    ) -> List[Row]:
+        """Returns the last limit postings of an account, newest first."""
+        result = await session.execute(
+            _postings_by_account_stmt,
+            {"account_number": account_number, "limit": limit},
+        )
+        return result.all()
+
+    async def get_recent_postings_by_phone(
+        self, phone_number: str, session: AsyncSession, limit: int = 3
+    ) -> Tuple[Optional[str], List[Row]]:
+        """
+        Resolves the account holding phone_number and returns its account
+        number with its last limit postings, newest first, in one query;
+        only an account without postings takes a second one. The account
+        number is None if no account has this phone number.
+        """
+        result = await session.execute(
+            _postings_by_phone_stmt,
+            {"phone_number": phone_number, "limit": limit},
+        )
+        rows = result.all()
+        if rows:
+            return rows[0].account_number, rows
+        account_number = await session.scalar(
+            _account_number_by_phone_stmt, {"phone_number": phone_number}
+        )
+        return account_number, []
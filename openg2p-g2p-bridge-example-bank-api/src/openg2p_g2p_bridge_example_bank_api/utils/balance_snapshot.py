@@ -0,0 +1,154 @@
+import logging
+from typing import Dict, Iterable, Optional
+
+from openg2p_fastapi_common.service import BaseService
+from redis import asyncio as aioredis
+
+from ..config import Settings
+
+_config = Settings.get_config()
+_logger = logging.getLogger(_config.logging_default_logger_name)
+
+# Shared with the celery worker, which writes the same keys
+_KEY_PREFIX = "example_bank:balance:"
+# Only replaces a snapshot with one of a newer balance version, or fills in
+# an invalidated one of the same version, so writers finishing out of order
+# can never put an older balance back
+_STORE_SCRIPT = """
+local version = redis.call('HGET', KEYS[1], 'version')
+if version then
+    version = tonumber(version)
+    local new_version = tonumber(ARGV[1])
+    if version > new_version then
+        return 0
+    end
+    if version == new_version and redis.call('HEXISTS', KEYS[1], 'available_balance') == 1 then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[1], 'available_balance', ARGV[2], 'currency', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+# Replaces the snapshot with a marker of the version a pending write is
+# about to commit. Readers treat it as missing, and it only takes a balance
+# of at least that version, so none read before the write can be put back.
+_INVALIDATE_SCRIPT = """
+local version = redis.call('HGET', KEYS[1], 'version')
+if version and tonumber(version) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'version', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class BalanceSnapshot(BaseService):
+    """
+    Optional account balance snapshot in Redis, shared by all API replicas.
+
+    Writers invalidate the snapshot with the balance_version of their change
+    before committing it, and write the balance through once it commits. A
+    missing, invalidated or expired snapshot, or any Redis failure, makes
+    readers fall back to the database.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.enabled = _config.balance_snapshot_enabled
+        self._redis = None
+        self._store_script = None
+        self._invalidate_script = None
+
+    def get_redis(self):
+        if self._redis is None:
+            self._redis = aioredis.from_url(
+                _config.balance_snapshot_redis_url or _config.celery_broker_url,
+                socket_connect_timeout=_config.balance_snapshot_redis_timeout,
+                socket_timeout=_config.balance_snapshot_redis_timeout,
+            )
+            self._store_script = self._redis.register_script(_STORE_SCRIPT)
+            self._invalidate_script = self._redis.register_script(_INVALIDATE_SCRIPT)
+        return self._redis
+
+    async def get(self, account_number: str) -> Optional[dict]:
+        return (await self.get_many([account_number])).get(account_number)
+
+    async def get_many(self, account_numbers: Iterable[str]) -> Dict[str, dict]:
+        """Returns the snapshots found, keyed by account number."""
+        if not self.enabled:
+            return {}
+        account_numbers = list(account_numbers)
+        try:
+            async with self.get_redis().pipeline(transaction=False) as pipe:
+                for account_number in account_numbers:
+                    pipe.hgetall(_KEY_PREFIX + account_number)
+                results = await pipe.execute()
+        except Exception as e:
+            _logger.error(f"Failed to read balance snapshots: {e}")
+            return {}
+        return {
+            account_number: {
+                "available_balance": float(result[b"available_balance"]),
+                "currency": result[b"currency"].decode(),
+                "version": int(result[b"version"]),
+            }
+            for account_number, result in zip(account_numbers, results)
+            if b"available_balance" in result
+        }
+
+    async def store(
+        self,
+        account_number: str,
+        currency: str,
+        available_balance: float,
+        version: int,
+    ):
+        await self.store_many([(account_number, currency, available_balance, version)])
+
+    async def store_many(self, balances: Iterable[tuple]):
+        """Stores (account_number, currency, available_balance, version) rows."""
+        if not self.enabled:
+            return
+        try:
+            redis = self.get_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                for account_number, currency, available_balance, version in balances:
+                    await self._store_script(
+                        keys=[_KEY_PREFIX + account_number],
+                        args=[
+                            version,
+                            repr(float(available_balance)),
+                            currency,
+                            _config.balance_snapshot_ttl_seconds,
+                        ],
+                        client=pipe,
+                    )
+                await pipe.execute()
+        except Exception as e:
+            _logger.error(f"Failed to store balance snapshots: {e}")
+
+    async def invalidate(self, account_number: str, version: int):
+        """
+        Invalidates the snapshot of an account before a change of this
+        balance_version commits. Should the transaction roll back instead,
+        readers use the database until the marker expires.
+        """
+        if not self.enabled:
+            return
+        try:
+            redis = self.get_redis()
+            await self._invalidate_script(
+                keys=[_KEY_PREFIX + account_number],
+                args=[version, _config.balance_snapshot_ttl_seconds],
+                client=redis,
+            )
+        except Exception as e:
+            _logger.error(f"Failed to invalidate balance snapshot: {e}")
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
@@ -0,0 +1,54 @@
+from typing import AsyncIterator
+
+from openg2p_fastapi_common.context import dbengine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from ..config import Settings
+
+_config = Settings.get_config()
+
+_session_maker: async_sessionmaker = None
+
+
+def create_db_engine() -> AsyncEngine:
+    """
+    Creates the API's async engine with the pool and statement cache
+    settings from Settings.
+    """
+    connect_args = {}
+    if make_url(_config.db_datasource).get_driver_name() == "asyncpg":
+        connect_args = {
+            "prepared_statement_cache_size": _config.db_prepared_statement_cache_size,
+            "command_timeout": _config.db_command_timeout,
+        }
+    return create_async_engine(
+        _config.db_datasource,
+        echo=_config.db_logging,
+        pool_size=_config.db_pool_size,
+        max_overflow=_config.db_max_overflow,
+        pool_timeout=_config.db_pool_timeout,
+        pool_recycle=_config.db_pool_recycle,
+        pool_pre_ping=_config.db_pool_pre_ping,
+        query_cache_size=_config.db_query_cache_size,
+        connect_args=connect_args,
+    )
+
+
+def get_session_maker() -> async_sessionmaker:
+    global _session_maker
+    engine = dbengine.get()
+    if _session_maker is None or _session_maker.kw["bind"] is not engine:
+        _session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    return _session_maker
+
+
+async def get_db_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency providing a session from the shared session maker."""
+    async with get_session_maker()() as session:
+        yield session
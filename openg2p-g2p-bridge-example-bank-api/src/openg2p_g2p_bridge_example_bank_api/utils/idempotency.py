@@ -0,0 +1,122 @@
+import logging
+from typing import Optional
+
+from openg2p_fastapi_common.service import BaseService
+from openg2p_g2p_bridge_example_bank_models.models import IdempotencyKey
+from pydantic import BaseModel
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import Settings
+from .ttl_cache import TTLCache
+
+_config = Settings.get_config()
+_logger = logging.getLogger(_config.logging_default_logger_name)
+
+_stored_response_stmt = select(IdempotencyKey.response).where(
+    (IdempotencyKey.endpoint == bindparam("endpoint"))
+    & (IdempotencyKey.idempotency_key == bindparam("idempotency_key"))
+)
+_store_response_stmt = (
+    update(IdempotencyKey)
+    .where(
+        (IdempotencyKey.endpoint == bindparam("key_endpoint"))
+        & (IdempotencyKey.idempotency_key == bindparam("key_idempotency_key"))
+    )
+    .values(response=bindparam("key_response"))
+    .execution_options(synchronize_session=False)
+)
+
+
+class IdempotencyStore(BaseService):
+    """
+    Remembers the response of every successful request made with an
+    Idempotency-Key header, so that a retry returns the same response
+    without repeating any of the work.
+
+    The key is inserted into idempotency_keys before any of the work and
+    its response is stored in the same transaction as the work itself, and
+    recently used responses are also kept in memory.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.responses = TTLCache(
+            _config.idempotency_cache_max_size,
+            _config.idempotency_cache_ttl_seconds,
+        )
+
+    async def get_response(
+        self, endpoint: str, idempotency_key: Optional[str], session: AsyncSession
+    ) -> Optional[str]:
+        """Returns the stored response JSON for this key, if any."""
+        if not idempotency_key:
+            return None
+        response = self.responses.get((endpoint, idempotency_key))
+        if response is not None:
+            return response
+        response = await session.scalar(
+            _stored_response_stmt,
+            {"endpoint": endpoint, "idempotency_key": idempotency_key},
+        )
+        if response is not None:
+            self.responses.set((endpoint, idempotency_key), response)
+        return response
+
+    async def claim_key(
+        self, endpoint: str, idempotency_key: Optional[str], session: AsyncSession
+    ) -> Optional[str]:
+        """
+        Inserts the key ahead of the work, so that a concurrent request with
+        the same key waits on its unique index until this one ends instead
+        of clashing with it on the rows of the work. If a concurrent request
+        committed the key first, the session is rolled back and that
+        request's response JSON is returned; otherwise returns None.
+        """
+        if not idempotency_key:
+            return None
+        session.add(
+            IdempotencyKey(
+                endpoint=endpoint,
+                idempotency_key=idempotency_key,
+                response="",
+                active=True,
+            )
+        )
+        try:
+            await session.flush()
+        except IntegrityError:
+            await session.rollback()
+            stored_response = await self.get_response(
+                endpoint, idempotency_key, session
+            )
+            if stored_response is None:
+                raise
+            _logger.info(f"Concurrent retry of {endpoint} for key {idempotency_key}")
+            return stored_response
+        return None
+
+    async def commit_with_response(
+        self,
+        endpoint: str,
+        idempotency_key: Optional[str],
+        response: BaseModel,
+        session: AsyncSession,
+    ):
+        """Commits the session together with the response of the claimed key."""
+        if not idempotency_key:
+            await session.commit()
+            return
+
+        response_json = response.model_dump_json()
+        await session.execute(
+            _store_response_stmt,
+            {
+                "key_endpoint": endpoint,
+                "key_idempotency_key": idempotency_key,
+                "key_response": response_json,
+            },
+        )
+        await session.commit()
+        self.responses.set((endpoint, idempotency_key), response_json)
@@ -0,0 +1,37 @@
+import codecs
+import json
+from typing import AsyncIterable, AsyncIterator
+
+_decoder = json.JSONDecoder()
+_SEPARATORS = " \t\r\n,[]"
+
+
+async def iter_json_objects(chunks: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+    """
+    Yields JSON values one at a time from a streamed request body.
+
+    Accepts NDJSON (one value per line) as well as a single JSON array of
+    values, so only the value currently being parsed is held in memory.
+    Raises ValueError if the body is not valid JSON.
+    """
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += utf8_decoder.decode(chunk)
+        while True:
+            buffer = buffer.lstrip(_SEPARATORS)
+            if not buffer:
+                break
+            try:
+                value, end = _decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # The value is split across chunks; wait for the rest of it
+                break
+            yield value
+            buffer = buffer[end:]
+
+    buffer = (buffer + utf8_decoder.decode(b"", final=True)).lstrip(_SEPARATORS)
+    while buffer:
+        value, end = _decoder.raw_decode(buffer)
+        yield value
+        buffer = buffer[end:].lstrip(_SEPARATORS)
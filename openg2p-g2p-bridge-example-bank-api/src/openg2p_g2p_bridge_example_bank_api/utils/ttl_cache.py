@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries also expire ttl_seconds after they
+    were set. Not thread safe; meant for use from the event loop.
+
+    A value read from the source while the key is invalidated must not be
+    cached, so readers take generation() before the read and cache the value
+    with set_if_unchanged.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        # Generation of the latest pop of each recently popped key. Older pops
+        # are forgotten to keep it bounded; _forgotten is the newest of them
+        self._generation = 0
+        self._popped: OrderedDict = OrderedDict()
+        self._forgotten = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def generation(self) -> int:
+        return self._generation
+
+    def set_if_unchanged(self, key: Hashable, value: Any, generation: int):
+        """Sets the value unless the key was popped since generation()."""
+        if generation < self._forgotten or self._popped.get(key, 0) > generation:
+            return
+        self.set(key, value)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+        self._generation += 1
+        self._popped[key] = self._generation
+        self._popped.move_to_end(key)
+        while len(self._popped) > self.max_size:
+            _, self._forgotten = self._popped.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self._generation += 1
+        self._popped.clear()
+        self._forgotten = self._generation
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
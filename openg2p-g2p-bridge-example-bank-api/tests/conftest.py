@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+# Keep the account caches in-process; tests do not run a Redis server
+os.environ.setdefault("EXAMPLE_BANK_ACCOUNT_UPDATES_REDIS_URL", "")
+
+from openg2p_fastapi_common.context import dbengine  # noqa: E402
+from openg2p_g2p_bridge_example_bank_api.utils import (  # noqa: E402
+    AccountCache,
+    BalanceSnapshot,
+    IdempotencyStore,
+)
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+
+AccountCache()
+BalanceSnapshot()
+IdempotencyStore()
+
+
+@pytest.fixture
+def bank_engine(bank_database):
+    """Async engine of the bank database, used by the controllers."""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{bank_database}",
+        connect_args={"timeout": 30},
+    )
+    dbengine.set(engine)
+    yield engine
+    dbengine.set(None)
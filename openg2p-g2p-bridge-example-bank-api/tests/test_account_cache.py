@@ -0,0 +1,168 @@
+import asyncio
+
+import fakeredis
+import pytest
+from openg2p_g2p_bridge_example_bank_api.controllers import USSDController
+from openg2p_g2p_bridge_example_bank_api.utils import (
+    AccountCache,
+    TTLCache,
+    account_cache,
+    get_session_maker,
+    ttl_cache,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(ttl_cache.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(max_size=10, ttl_seconds=30)
+    cache.set("1001", 500)
+
+    clock[0] = 29.9
+    fresh = cache.get("1001")
+    clock[0] = 30
+    expired = cache.get("1001")
+
+    assert fresh == 500
+    assert expired is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(max_size=2, ttl_seconds=30)
+    cache.set("1001", 1)
+    cache.set("1002", 2)
+    cache.get("1001")
+    cache.set("1003", 3)
+
+    assert len(cache) == 2
+    assert [cache.get(key) for key in ["1001", "1002", "1003"]] == [1, None, 3]
+
+
+def test_value_read_during_invalidation_is_not_cached():
+    cache = TTLCache(max_size=2, ttl_seconds=30)
+    generation = cache.generation()
+    cache.pop("1001")
+    cache.set_if_unchanged("1001", "stale", generation)
+    cache.set_if_unchanged("1002", "unaffected", generation)
+
+    # Pops forgotten to keep the cache bounded still count
+    generation = cache.generation()
+    for key in ["1001", "1003", "1004"]:
+        cache.pop(key)
+    cache.set_if_unchanged("1001", "stale", generation)
+    cache.set_if_unchanged("1002", "unsure", generation)
+
+    generation = cache.generation()
+    cache.clear()
+    cache.set_if_unchanged("1002", "stale", generation)
+    cache.set_if_unchanged("1002", "fresh", cache.generation())
+
+    assert cache.get("1001") is None
+    assert cache.get("1002") == "fresh"
+
+
+def test_published_updates_invalidate_other_processes(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        account_cache.aioredis,
+        "from_url",
+        lambda *args, **kwargs: fakeredis.aioredis.FakeRedis(server=server),
+    )
+    monkeypatch.setattr(
+        account_cache._config, "account_updates_redis_url", "redis://fake"
+    )
+
+    async def run():
+        listening, publishing = AccountCache(), AccountCache()
+        await listening.start_listener()
+        # Once subscribed, the listener drops what it may have missed
+        while not listening.balances.generation():
+            await asyncio.sleep(0.01)
+        for account_number in ["1001", "1002"]:
+            listening.balances.set(account_number, 500)
+            listening.recent_transactions.set(account_number, [])
+
+        await publishing.publish_account_updates(["1001"])
+        for _ in range(100):
+            if listening.balances.get("1001") is None:
+                break
+            await asyncio.sleep(0.01)
+        cached = (
+            listening.balances.get("1001"),
+            listening.recent_transactions.get("1001"),
+            listening.balances.get("1002"),
+        )
+        await listening.stop_listener()
+        await publishing.stop_listener()
+        return cached
+
+    assert asyncio.run(run()) == (None, None, 500)
+
+
+def ussd_balance(engine, controller, times):
+    async def run():
+        responses = []
+        for _ in range(times):
+            async with get_session_maker()() as session:
+                responses.append(
+                    await controller.ussd(
+                        sessionId="1",
+                        serviceCode="*1#",
+                        phoneNumber="+100",
+                        networkCode="1",
+                        text="1",
+                        session=session,
+                    )
+                )
+        await engine.dispose()
+        return responses
+
+    return asyncio.run(run())
+
+
+def test_cache_stats_count_ussd_lookups(bank_engine):
+    controller = USSDController()
+    controller.account_cache = AccountCache()
+
+    responses = ussd_balance(bank_engine, controller, 2)
+    stats = asyncio.run(controller.get_cache_stats())
+
+    assert (
+        responses
+        == ["END Available balance in account ending with 1001 is $1,000.00"] * 2
+    )
+    assert {
+        name: (cache_stats["size"], cache_stats["hits"], cache_stats["misses"])
+        for name, cache_stats in stats.items()
+    } == {
+        # The phone lookup also caches the balance it read
+        "accounts_by_phone": (1, 1, 1),
+        "balances": (1, 2, 0),
+        "recent_transactions": (0, 0, 0),
+    }
+
+
+def test_balance_invalidated_during_read_is_not_cached(bank_engine):
+    controller = USSDController()
+    controller.account_cache = AccountCache()
+    get_available_balance = controller.get_available_balance
+
+    async def invalidated_during_read(account_number, session):
+        available_balance = await get_available_balance(account_number, session)
+        # A posting is published before the stale balance would be cached
+        controller.account_cache.invalidate_accounts([account_number])
+        return available_balance
+
+    ussd_balance(bank_engine, controller, 1)
+    controller.account_cache.invalidate_accounts(["1001"])
+    controller.get_available_balance = invalidated_during_read
+    ussd_balance(bank_engine, controller, 1)
+
+    assert controller.account_cache.balances.get("1001") is None
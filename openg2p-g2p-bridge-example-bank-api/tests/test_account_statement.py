@@ -0,0 +1,157 @@
+import asyncio
+from datetime import date, datetime
+
+import pytest
+from openg2p_g2p_bridge_example_bank_api.controllers import (
+    AccountStatementController,
+    account_statement,
+)
+from openg2p_g2p_bridge_example_bank_api.utils import get_session_maker
+from openg2p_g2p_bridge_example_bank_models.models import (
+    AccountStatement,
+    AccountStatementStatus,
+)
+from openg2p_g2p_bridge_example_bank_models.schemas import AccountStatementRequest
+
+
+@pytest.fixture
+def sent_tasks(monkeypatch):
+    sent_tasks = []
+    monkeypatch.setattr(
+        account_statement.celery_app,
+        "send_task",
+        lambda name, args=(), **kwargs: sent_tasks.append((name, tuple(args))),
+    )
+    return sent_tasks
+
+
+def request_statements(engine, statement_requests):
+    async def run():
+        controller = AccountStatementController()
+        responses = []
+        for statement_request in statement_requests:
+            async with get_session_maker()() as session:
+                responses.append(
+                    await controller.generate_account_statement(
+                        statement_request, session
+                    )
+                )
+        await engine.dispose()
+        return responses
+
+    return asyncio.run(run())
+
+
+def add_statements(engine, *statements):
+    async def run():
+        async with get_session_maker()() as session:
+            session.add_all(statements)
+            await session.commit()
+        await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_closed_range_statement_is_only_reused_if_requested_after_the_range(
+    bank_engine, sent_tasks
+):
+    range_dates = {"from_date": datetime(2024, 1, 1), "to_date": datetime(2024, 1, 31)}
+    add_statements(
+        bank_engine,
+        # Generated while the range was still open
+        AccountStatement(
+            id=1,
+            account_number="1001",
+            statement_status=AccountStatementStatus.COMPLETED,
+            created_at=datetime(2024, 1, 31, 23, 59),
+            active=True,
+            **range_dates,
+        ),
+    )
+    statement_request = AccountStatementRequest(
+        program_account_number="1001",
+        from_date=date(2024, 1, 1),
+        to_date=date(2024, 1, 31),
+    )
+
+    rebuilt = request_statements(bank_engine, [statement_request])
+    add_statements(
+        bank_engine,
+        AccountStatement(
+            id=3,
+            account_number="1001",
+            statement_status=AccountStatementStatus.COMPLETED,
+            created_at=datetime(2024, 2, 1),
+            active=True,
+            **range_dates,
+        ),
+    )
+    reused = request_statements(bank_engine, [statement_request])
+
+    assert rebuilt[0].account_statement_id == "2"
+    assert reused[0].account_statement_id == "3"
+    assert sent_tasks == [
+        ("account_statement_generator", (2,)),
+        ("account_statement_generator", (3,)),
+    ]
+
+
+def test_statement_requests_coalesce_into_one_pending_statement(
+    bank_engine, sent_tasks
+):
+    async def run():
+        controller = AccountStatementController()
+
+        async def request_statement():
+            async with get_session_maker()() as session:
+                return await controller.generate_account_statement(
+                    AccountStatementRequest(program_account_number="1001"), session
+                )
+
+        coalesced = await asyncio.gather(*[request_statement() for _ in range(10)])
+        # Once generation has claimed it, requests start a follow-up statement
+        async with get_session_maker()() as session:
+            account_statement = await session.get(AccountStatement, 1)
+            account_statement.statement_status = AccountStatementStatus.GENERATING
+            await session.commit()
+        follow_up = await request_statement()
+        await bank_engine.dispose()
+        return coalesced, follow_up
+
+    coalesced, follow_up = asyncio.run(run())
+
+    assert {response.account_statement_id for response in coalesced} == {"1"}
+    assert follow_up.account_statement_id == "2"
+    assert sent_tasks == [
+        ("account_statement_generator", (1,)),
+        ("account_statement_generator", (2,)),
+    ]
+
+
+def test_pending_statement_is_dispatched_again_when_sending_failed(
+    bank_engine, monkeypatch
+):
+    sent_tasks = []
+
+    def send_task(name, args=(), **kwargs):
+        if not sent_tasks:
+            sent_tasks.append(None)
+            raise ConnectionError("Broker unavailable")
+        sent_tasks.append((name, tuple(args)))
+
+    monkeypatch.setattr(account_statement.celery_app, "send_task", send_task)
+    statement_request = AccountStatementRequest(program_account_number="1001")
+
+    with pytest.raises(ConnectionError):
+        request_statements(bank_engine, [statement_request])
+    merged = request_statements(bank_engine, [statement_request])
+    # The statement has now been pending for longer than a generation run
+    # would have taken to claim it
+    monkeypatch.setattr(
+        account_statement._config, "statement_redispatch_after_seconds", -1
+    )
+    dispatched = request_statements(bank_engine, [statement_request])
+
+    assert merged[0].account_statement_id == "1"
+    assert dispatched[0].account_statement_id == "1"
+    assert sent_tasks == [None, ("account_statement_generator", (1,))]
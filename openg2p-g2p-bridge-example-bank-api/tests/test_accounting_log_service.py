@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime
+
+from openg2p_g2p_bridge_example_bank_api.utils import (
+    AccountingLogService,
+    get_session_maker,
+)
+from openg2p_g2p_bridge_example_bank_models.models import (
+    Account,
+    AccountingLog,
+    DebitCreditTypes,
+)
+
+
+def test_recent_postings_by_phone(bank_engine):
+    async def run():
+        service = AccountingLogService()
+        async with get_session_maker()() as session:
+            session.add(
+                Account(
+                    account_holder_name="Idle",
+                    account_number="2001",
+                    account_currency="USD",
+                    account_holder_phone="200",
+                    account_holder_email="idle@example.org",
+                    book_balance=0,
+                    available_balance=0,
+                    blocked_amount=0,
+                    active=True,
+                )
+            )
+            session.add_all(
+                AccountingLog(
+                    reference_no=f"REF-{account_number}-{index}",
+                    customer_reference_no=f"CUST-{index}",
+                    debit_credit=DebitCreditTypes.DEBIT,
+                    account_number=account_number,
+                    transaction_amount=index,
+                    transaction_date=datetime.utcnow(),
+                    transaction_currency="USD",
+                    active=True,
+                )
+                for index in range(5)
+                for account_number in ("1001", "3001")
+            )
+            await session.commit()
+
+            results = [
+                await service.get_recent_postings_by_phone(phone_number, session)
+                for phone_number in ("100", "200", "999")
+            ]
+        await bank_engine.dispose()
+        return results
+
+    (account_number, postings), idle, unknown = asyncio.run(run())
+
+    assert account_number == "1001"
+    assert [posting.reference_no for posting in postings] == [
+        "REF-1001-4",
+        "REF-1001-3",
+        "REF-1001-2",
+    ]
+    # An account without postings is still resolved
+    assert idle == ("2001", [])
+    assert unknown == (None, [])
@@ -0,0 +1,120 @@
+import asyncio
+
+import fakeredis
+import pytest
+from openg2p_g2p_bridge_example_bank_api.controllers import (
+    BlockFundsController,
+    FundAvailabilityController,
+)
+from openg2p_g2p_bridge_example_bank_api.utils import (
+    BalanceSnapshot,
+    balance_snapshot,
+    get_session_maker,
+)
+from openg2p_g2p_bridge_example_bank_models.models import Account
+from openg2p_g2p_bridge_example_bank_models.schemas import (
+    BlockFundsRequest,
+    CheckFundRequest,
+)
+from sqlalchemy import update
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        balance_snapshot.aioredis,
+        "from_url",
+        lambda *args, **kwargs: fakeredis.aioredis.FakeRedis(server=server),
+    )
+    snapshot = BalanceSnapshot.get_component()
+    monkeypatch.setattr(snapshot, "enabled", True)
+    monkeypatch.setattr(snapshot, "_redis", None)
+    return snapshot
+
+
+def test_snapshot_keeps_newest_version(snapshot):
+    async def run():
+        await snapshot.store("1001", "USD", 500, version=3)
+        await snapshot.store("1001", "USD", 900, version=2)
+        newest = await snapshot.get("1001")
+        await snapshot.store("1001", "USD", 400, version=4)
+        return newest, await snapshot.get("1001"), await snapshot.get("1002")
+
+    newest, updated, missing = asyncio.run(run())
+
+    assert newest == {"available_balance": 500, "currency": "USD", "version": 3}
+    assert updated == {"available_balance": 400, "currency": "USD", "version": 4}
+    assert missing is None
+
+
+def test_invalidated_snapshot_only_takes_the_pending_version(snapshot):
+    async def run():
+        await snapshot.store("1001", "USD", 500, version=1)
+        # A writer is about to commit version 2
+        await snapshot.invalidate("1001", version=2)
+        invalidated = await snapshot.get("1001")
+        # A reader that fell back to the database before the commit
+        await snapshot.store("1001", "USD", 500, version=1)
+        stale = await snapshot.get("1001")
+        await snapshot.store("1001", "USD", 200, version=2)
+        committed = await snapshot.get("1001")
+        # An invalidation that lost the race leaves the newer balance alone
+        await snapshot.invalidate("1001", version=2)
+        return invalidated, stale, committed, await snapshot.get("1001")
+
+    invalidated, stale, committed, kept = asyncio.run(run())
+
+    assert invalidated is None
+    assert stale is None
+    assert committed == {"available_balance": 200, "currency": "USD", "version": 2}
+    assert kept == committed
+
+
+def test_block_funds_writes_through_to_check_funds(snapshot, bank_engine):
+    async def run():
+        async with get_session_maker()() as session:
+            await BlockFundsController().block_funds(
+                BlockFundsRequest(account_number="1001", currency="USD", amount=300),
+                session,
+            )
+        stored = await snapshot.get("1001")
+
+        # Served from the snapshot, not from the (now different) database row
+        async with get_session_maker()() as session:
+            await session.execute(update(Account).values(available_balance=0))
+            await session.commit()
+            from_snapshot = await FundAvailabilityController().check_available_funds(
+                CheckFundRequest(
+                    account_number="1001",
+                    account_currency="USD",
+                    total_funds_needed=700,
+                ),
+                session,
+            )
+
+        # Without a snapshot the database is read and the snapshot refilled
+        await snapshot.get_redis().flushall()
+        async with get_session_maker()() as session:
+            from_database = (
+                await FundAvailabilityController().check_available_funds_bulk(
+                    [
+                        CheckFundRequest(
+                            account_number="1001",
+                            account_currency="USD",
+                            total_funds_needed=700,
+                        )
+                    ],
+                    session,
+                )
+            )
+        refilled = await snapshot.get("1001")
+        await bank_engine.dispose()
+        return stored, from_snapshot, from_database, refilled
+
+    stored, from_snapshot, from_database, refilled = asyncio.run(run())
+
+    assert stored == {"available_balance": 700, "currency": "USD", "version": 1}
+    assert from_snapshot.has_sufficient_funds is True
+    assert from_database[0].has_sufficient_funds is False
+    assert refilled == {"available_balance": 0, "currency": "USD", "version": 1}
@@ -0,0 +1,86 @@
+import asyncio
+
+from openg2p_g2p_bridge_example_bank_api.controllers import BlockFundsController
+from openg2p_g2p_bridge_example_bank_api.utils import get_session_maker
+from openg2p_g2p_bridge_example_bank_models.models import Account, FundBlock
+from openg2p_g2p_bridge_example_bank_models.schemas import BlockFundsRequest
+from sqlalchemy import func, select
+
+
+def test_concurrent_block_funds_do_not_overdraw(bank_engine):
+    async def run():
+        controller = BlockFundsController()
+
+        async def block_funds():
+            async with get_session_maker()() as session:
+                return await controller.block_funds(
+                    BlockFundsRequest(account_number="1001", currency="USD", amount=30),
+                    session,
+                )
+
+        responses = await asyncio.gather(*[block_funds() for _ in range(50)])
+
+        async with get_session_maker()() as session:
+            account = await session.scalar(select(Account))
+            fund_block_count = await session.scalar(select(func.count(FundBlock.id)))
+        await bank_engine.dispose()
+        return responses, account, fund_block_count
+
+    responses, account, fund_block_count = asyncio.run(run())
+
+    successes = [response for response in responses if response.status == "success"]
+    failures = [response for response in responses if response.status == "failed"]
+    assert len(successes) == 33
+    assert {response.error_message for response in failures} == {"Insufficient funds"}
+    assert fund_block_count == 33
+    assert account.blocked_amount == 990
+    assert account.available_balance == 10
+    assert account.book_balance == 1000
+
+
+def test_block_funds_unknown_account(bank_engine):
+    async def run():
+        async with get_session_maker()() as session:
+            response = await BlockFundsController().block_funds(
+                BlockFundsRequest(account_number="1001", currency="EUR", amount=30),
+                session,
+            )
+        await bank_engine.dispose()
+        return response
+
+    response = asyncio.run(run())
+
+    assert response.status == "failed"
+    assert response.error_message == "Account not found"
+
+
+def test_block_funds_retry_with_idempotency_key(bank_engine):
+    async def run():
+        controller = BlockFundsController()
+
+        async def block_funds():
+            async with get_session_maker()() as session:
+                return await controller.block_funds(
+                    BlockFundsRequest(account_number="1001", currency="USD", amount=30),
+                    session,
+                    idempotency_key="retry-1",
+                )
+
+        # Concurrent retries race each other to store their response
+        first, *retries = await asyncio.gather(*[block_funds() for _ in range(5)])
+        # A later retry is served from the database, not from memory
+        controller.idempotency_store.responses.clear()
+        retries.append(await block_funds())
+
+        async with get_session_maker()() as session:
+            account = await session.scalar(select(Account))
+            fund_block_count = await session.scalar(select(func.count(FundBlock.id)))
+        await bank_engine.dispose()
+        return first, retries, account, fund_block_count
+
+    first, retries, account, fund_block_count = asyncio.run(run())
+
+    assert first.status == "success"
+    assert all(retry == first for retry in retries)
+    assert fund_block_count == 1
+    assert account.available_balance == 970
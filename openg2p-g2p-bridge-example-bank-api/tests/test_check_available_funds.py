@@ -0,0 +1,86 @@
+import asyncio
+
+from openg2p_g2p_bridge_example_bank_api.controllers import FundAvailabilityController
+from openg2p_g2p_bridge_example_bank_api.utils import get_session_maker
+from openg2p_g2p_bridge_example_bank_models.models import Account
+from openg2p_g2p_bridge_example_bank_models.schemas import CheckFundRequest
+from sqlalchemy import event
+
+
+def check_funds_bulk(engine, requests):
+    """Returns the responses and the SQL statements run to build them."""
+    statements = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    async def run():
+        async with get_session_maker()() as session:
+            session.add(
+                Account(
+                    account_holder_name="Beneficiary",
+                    account_number="2001",
+                    account_currency="EUR",
+                    book_balance=50,
+                    available_balance=50,
+                    blocked_amount=0,
+                    account_holder_phone="200",
+                    account_holder_email="beneficiary@example.org",
+                    active=True,
+                )
+            )
+            await session.commit()
+        event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+        async with get_session_maker()() as session:
+            responses = await FundAvailabilityController().check_available_funds_bulk(
+                requests, session
+            )
+        event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+        await engine.dispose()
+        return responses
+
+    return asyncio.run(run()), statements
+
+
+def test_bulk_check_reads_all_accounts_in_one_query(bank_engine):
+    responses, statements = check_funds_bulk(
+        bank_engine,
+        [
+            CheckFundRequest(
+                account_number="1001", account_currency="USD", total_funds_needed=1000
+            ),
+            CheckFundRequest(
+                account_number="2001", account_currency="EUR", total_funds_needed=60
+            ),
+            # The account exists, but not in this currency
+            CheckFundRequest(
+                account_number="1001", account_currency="EUR", total_funds_needed=1
+            ),
+            CheckFundRequest(
+                account_number="3001", account_currency="USD", total_funds_needed=1
+            ),
+            CheckFundRequest(
+                account_number="2001", account_currency="EUR", total_funds_needed=50
+            ),
+        ],
+    )
+
+    assert [
+        (response.account_number, response.status, response.error_message)
+        for response in responses
+    ] == [
+        ("1001", "success", ""),
+        ("2001", "failed", "Insufficient funds"),
+        ("1001", "failed", "Account not found"),
+        ("3001", "failed", "Account not found"),
+        ("2001", "success", ""),
+    ]
+    assert [response.has_sufficient_funds for response in responses] == [
+        True,
+        False,
+        False,
+        False,
+        True,
+    ]
+    assert len(statements) == 1
+    assert " IN " in statements[0]
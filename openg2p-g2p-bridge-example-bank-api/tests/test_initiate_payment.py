@@ -0,0 +1,298 @@
+import asyncio
+import json
+
+import pytest
+from openg2p_g2p_bridge_example_bank_api.controllers import (
+    PaymentController,
+    initiate_payment,
+)
+from openg2p_g2p_bridge_example_bank_api.utils import get_session_maker
+from openg2p_g2p_bridge_example_bank_models.models import (
+    FundBlock,
+    InitiatePaymentBatchRequest,
+    InitiatePaymentRequest,
+)
+from openg2p_g2p_bridge_example_bank_models.schemas import InitiatePaymentPayload
+from sqlalchemy import func, select
+
+
+def make_payload(reference, amount, currency="USD", block="FB-1"):
+    return InitiatePaymentPayload(
+        payment_reference_number=reference,
+        remitting_account="1001",
+        remitting_account_currency=currency,
+        payment_amount=amount,
+        funds_blocked_reference_number=block,
+        beneficiary_name="Beneficiary",
+        beneficiary_account="2001",
+        beneficiary_account_currency="USD",
+        beneficiary_account_type="BANK_ACCOUNT",
+        beneficiary_bank_code="EXAMPLE_BANK",
+        beneficiary_branch_code="001",
+        payment_date="2024-01-01",
+    )
+
+
+class StreamRequest:
+    """Stands in for a request whose body arrives in these chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+@pytest.fixture
+def payments(bank_engine, monkeypatch):
+    """Fund block FB-1 of 100 USD, ingested two payloads at a time."""
+    monkeypatch.setattr(initiate_payment._config, "payment_ingest_chunk_size", 2)
+    monkeypatch.setattr(
+        initiate_payment.celery_app, "send_task", lambda *args, **kwargs: None
+    )
+
+    async def seed():
+        async with get_session_maker()() as session:
+            session.add(
+                FundBlock(
+                    block_reference_no="FB-1",
+                    account_number="1001",
+                    currency="USD",
+                    amount=100,
+                    amount_released=0,
+                    active=True,
+                )
+            )
+            await session.commit()
+
+    asyncio.run(seed())
+    return bank_engine
+
+
+def initiate(engine, *requests, stream=False):
+    """Initiates a batch per request; returns the responses and stored counts."""
+
+    async def run():
+        controller = PaymentController()
+        responses = []
+        for request in requests:
+            async with get_session_maker()() as session:
+                if stream:
+                    response = await controller.initiate_payment_stream(
+                        StreamRequest(request), session
+                    )
+                else:
+                    response = await controller.initiate_payment(request, session)
+                responses.append(response)
+        async with get_session_maker()() as session:
+            counts = (
+                await session.scalar(
+                    select(func.count(InitiatePaymentBatchRequest.id))
+                ),
+                await session.scalar(select(func.count(InitiatePaymentRequest.id))),
+            )
+        await engine.dispose()
+        return responses, counts
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "amounts, status",
+    [
+        # Split over chunks, together exactly the blocked amount
+        ([40, 30, 20, 10], "success"),
+        # Each fits the block, together they exceed it
+        ([40, 30, 20, 10.5], "failed"),
+        ([101], "failed"),
+    ],
+)
+def test_fund_block_covers_combined_total(payments, amounts, status):
+    (response,), counts = initiate(
+        payments,
+        [make_payload(f"P-{index}", amount) for index, amount in enumerate(amounts)],
+    )
+
+    assert response.status == status
+    assert counts == ((1, len(amounts)) if status == "success" else (0, 0))
+
+
+def test_fund_block_must_exist_in_payment_currency(payments):
+    responses, counts = initiate(
+        payments,
+        [make_payload("P-1", 10, currency="EUR")],
+        [make_payload("P-2", 10, block="FB-2")],
+    )
+
+    assert [response.status for response in responses] == ["failed", "failed"]
+    assert counts == (0, 0)
+
+
+def test_duplicate_references_are_skipped_and_reported(payments):
+    responses, counts = initiate(
+        payments,
+        [make_payload("P-1", 10), make_payload("P-2", 10)],
+        # Repeats a stored reference, and one within the request across chunks
+        [
+            make_payload("P-2", 10),
+            make_payload("P-3", 10),
+            make_payload("P-4", 10),
+            make_payload("P-3", 10),
+        ],
+        [make_payload("P-1", 10)],
+    )
+
+    assert [response.status for response in responses] == [
+        "success",
+        "success",
+        "failed",
+    ]
+    assert responses[1].duplicate_payment_reference_numbers == ["P-2", "P-3"]
+    assert responses[2].error_message == "All payment reference numbers are duplicates"
+    assert responses[2].duplicate_payment_reference_numbers == ["P-1"]
+    assert counts == (2, 4)
+
+
+def test_stream_ingests_values_split_across_chunks(payments):
+    body = "\n".join(
+        make_payload(f"P-{index}", 10).model_dump_json() for index in range(5)
+    ).encode()
+
+    responses, counts = initiate(
+        payments,
+        [body[start : start + 7] for start in range(0, len(body), 7)],
+        [b'[{"payment_reference_number": "P-9",', b" ]"],
+        [json.dumps([make_payload("P-9", 10).model_dump()]).encode()[:-3]],
+        stream=True,
+    )
+
+    assert responses[0].status == "success"
+    assert [response.status for response in responses[1:]] == ["failed", "failed"]
+    assert all(
+        response.error_message.startswith("Invalid payment payload")
+        for response in responses[1:]
+    )
+    assert counts == (1, 5)
+
+
+@pytest.mark.parametrize(
+    "dispatch_on_initiate, fail_commit, dispatched",
+    [(True, False, True), (True, True, False), (False, False, False)],
+)
+def test_batch_is_dispatched_only_after_commit(
+    payments, monkeypatch, dispatch_on_initiate, fail_commit, dispatched
+):
+    monkeypatch.setattr(
+        initiate_payment._config, "payment_dispatch_on_initiate", dispatch_on_initiate
+    )
+    events = []
+
+    async def run():
+        async with get_session_maker()() as session:
+            commit = session.commit
+
+            async def record_commit():
+                if fail_commit:
+                    raise ConnectionError("Database unavailable")
+                await commit()
+                events.append("commit")
+
+            session.commit = record_commit
+            try:
+                await PaymentController().initiate_payment(
+                    [make_payload("P-1", 10)], session
+                )
+            except ConnectionError:
+                events.append("failed")
+        await payments.dispose()
+
+    monkeypatch.setattr(
+        initiate_payment.celery_app,
+        "send_task",
+        lambda name, args=(), **kwargs: events.append((name, tuple(args))),
+    )
+    asyncio.run(run())
+
+    if dispatched:
+        assert events[0] == "commit"
+        assert [event[0] for event in events[1:]] == ["process_payments_worker"]
+    else:
+        assert events == ["failed" if fail_commit else "commit"]
+
+
+def test_concurrent_retries_with_idempotency_key(payments):
+    async def run():
+        controller = PaymentController()
+
+        async def initiate_batch():
+            async with get_session_maker()() as session:
+                return await controller.initiate_payment(
+                    [make_payload(f"P-{index}", 10) for index in range(5)],
+                    session,
+                    idempotency_key="retry-1",
+                )
+
+        # The retries wait on the key of the first request while it ingests
+        responses = await asyncio.gather(*[initiate_batch() for _ in range(5)])
+        async with get_session_maker()() as session:
+            counts = (
+                await session.scalar(
+                    select(func.count(InitiatePaymentBatchRequest.id))
+                ),
+                await session.scalar(select(func.count(InitiatePaymentRequest.id))),
+            )
+        await payments.dispose()
+        return responses, counts
+
+    responses, counts = asyncio.run(run())
+
+    assert responses[0].status == "success"
+    assert responses[0].duplicate_payment_reference_numbers == []
+    assert all(response == responses[0] for response in responses)
+    assert counts == (1, 5)
+
+
+def test_references_stored_concurrently_are_rejected(payments):
+    # A concurrent request stores P-1 after this one looked its chunk up
+    initiate(payments, [make_payload("P-1", 60)])
+    controller = PaymentController()
+    remove_duplicate_payments = controller.remove_duplicate_payments
+    lookups = []
+
+    async def lookup_before_concurrent_request(
+        initiate_payment_payloads, payment_references, *args
+    ):
+        lookups.append(len(initiate_payment_payloads))
+        if len(lookups) > 1:
+            return await remove_duplicate_payments(
+                initiate_payment_payloads, payment_references, *args
+            )
+        payment_references.update(
+            initiate_payment_payload.payment_reference_number
+            for initiate_payment_payload in initiate_payment_payloads
+        )
+        return initiate_payment_payloads
+
+    controller.remove_duplicate_payments = lookup_before_concurrent_request
+
+    async def run():
+        async with get_session_maker()() as session:
+            response = await controller.initiate_payment(
+                [make_payload("P-1", 60), make_payload("P-2", 40)], session
+            )
+        async with get_session_maker()() as session:
+            references = set(
+                await session.scalars(
+                    select(InitiatePaymentRequest.payment_reference_number)
+                )
+            )
+        await payments.dispose()
+        return response, references
+
+    response, references = asyncio.run(run())
+
+    assert lookups == [2, 2]
+    assert response.status == "success"
+    assert response.duplicate_payment_reference_numbers == ["P-1"]
+    assert references == {"P-1", "P-2"}
@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+import pytest
+from openg2p_g2p_bridge_example_bank_api.utils import iter_json_objects
+
+VALUES = [{"id": 1, "name": "Zoë"}, {"id": 2, "tags": ["a", "b"]}, {"id": 3}]
+
+
+async def chunked(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start : start + size]
+
+
+def parse(body: bytes, size: int):
+    async def run():
+        return [value async for value in iter_json_objects(chunked(body, size))]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 1024])
+@pytest.mark.parametrize(
+    "body",
+    [
+        "\n".join(json.dumps(value) for value in VALUES) + "\n",
+        json.dumps(VALUES, indent=2),
+        json.dumps(VALUES, ensure_ascii=False),
+    ],
+)
+def test_values_split_across_chunks(body, size):
+    # Chunks of one byte also split the multibyte character
+    assert parse(body.encode(), size) == VALUES
+
+
+def test_empty_body():
+    assert parse(b"", 1) == []
+    assert parse(b" \n[]\n", 1) == []
+
+
+@pytest.mark.parametrize(
+    "body", [b'{"id": 1}\n{"id": 2', b'{"id": 1}\n{"id": }', b'[{"id": 1}, oops]']
+)
+def test_malformed_body(body):
+    with pytest.raises(ValueError):
+        parse(body, 3)
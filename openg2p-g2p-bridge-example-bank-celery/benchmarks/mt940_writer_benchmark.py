@@ -0,0 +1,74 @@
+"""
+Measures how fast Mt940Writer formats statement lines.
+
+    python benchmarks/mt940_writer_benchmark.py --transactions 1000000
+"""
+
+import argparse
+import io
+import os
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from openg2p_g2p_bridge_example_bank_celery.utils import Mt940Writer, TransactionType
+
+
+def build_transactions(mt940_writer, count):
+    start = datetime(2024, 1, 1)
+    return [
+        mt940_writer.create_transaction(
+            start + timedelta(seconds=index * 7),
+            start + timedelta(seconds=index * 7),
+            "D" if index % 3 else "C",
+            Decimal(index % 100000) / 100,
+            TransactionType.transfer,
+            f"DISB{index:010d}",
+            f"REF{index:013d}",
+            "",
+            "",
+            f"DISB{index:010d}\nBEN{index:010d}\nPRG\nCYCLE1\nNone\nNone",
+        )
+        for index in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument(
+        "--output",
+        choices=["memory", "file"],
+        default="memory",
+        help="write into a StringIO or into os.devnull",
+    )
+    args = parser.parse_args()
+
+    mt940_writer = Mt940Writer()
+    transactions = build_transactions(mt940_writer, args.transactions)
+    balance = mt940_writer.create_balance(
+        Decimal("100000000"), datetime(2024, 1, 1), "USD"
+    )
+    statement_file = (
+        io.StringIO()
+        if args.output == "memory"
+        else open(os.devnull, "w", encoding="utf-8")
+    )
+
+    started = time.perf_counter()
+    mt940_writer.write_statement_header(statement_file, 1, "1001", "1/1", balance)
+    mt940_writer.write_transactions(statement_file, transactions)
+    mt940_writer.write_statement_footer(statement_file, balance)
+    elapsed = time.perf_counter() - started
+    statement_file.close()
+
+    # Every transaction writes a :61: and a :86: line
+    lines = 2 * args.transactions + 5
+    print(f"transactions: {args.transactions}")
+    print(f"lines:        {lines}")
+    print(f"seconds:      {elapsed:.2f}")
+    print(f"lines/sec:    {lines / elapsed:,.0f}")
+
+
+if __name__ == "__main__":
+    main()
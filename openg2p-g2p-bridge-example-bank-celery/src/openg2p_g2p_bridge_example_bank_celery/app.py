@@ -1,15 +1,17 @@
 # ruff: noqa: E402
 import logging
+import os
 
 from .config import Settings
 
 _config = Settings.get_config()
 
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from openg2p_fastapi_common.app import Initializer as BaseInitializer
 from sqlalchemy import create_engine
 
-from .utils import Mt940Writer
+from .utils import FileSystemStatementStore, Mt940Writer
 
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
@@ -19,10 +21,57 @@ class Initializer(BaseInitializer):
         super().initialize()
 
 
+_engine = None
+_engine_pid = None
+
+
 def get_engine():
-    if _config.db_datasource:
-        db_engine = create_engine(_config.db_datasource)
-        return db_engine
+    """
+    Returns the engine of the current process, creating it on first use.
+
+    Every task shares this one engine. It is owned by a single process, so a
+    prefork child never uses connections inherited from its parent.
+    """
+    global _engine, _engine_pid
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+    if not _config.db_datasource:
+        return None
+    if _engine is not None:
+        # Inherited across a fork; drop the parent's pool without closing
+        # connections the parent is still using
+        _engine.dispose(close=False)
+    _engine = create_engine(
+        _config.db_datasource,
+        echo=_config.db_logging,
+        pool_size=_config.db_pool_size,
+        max_overflow=_config.db_max_overflow,
+        pool_timeout=_config.db_pool_timeout,
+        pool_recycle=_config.db_pool_recycle,
+        pool_pre_ping=_config.db_pool_pre_ping,
+    )
+    _engine_pid = os.getpid()
+    return _engine
+
+
+def dispose_engine():
+    global _engine, _engine_pid
+    if _engine is not None and _engine_pid == os.getpid():
+        _engine.dispose()
+    _engine = None
+    _engine_pid = None
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    get_engine()
+    _logger.info(f"Database engine created for worker process {os.getpid()}")
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    dispose_engine()
+    _logger.info(f"Database engine disposed for worker process {os.getpid()}")
 
 
 celery_app = Celery(
@@ -36,9 +85,14 @@ celery_app.conf.beat_schedule = {
     "process_payments": {
         "task": "process_payments_beat_producer",
         "schedule": _config.process_payment_frequency,
-    }
+    },
+    "deliver_statements": {
+        "task": "statement_delivery_worker",
+        "schedule": _config.statement_delivery_frequency,
+    },
 }
 
 celery_app.conf.timezone = "UTC"
-# Initialize the Mt940Writer here
+# Initialize the Mt940Writer and the statement store here
 Mt940Writer()
+FileSystemStatementStore()
@@ -19,11 +19,59 @@ class Settings(BaseSettings):
 
     db_dbname: str = "example_bank_db"
     db_driver: str = "postgresql"
+    db_pool_size: int = 5
+    db_max_overflow: int = 5
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
 
     celery_broker_url: str = "redis://localhost:6379/0"
     celery_backend_url: str = "redis://localhost:6379/0"
 
     process_payment_frequency: int = 3600
     payment_initiate_attempts: int = 3
+    payment_batch_lease_seconds: int = 900
+    payment_net_settlement_enabled: bool = False
+    payment_processing_chunk_size: int = 1000
+    payment_partition_size: int = 10000
+
+    account_updates_redis_url: str = "redis://localhost:6379/0"
+    account_updates_channel: str = "example_bank_account_updates"
+    account_updates_redis_timeout: float = 1
+
+    balance_snapshot_enabled: bool = False
+    # Defaults to the celery broker Redis when empty
+    balance_snapshot_redis_url: str = ""
+    balance_snapshot_ttl_seconds: int = 300
+    balance_snapshot_redis_timeout: float = 1
+
+    # Statement requests for an account within this window are merged
+    statement_debounce_seconds: int = 10
+    # A statement pending for longer than this lost its generation task, which
+    # the next request for the account sends again
+    statement_redispatch_after_seconds: int = 60
+    statement_fetch_batch_size: int = 1000
+    # A statement is split into pages of at most this many transactions and
+    # bytes, generated by up to statement_page_workers threads
+    statement_page_max_transactions: int = 10000
+    statement_page_max_bytes: int = 4 * 1024 * 1024
+    statement_page_workers: int = 4
+    # Directory of the filesystem statement store, shared by every worker
+    statement_store_path: str = "statement_store"
+    statement_store_compress_level: int = 6
 
     mt940_statement_callback_url: str = "http://localhost:8000/upload_mt940_statement"
+    # Statement pages are uploaded from an outbox, drained every
+    # statement_delivery_frequency seconds and whenever a statement is ready
+    statement_delivery_frequency: int = 30
+    statement_delivery_batch_size: int = 100
+    # Concurrent uploads, each holding a callback and a database connection
+    statement_delivery_pool_size: int = 4
+    statement_delivery_connect_timeout: float = 5
+    statement_delivery_read_timeout: float = 60
+    # Longer than a single upload may take, timeouts included
+    statement_delivery_lease_seconds: int = 300
+    statement_delivery_max_attempts: int = 8
+    statement_delivery_backoff_seconds: int = 30
+    statement_delivery_max_backoff_seconds: int = 3600
+    statement_delivery_gzip: bool = False
@@ -1,2 +1,3 @@
 from .account_statement_generator import account_statement_generator
 from .process_payment import process_payments_beat_producer, process_payments_worker
+from .statement_delivery import statement_delivery_worker
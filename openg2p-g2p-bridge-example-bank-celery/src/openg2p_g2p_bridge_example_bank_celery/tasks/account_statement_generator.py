@@ -1,32 +1,387 @@
 import io
 import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from decimal import Decimal
+from typing import List, NamedTuple
 
-import requests
 from openg2p_g2p_bridge_example_bank_models.models import (
     Account,
+    AccountBalanceCheckpoint,
     AccountingLog,
     AccountStatement,
+    AccountStatementPage,
+    AccountStatementStatus,
     DebitCreditTypes,
 )
-from sqlalchemy import select
+from openg2p_g2p_bridge_example_bank_models.utils import (
+    get_or_create_pending_statement,
+)
+from sqlalchemy import (
+    Integer,
+    bindparam,
+    case,
+    func,
+    insert,
+    or_,
+    select,
+    text,
+    update,
+)
 from sqlalchemy.orm import sessionmaker
 
 from ..app import celery_app, get_engine
 from ..config import Settings
-from ..utils import Mt940Writer, TransactionType
+from ..utils import Mt940Writer, StatementStore, TransactionType
+from .statement_delivery import enqueue_statement_delivery, request_statement_delivery
 
 _config = Settings.get_config()
-_engine = get_engine()
 
 
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
+# A statement either reports every posting not reported yet, or re-reports
+# the postings of a date range, found through the (account_number,
+# transaction_date) index
+_unreported_criteria = (
+    AccountingLog.account_number == bindparam("account_number"),
+    AccountingLog.reported_in_mt940.is_(False),
+)
+_date_range_criteria = (
+    AccountingLog.account_number == bindparam("account_number"),
+    AccountingLog.transaction_date >= bindparam("from_date"),
+    AccountingLog.transaction_date < bindparam("before_date"),
+)
+_signed_amount = case(
+    (
+        AccountingLog.debit_credit == DebitCreditTypes.DEBIT,
+        -AccountingLog.transaction_amount,
+    ),
+    else_=AccountingLog.transaction_amount,
+)
+
+
+def _statement_logs_stmt(criteria):
+    return (
+        select(
+            AccountingLog.id,
+            AccountingLog.reference_no,
+            AccountingLog.customer_reference_no,
+            AccountingLog.debit_credit,
+            AccountingLog.transaction_amount,
+            AccountingLog.transaction_date,
+            AccountingLog.narrative_1,
+            AccountingLog.narrative_2,
+            AccountingLog.narrative_3,
+            AccountingLog.narrative_4,
+            AccountingLog.narrative_5,
+            AccountingLog.narrative_6,
+        )
+        .where(
+            *criteria,
+            AccountingLog.id.between(
+                bindparam("first_log_id"), bindparam("last_log_id")
+            ),
+        )
+        .order_by(AccountingLog.id)
+    )
+
+
+def _chunk_plan_stmt(criteria):
+    """
+    Splits the postings into id ranges of at most page_size postings,
+    without reading the postings themselves.
+    """
+    numbered_logs = (
+        select(
+            AccountingLog.id,
+            (
+                (func.row_number(type_=Integer).over(order_by=AccountingLog.id) - 1)
+                // bindparam("page_size", type_=Integer)
+            ).label("chunk_number"),
+        )
+        .where(*criteria)
+        .subquery()
+    )
+    return (
+        select(
+            func.min(numbered_logs.c.id).label("first_log_id"),
+            func.max(numbered_logs.c.id).label("last_log_id"),
+        )
+        .group_by(numbered_logs.c.chunk_number)
+        .order_by(numbered_logs.c.chunk_number)
+    )
+
+
+_unreported_logs_stmt = _statement_logs_stmt(_unreported_criteria)
+_unreported_chunk_plan_stmt = _chunk_plan_stmt(_unreported_criteria)
+_date_range_logs_stmt = _statement_logs_stmt(_date_range_criteria)
+_date_range_chunk_plan_stmt = _chunk_plan_stmt(_date_range_criteria)
+_latest_checkpoint_stmt = (
+    select(AccountBalanceCheckpoint.last_log_id, AccountBalanceCheckpoint.balance)
+    .where(AccountBalanceCheckpoint.account_number == bindparam("account_number"))
+    .order_by(AccountBalanceCheckpoint.last_log_id.desc())
+    .limit(1)
+)
+_net_amount_between_stmt = select(func.coalesce(func.sum(_signed_amount), 0)).where(
+    AccountingLog.account_number == bindparam("account_number"),
+    AccountingLog.id > bindparam("after_log_id"),
+    AccountingLog.id < bindparam("before_log_id"),
+)
+# Book balance less every posting from first_log_id on, read in one statement
+# so that both come from the same snapshot
+_balance_before_stmt = select(
+    Account.book_balance
+    - select(func.coalesce(func.sum(_signed_amount), 0))
+    .where(
+        AccountingLog.account_number == Account.account_number,
+        AccountingLog.id >= bindparam("first_log_id"),
+    )
+    .scalar_subquery()
+).where(Account.account_number == bindparam("account_number"))
+# Same, for the balance at the start of a date
+_balance_before_date_stmt = select(
+    Account.book_balance
+    - select(func.coalesce(func.sum(_signed_amount), 0))
+    .where(
+        AccountingLog.account_number == Account.account_number,
+        AccountingLog.transaction_date >= bindparam("from_date"),
+    )
+    .scalar_subquery()
+).where(Account.account_number == bindparam("account_number"))
+# Statements created before statement_status existed have none
+_claim_statement_stmt = (
+    update(AccountStatement)
+    .where(
+        AccountStatement.id == bindparam("claim_statement_id"),
+        or_(
+            AccountStatement.statement_status == AccountStatementStatus.PENDING,
+            AccountStatement.statement_status.is_(None),
+        ),
+    )
+    .values(statement_status=AccountStatementStatus.GENERATING)
+    .execution_options(synchronize_session=False)
+)
+_mark_reported_stmt = (
+    update(AccountingLog)
+    .where(
+        AccountingLog.account_number == bindparam("log_account_number"),
+        AccountingLog.reported_in_mt940.is_(False),
+        AccountingLog.id.between(bindparam("first_log_id"), bindparam("last_log_id")),
+    )
+    .values(reported_in_mt940=True)
+)
+
+# Namespace of the per-account advisory locks taken by statement runs
+_STATEMENT_LOCK_NAMESPACE = 940
+
+# Room left on every page for its header and closing balance lines
+_PAGE_ENVELOPE_BYTES = 256
+
+
+class _PageBody(NamedTuple):
+    # Transaction lines, kept on disk so that a statement never has to fit
+    # in memory
+    file: tempfile.TemporaryFile
+    transaction_count: int
+    # Relative to the opening balance of the chunk the page belongs to
+    opening_offset: Decimal
+    closing_offset: Decimal
+
+
+class _PageReader:
+    """Reads a page's header, transaction lines and footer as one file."""
+
+    def __init__(self, header: str, body_file, footer: str):
+        self.parts = [io.StringIO(header), body_file, io.StringIO(footer)]
+
+    def read(self, size: int) -> str:
+        while self.parts:
+            chunk = self.parts[0].read(size)
+            if chunk:
+                return chunk
+            self.parts.pop(0)
+        return ""
+
+
+def _statement_transaction(mt940_writer, account_log):
+    transaction_debit_credit = account_log.debit_credit
+    if account_log.debit_credit == DebitCreditTypes.DEBIT:
+        transaction_debit_credit = "D"
+    if account_log.debit_credit == DebitCreditTypes.CREDIT:
+        transaction_debit_credit = "C"
+    if (
+        account_log.debit_credit == DebitCreditTypes.DEBIT
+        and account_log.transaction_amount < 0
+    ):
+        transaction_debit_credit = "RD"
+    if (
+        account_log.debit_credit == DebitCreditTypes.CREDIT
+        and account_log.transaction_amount < 0
+    ):
+        transaction_debit_credit = "RC"
+
+    return mt940_writer.create_transaction(
+        account_log.transaction_date,
+        account_log.transaction_date,
+        transaction_debit_credit,
+        Decimal(abs(account_log.transaction_amount)),
+        TransactionType.transfer,
+        account_log.customer_reference_no,
+        account_log.reference_no[:16],
+        "",
+        "",
+        f"{account_log.narrative_1}\n{account_log.narrative_2}"
+        f"\n{account_log.narrative_3}\n{account_log.narrative_4}"
+        f"\n{account_log.narrative_5}\n{account_log.narrative_6}",
+    )
+
+
+def _opening_balance(session, account_number, first_log_id) -> Decimal:
+    """
+    Balance of the account just before posting first_log_id. Starts from the
+    latest balance checkpoint and adds only the postings made after it, so
+    the cost grows with the new postings rather than the account's history.
+    An account without checkpoints works back from its book balance.
+    """
+    checkpoint = session.execute(
+        _latest_checkpoint_stmt, {"account_number": account_number}
+    ).first()
+    if checkpoint:
+        net_amount = session.scalar(
+            _net_amount_between_stmt,
+            {
+                "account_number": account_number,
+                "after_log_id": checkpoint.last_log_id,
+                "before_log_id": first_log_id,
+            },
+        )
+        return Decimal(checkpoint.balance) + Decimal(net_amount)
+    return Decimal(
+        session.scalar(
+            _balance_before_stmt,
+            {"account_number": account_number, "first_log_id": first_log_id},
+        )
+    )
+
+
+def _generate_chunk_pages(
+    mt940_writer, logs_stmt, log_params, first_log_id, last_log_id, session
+) -> List[_PageBody]:
+    """
+    Writes the transaction lines of the postings between first_log_id and
+    last_log_id into page bodies, starting a new page whenever the next
+    posting would take the page over statement_page_max_bytes. Balances are
+    kept relative to the chunk's opening, which is only known once the
+    chunks before it are written.
+    """
+    max_body_bytes = _config.statement_page_max_bytes - _PAGE_ENVELOPE_BYTES
+    pages = []
+    page_file = None
+    page_bytes = page_count = 0
+    balance = page_opening = Decimal(0)
+    account_logs = session.execute(
+        logs_stmt.execution_options(yield_per=_config.statement_fetch_batch_size),
+        {**log_params, "first_log_id": first_log_id, "last_log_id": last_log_id},
+    )
+    for account_log in account_logs:
+        lines = mt940_writer.format_transaction_lines(
+            _statement_transaction(mt940_writer, account_log)
+        )
+        line_bytes = len(lines.encode())
+        if page_file is not None and page_bytes + line_bytes > max_body_bytes:
+            pages.append(_PageBody(page_file, page_count, page_opening, balance))
+            page_file = None
+        if page_file is None:
+            page_file = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+            page_bytes = page_count = 0
+            page_opening = balance
+        page_file.write(lines)
+        page_bytes += line_bytes
+        page_count += 1
+        if account_log.debit_credit == DebitCreditTypes.DEBIT:
+            balance -= Decimal(account_log.transaction_amount)
+        else:
+            balance += Decimal(account_log.transaction_amount)
+    if page_file is not None:
+        pages.append(_PageBody(page_file, page_count, page_opening, balance))
+    return pages
+
+
+def _generate_chunk_pages_in_snapshot(snapshot_id, *args) -> List[_PageBody]:
+    """
+    Generates the pages of a chunk in a session of its own that reads the
+    snapshot exported by the statement's transaction, so that chunks can be
+    generated in parallel and still see exactly the same postings.
+    """
+    session_maker = sessionmaker(bind=get_engine())
+    with session_maker() as session:
+        session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        session.execute(
+            text("SET TRANSACTION SNAPSHOT :snapshot_id"),
+            {"snapshot_id": snapshot_id},
+        )
+        return _generate_chunk_pages(*args, session)
+
+
+def request_pending_statement(account_number: str, session) -> int:
+    """
+    Returns the id of the account's pending statement of its unreported
+    postings. If there is none, creates one and schedules its generation
+    after statement_debounce_seconds, so that requests arriving in the
+    meantime are merged into the same statement. A statement pending for
+    longer than statement_redispatch_after_seconds has its generation
+    scheduled again, in case sending the task failed.
+    """
+    account_statement_id, dispatch = get_or_create_pending_statement(
+        session,
+        account_number,
+        timedelta(seconds=_config.statement_redispatch_after_seconds),
+    )
+    if not dispatch:
+        _logger.info(f"Merged into pending account statement {account_statement_id}")
+        return account_statement_id
+
+    _logger.info("Account statement generation task created")
+    celery_app.send_task(
+        "account_statement_generator",
+        args=(account_statement_id,),
+        countdown=_config.statement_debounce_seconds,
+    )
+    return account_statement_id
+
+
+def _lock_account(connection, account_number) -> bool:
+    """
+    Tries to take the account's session-level advisory lock on connection.
+    The lock outlives transactions and is released with the connection if
+    the worker dies. Databases without advisory locks always succeed.
+    """
+    if connection.dialect.name != "postgresql":
+        return True
+    locked = connection.scalar(
+        text("SELECT pg_try_advisory_lock(:namespace, hashtext(:account_number))"),
+        {"namespace": _STATEMENT_LOCK_NAMESPACE, "account_number": account_number},
+    )
+    connection.commit()
+    return locked
+
+
+def _unlock_account(connection, account_number):
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(
+        text("SELECT pg_advisory_unlock(:namespace, hashtext(:account_number))"),
+        {"namespace": _STATEMENT_LOCK_NAMESPACE, "account_number": account_number},
+    )
+    connection.commit()
+
 
 @celery_app.task(name="account_statement_generator")
 def account_statement_generator(account_statement_id: int):
     _logger.info("Generating account statement")
-    session_maker = sessionmaker(bind=_engine, expire_on_commit=False)
+    session_maker = sessionmaker(bind=get_engine(), expire_on_commit=False)
     with session_maker() as session:
         account_statement = (
             session.execute(
@@ -42,106 +397,212 @@ def account_statement_generator(account_statement_id: int):
             _logger.error("Account statement not found")
             return
 
-        account = (
-            session.execute(
-                select(Account).where(
-                    Account.account_number == account_statement.account_number
-                )
+        if account_statement.statement_status == AccountStatementStatus.COMPLETED:
+            # Statements of a closed date range are served again as stored
+            _logger.info("Delivering stored account statement")
+            enqueue_statement_delivery(
+                account_statement_id, account_statement.page_count, session
             )
-            .scalars()
-            .first()
-        )
+            session.commit()
+            request_statement_delivery()
+            return
 
-        if not account:
-            _logger.error("Account not found")
+        if account_statement.from_date is not None:
+            _claim_and_generate_statement(account_statement, session)
             return
 
-        account_logs = (
-            session.execute(
-                select(AccountingLog).where(
-                    AccountingLog.account_number == account_statement.account_number,
-                    AccountingLog.reported_in_mt940.is_(False),
+        # Only one run at a time reports the unreported postings of an
+        # account; this statement waits for the running one to finish
+        with get_engine().connect() as lock_connection:
+            if not _lock_account(lock_connection, account_statement.account_number):
+                _logger.info("Account statement of this account in progress, retrying")
+                celery_app.send_task(
+                    "account_statement_generator",
+                    args=(account_statement_id,),
+                    countdown=_config.statement_debounce_seconds,
                 )
+                return
+            try:
+                _claim_and_generate_statement(account_statement, session)
+            finally:
+                _unlock_account(lock_connection, account_statement.account_number)
+
+
+def _claim_and_generate_statement(account_statement: AccountStatement, session):
+    # Committed on its own, so that new requests start a follow-up statement
+    # instead of merging into this one once its postings are being read
+    claimed = session.execute(
+        _claim_statement_stmt, {"claim_statement_id": account_statement.id}
+    ).rowcount
+    session.commit()
+    if not claimed:
+        _logger.info(f"Account statement {account_statement.id} already generated")
+        return
+
+    try:
+        _generate_statement(account_statement, session)
+    except Exception:
+        session.rollback()
+        account_statement.statement_status = AccountStatementStatus.FAILED
+        session.commit()
+        raise
+
+
+def _generate_statement(account_statement: AccountStatement, session):
+    account_statement_id = account_statement.id
+    if session.get_bind().dialect.name == "postgresql":
+        # The plan, the balances and the marking of the reported postings
+        # all read one snapshot, so a posting committed meanwhile is neither
+        # counted nor marked without being written
+        session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    account = (
+        session.execute(
+            select(Account).where(
+                Account.account_number == account_statement.account_number
             )
-            .scalars()
-            .all()
         )
+        .scalars()
+        .first()
+    )
 
-        if not account_logs:
-            _logger.error("Account logs not found")
-            return
+    if not account:
+        _logger.error("Account not found")
+        account_statement.statement_status = AccountStatementStatus.FAILED
+        session.commit()
+        return
+
+    mt940_writer = Mt940Writer.get_component()
+    statement_store = StatementStore.get_component()
+    currency = account.account_currency
+    statement_date = account_statement.account_statement_date
+    mt940_account = account.account_number
+    is_date_range = account_statement.from_date is not None
+    if is_date_range:
+        logs_stmt = _date_range_logs_stmt
+        chunk_plan_stmt = _date_range_chunk_plan_stmt
+        log_params = {
+            "account_number": account_statement.account_number,
+            "from_date": account_statement.from_date,
+            "before_date": account_statement.to_date + timedelta(days=1),
+        }
+    else:
+        logs_stmt = _unreported_logs_stmt
+        chunk_plan_stmt = _unreported_chunk_plan_stmt
+        log_params = {"account_number": account_statement.account_number}
+
+    chunks = session.execute(
+        chunk_plan_stmt,
+        {**log_params, "page_size": _config.statement_page_max_transactions},
+    ).all()
+    if not chunks:
+        _logger.error("Account logs not found")
+        account_statement.statement_status = AccountStatementStatus.COMPLETED
+        account_statement.page_count = 0
+        session.commit()
+        return
 
-        mt940_writer = Mt940Writer.get_component()
-        currency = account.account_currency
-        statement_date = account_statement.account_statement_date
-        mt940_account = account.account_number
-        mt940_opening_balance = mt940_writer.create_balance(
-            Decimal("100000000"), statement_date, currency
-        )
-        mt940_closing_balance = mt940_writer.create_balance(
-            Decimal(account.book_balance), statement_date, currency
-        )
-
-        transactions = []
-        for account_log in account_logs:
-            transaction_debit_credit = account_log.debit_credit
-            if account_log.debit_credit == DebitCreditTypes.DEBIT:
-                transaction_debit_credit = "D"
-            if account_log.debit_credit == DebitCreditTypes.CREDIT:
-                transaction_debit_credit = "C"
-            if (
-                account_log.debit_credit == DebitCreditTypes.DEBIT
-                and account_log.transaction_amount < 0
-            ):
-                transaction_debit_credit = "RD"
-            if (
-                account_log.debit_credit == DebitCreditTypes.CREDIT
-                and account_log.transaction_amount < 0
-            ):
-                transaction_debit_credit = "RC"
-
-            transactions.append(
-                mt940_writer.create_transaction(
-                    account_log.transaction_date,
-                    account_log.transaction_date,
-                    transaction_debit_credit,
-                    Decimal(abs(account_log.transaction_amount)),
-                    TransactionType.transfer,
-                    account_log.customer_reference_no,
-                    account_log.reference_no[:16],
-                    "",
-                    "",
-                    f"{account_log.narrative_1}\n{account_log.narrative_2}"
-                    f"\n{account_log.narrative_3}\n{account_log.narrative_4}"
-                    f"\n{account_log.narrative_5}\n{account_log.narrative_6}",
+    if is_date_range:
+        opening_balance = Decimal(session.scalar(_balance_before_date_stmt, log_params))
+    else:
+        opening_balance = _opening_balance(
+            session, account_statement.account_number, chunks[0].first_log_id
+        )
+    chunk_args = [
+        (mt940_writer, logs_stmt, log_params, chunk.first_log_id, chunk.last_log_id)
+        for chunk in chunks
+    ]
+    if session.get_bind().dialect.name == "postgresql":
+        # Chunks are generated in parallel, each reading this transaction's
+        # snapshot
+        snapshot_id = session.scalar(text("SELECT pg_export_snapshot()"))
+        with ThreadPoolExecutor(_config.statement_page_workers) as executor:
+            chunk_pages = list(
+                executor.map(
+                    lambda args: _generate_chunk_pages_in_snapshot(snapshot_id, *args),
+                    chunk_args,
                 )
             )
-            # Update the log to indicate that it has been reported in the MT940 statement
-            account_log.reported_in_mt940 = True
+    else:
+        chunk_pages = [_generate_chunk_pages(*args, session) for args in chunk_args]
 
-        statement = mt940_writer.create_statement(
+    # Each chunk opens where the pages written before it closed
+    pages = []
+    chunk_opening = opening_balance
+    for pages_of_chunk in chunk_pages:
+        for page in pages_of_chunk:
+            pages.append(
+                (
+                    page,
+                    chunk_opening + page.opening_offset,
+                    chunk_opening + page.closing_offset,
+                )
+            )
+        if pages_of_chunk:
+            chunk_opening += pages_of_chunk[-1].closing_offset
+    closing_balance = chunk_opening
+
+    for page_number, (page, page_opening, page_closing) in enumerate(pages, start=1):
+        is_last_page = page_number == len(pages)
+        header = io.StringIO()
+        mt940_writer.write_statement_header(
+            header,
             account_statement_id,
             mt940_account,
-            "1/1",
-            mt940_opening_balance,
-            mt940_closing_balance,
-            transactions,
-        )
-        mt940_statement = mt940_writer.format_statement(statement)
-        account_statement.account_statement_lob = str(mt940_statement)
-        _logger.info("Account statement generated successfully")
-        session.commit()
-
-        # Prepare the in-memory file
-        mt940_file = io.StringIO(str(mt940_statement))
+            f"1/{page_number}",
+            mt940_writer.create_balance(page_opening, statement_date, currency),
+            "60F" if page_number == 1 else "60M",
+        )
+        footer = io.StringIO()
+        mt940_writer.write_statement_footer(
+            footer,
+            mt940_writer.create_balance(page_closing, statement_date, currency),
+            "62F" if is_last_page else "62M",
+        )
+        page.file.seek(0)
+        with page.file:
+            stored_page = statement_store.put(
+                _PageReader(header.getvalue(), page.file, footer.getvalue())
+            )
+        session.execute(
+            insert(AccountStatementPage).values(
+                account_statement_id=account_statement_id,
+                page_number=page_number,
+                transaction_count=page.transaction_count,
+                storage_key=stored_page.storage_key,
+                content_size=stored_page.content_size,
+                content_sha256=stored_page.content_sha256,
+                active=True,
+            )
+        )
 
-        # Prepare the files dictionary for the request
-        files = {
-            "statement_file": ("statement.mt940", mt940_file.getvalue(), "text/plain")
-        }
-        try:
-            response = requests.post(_config.mt940_statement_callback_url, files=files)
-            response.raise_for_status()
-            _logger.info("MT940 statement uploaded successfully")
-        except requests.exceptions.RequestException as e:
-            _logger.error(f"Failed to upload MT940 statement: {e}")
+    if not is_date_range:
+        # Marks the reported logs in one statement over the id range read;
+        # it only sees the postings of the snapshot they were read from
+        session.execute(
+            _mark_reported_stmt,
+            {
+                "log_account_number": account_statement.account_number,
+                "first_log_id": chunks[0].first_log_id,
+                "last_log_id": chunks[-1].last_log_id,
+            },
+            execution_options={"synchronize_session": False},
+        )
+        # The next statement opens from here
+        session.add(
+            AccountBalanceCheckpoint(
+                account_number=account_statement.account_number,
+                account_statement_id=account_statement_id,
+                last_log_id=chunks[-1].last_log_id,
+                balance=float(closing_balance),
+                checkpoint_date=statement_date,
+                active=True,
+            )
+        )
+    account_statement.page_count = len(pages)
+    account_statement.statement_status = AccountStatementStatus.COMPLETED
+    # Delivered only once the statement is committed, and retried until the
+    # callback accepts it
+    enqueue_statement_delivery(account_statement_id, len(pages), session)
+    _logger.info(f"Account statement generated successfully in {len(pages)} pages")
+    session.commit()
+    request_statement_delivery()
@@ -1,67 +1,114 @@
 import logging
 import random
 import uuid
-from datetime import datetime
-from typing import List
+from datetime import datetime, timedelta
+from typing import List, Optional
 
+from celery import chord
 from openg2p_g2p_bridge_example_bank_models.models import (
-    Account,
     AccountingLog,
-    AccountStatement,
     DebitCreditTypes,
-    FundBlock,
+    InitiatePaymentBatchPartition,
     InitiatePaymentBatchRequest,
     InitiatePaymentRequest,
     PaymentStatus,
 )
-from sqlalchemy import select
+from sqlalchemy import case, func, literal, select, update
 from sqlalchemy.orm import sessionmaker
 
 from ..app import celery_app, get_engine
 from ..config import Settings
+from ..utils import (
+    BatchLedger,
+    get_balances,
+    invalidate_balance_snapshots,
+    publish_account_updates,
+    store_balance_snapshots,
+)
+from .account_statement_generator import request_pending_statement
 
 _config = Settings.get_config()
-_engine = get_engine()
 _logger = logging.getLogger(_config.logging_default_logger_name)
 
 
+class PaymentBatchLeaseLost(Exception):
+    pass
+
+
 @celery_app.task(name="process_payments_beat_producer")
 def process_payments_beat_producer():
     _logger.info("Processing payments")
-    session_maker = sessionmaker(bind=_engine, expire_on_commit=False)
+    session_maker = sessionmaker(bind=get_engine(), expire_on_commit=False)
     with session_maker() as session:
-        initiate_payment_batch_requests = (
+        now = datetime.utcnow()
+        # Rows claimed by a concurrent producer stay locked and are skipped
+        unleased_payment_batch_requests = (
             session.execute(
-                select(InitiatePaymentBatchRequest).where(
-                    (InitiatePaymentBatchRequest.payment_status.in_(["PENDING"]))
-                    & (
-                        InitiatePaymentBatchRequest.payment_initiate_attempts
-                        < _config.payment_initiate_attempts
-                    )
-                )
+                select(InitiatePaymentBatchRequest)
+                .where(unleased_payment_batch_criteria(now))
+                .with_for_update(skip_locked=True)
             )
             .scalars()
             .all()
         )
 
+        initiate_payment_batch_requests = []
+        for initiate_payment_batch_request in unleased_payment_batch_requests:
+            if (
+                initiate_payment_batch_request.payment_status
+                == PaymentStatus.IN_PROGRESS
+            ):
+                # The previous worker let its lease expire; count it as an attempt
+                _logger.warning(
+                    f"Lease expired for batch: {initiate_payment_batch_request.batch_id}"
+                )
+                initiate_payment_batch_request.payment_initiate_attempts += 1
+                initiate_payment_batch_request.failure_reason = "Lease expired"
+            if (
+                initiate_payment_batch_request.payment_initiate_attempts
+                >= _config.payment_initiate_attempts
+            ):
+                _logger.error(
+                    f"Batch {initiate_payment_batch_request.batch_id} failed after "
+                    f"{initiate_payment_batch_request.payment_initiate_attempts} "
+                    f"attempts: {initiate_payment_batch_request.failure_reason}"
+                )
+                initiate_payment_batch_request.payment_status = PaymentStatus.FAILED
+                initiate_payment_batch_request.lease_token = None
+                initiate_payment_batch_request.lease_expires_at = None
+                continue
+            initiate_payment_batch_requests.append(initiate_payment_batch_request)
+            initiate_payment_batch_request.payment_status = PaymentStatus.IN_PROGRESS
+            initiate_payment_batch_request.lease_token = str(uuid.uuid4())
+            initiate_payment_batch_request.lease_expires_at = now + timedelta(
+                seconds=_config.payment_batch_lease_seconds
+            )
+        session.commit()
+
         for initiate_payment_batch_request in initiate_payment_batch_requests:
             _logger.info(
                 f"Initiating payment processing for batch: {initiate_payment_batch_request.batch_id}"
             )
             celery_app.send_task(
                 "process_payments_worker",
-                args=[initiate_payment_batch_request.batch_id],
+                args=[
+                    initiate_payment_batch_request.batch_id,
+                    initiate_payment_batch_request.lease_token,
+                ],
                 queue="g2p_bridge_celery_worker_tasks",
             )
         _logger.info("Payments processing initiated")
-        session.commit()
 
 
 @celery_app.task(name="process_payments_worker")
-def process_payments_worker(payment_request_batch_id: str):
+def process_payments_worker(
+    payment_request_batch_id: str, lease_token: Optional[str] = None
+):
     _logger.info(f"Processing payments for batch: {payment_request_batch_id}")
-    session_maker = sessionmaker(bind=_engine, expire_on_commit=False)
+    session_maker = sessionmaker(bind=get_engine(), expire_on_commit=False)
     with session_maker() as session:
+        if not lease_token:
+            lease_token = claim_payment_batch(payment_request_batch_id, session)
         initiate_payment_batch_request = (
             session.execute(
                 select(InitiatePaymentBatchRequest).where(
@@ -71,92 +118,456 @@ def process_payments_worker(payment_request_batch_id: str):
             .scalars()
             .first()
         )
+        if (
+            not lease_token
+            or initiate_payment_batch_request.lease_token != lease_token
+            or initiate_payment_batch_request.payment_status
+            != PaymentStatus.IN_PROGRESS
+        ):
+            _logger.info(
+                f"Batch {payment_request_batch_id} is not leased to this worker, skipping"
+            )
+            return
         try:
-            initiate_payment_requests = (
-                session.execute(
-                    select(InitiatePaymentRequest).where(
-                        InitiatePaymentRequest.batch_id == payment_request_batch_id
-                    )
-                )
-                .scalars()
-                .all()
+            partitions = get_payment_batch_partitions(
+                initiate_payment_batch_request, session
             )
-
-            failure_logs = []
-            for initiate_payment_request in initiate_payment_requests:
-                accounting_log_debit: AccountingLog = (
-                    construct_accounting_log_for_debit(initiate_payment_request)
+            pending_partition_ids = [
+                partition.id
+                for partition in partitions
+                if partition.payment_status != PaymentStatus.SUCCESS
+            ]
+            if pending_partition_ids:
+                session.commit()
+                _logger.info(
+                    f"Dispatching {len(pending_partition_ids)} partitions for batch: "
+                    f"{payment_request_batch_id}"
                 )
-                (
-                    credit_account_number,
-                    credit_account_name,
-                    credit_account_phone,
-                    credit_account_email,
-                ) = construct_credit_account_details(initiate_payment_request)
-
-                accounting_log_credit: AccountingLog = (
-                    construct_accounting_log_for_credit(
-                        initiate_payment_request, credit_account_number
-                    )
+                chord(
+                    [
+                        process_payments_partition_worker.si(
+                            payment_request_batch_id, partition_id, lease_token
+                        ).set(queue="g2p_bridge_celery_worker_tasks")
+                        for partition_id in pending_partition_ids
+                    ]
+                )(
+                    process_payments_batch_finalizer.s(
+                        payment_request_batch_id, lease_token
+                    ).set(queue="g2p_bridge_celery_worker_tasks")
                 )
+                return
 
-                remitting_account = update_account_for_debit(
-                    accounting_log_debit.account_number,
-                    initiate_payment_request.payment_amount,
-                    session,
-                )
-                fund_block = update_fund_block(
-                    accounting_log_debit.corresponding_block_reference_no,
-                    initiate_payment_request.payment_amount,
+            if not partitions:
+                process_payment_requests(
+                    payment_request_batch_id,
+                    initiate_payment_batch_request,
+                    lease_token,
                     session,
                 )
+            complete_payment_batch(initiate_payment_batch_request, lease_token, session)
+        except PaymentBatchLeaseLost as e:
+            _logger.error(str(e))
+            session.rollback()
+        except Exception as e:
+            _logger.error(f"Error processing payment: {e}")
+            session.rollback()
+            release_payment_batch(
+                payment_request_batch_id, lease_token, str(e), session
+            )
 
-                credit_account = update_account_for_credit(
-                    credit_account_name,
-                    credit_account_number,
-                    credit_account_phone,
-                    credit_account_email,
-                    initiate_payment_request.beneficiary_account_currency,
-                    initiate_payment_request.payment_amount,
-                    session,
-                )
-                failure_random_number = random.randint(1, 100)
-                if (
-                    failure_random_number <= 30
-                    and initiate_payment_request.beneficiary_bank_code != "EXAMPLE_BANK"
-                ):
-                    failure_logs.append(accounting_log_debit)
-                    failure_logs.append(accounting_log_credit)
-
-                session.add(accounting_log_debit)
-                session.add(accounting_log_credit)
-                session.add(fund_block)
-                session.add(remitting_account)
-                session.add(credit_account)
-
-            # End of loop
-
-            generate_failures(failure_logs, session)
-            initiate_payment_batch_request.payment_initiate_attempts += 1
-            initiate_payment_batch_request.payment_status = PaymentStatus.SUCCESS
-            _logger.info(f"Payments processed for batch: {payment_request_batch_id}")
-            account_statement = AccountStatement(
-                account_number=initiate_payment_requests[0].remitting_account,
-                active=True,
+
+@celery_app.task(name="process_payments_partition_worker")
+def process_payments_partition_worker(
+    payment_request_batch_id: str, partition_id: int, lease_token: str
+):
+    _logger.info(
+        f"Processing partition {partition_id} of batch: {payment_request_batch_id}"
+    )
+    session_maker = sessionmaker(bind=get_engine(), expire_on_commit=False)
+    with session_maker() as session:
+        partition = session.get(InitiatePaymentBatchPartition, partition_id)
+        try:
+            process_payment_requests(
+                payment_request_batch_id,
+                partition,
+                lease_token,
+                session,
+                last_payment_request_id=partition.last_payment_request_id,
             )
-            session.add(account_statement)
+            partition.payment_status = PaymentStatus.SUCCESS
             session.commit()
-            _logger.info("Account statement generation task created")
-            celery_app.send_task(
-                "account_statement_generator",
-                args=(account_statement.id,),
-            )
+            return True
         except Exception as e:
-            _logger.error(f"Error processing payment: {e}")
+            _logger.error(
+                f"Error processing partition {partition_id} of batch: "
+                f"{payment_request_batch_id}: {e}"
+            )
             session.rollback()
-            initiate_payment_batch_request.payment_status = PaymentStatus.PENDING
-            initiate_payment_batch_request.payment_initiate_attempts += 1
-            session.commit()
+            return False
+
+
+@celery_app.task(name="process_payments_batch_finalizer")
+def process_payments_batch_finalizer(
+    partition_results: List[bool], payment_request_batch_id: str, lease_token: str
+):
+    session_maker = sessionmaker(bind=get_engine(), expire_on_commit=False)
+    with session_maker() as session:
+        if not all(partition_results):
+            # Completed partitions keep their status; the retry only redoes the rest
+            _logger.error(f"Partitions failed for batch: {payment_request_batch_id}")
+            release_payment_batch(
+                payment_request_batch_id, lease_token, "Partitions failed", session
+            )
+            return
+
+        initiate_payment_batch_request = (
+            session.execute(
+                select(InitiatePaymentBatchRequest).where(
+                    InitiatePaymentBatchRequest.batch_id == payment_request_batch_id
+                )
+            )
+            .scalars()
+            .first()
+        )
+        try:
+            complete_payment_batch(initiate_payment_batch_request, lease_token, session)
+        except PaymentBatchLeaseLost as e:
+            _logger.error(str(e))
+            session.rollback()
+
+
+def unleased_payment_batch_criteria(now: datetime):
+    """Batches waiting for an attempt, or whose worker let the lease expire."""
+    return (InitiatePaymentBatchRequest.payment_status == PaymentStatus.PENDING) | (
+        (InitiatePaymentBatchRequest.payment_status == PaymentStatus.IN_PROGRESS)
+        & (InitiatePaymentBatchRequest.lease_expires_at < now)
+    )
+
+
+def claimable_payment_batch_criteria(now: datetime):
+    """Unleased batches with an attempt left, counting an expired lease."""
+    return unleased_payment_batch_criteria(now) & (
+        InitiatePaymentBatchRequest.payment_initiate_attempts
+        + case(
+            (
+                InitiatePaymentBatchRequest.payment_status == PaymentStatus.IN_PROGRESS,
+                1,
+            ),
+            else_=0,
+        )
+        < _config.payment_initiate_attempts
+    )
+
+
+def claim_payment_batch(payment_request_batch_id: str, session) -> Optional[str]:
+    """
+    Atomically leases a single claimable batch, for workers dispatched
+    without a lease token. Returns the new token, or None if the batch is
+    already leased, finished or out of attempts.
+    """
+    now = datetime.utcnow()
+    lease_token = str(uuid.uuid4())
+    result = session.execute(
+        update(InitiatePaymentBatchRequest)
+        .where(
+            (InitiatePaymentBatchRequest.batch_id == payment_request_batch_id)
+            & claimable_payment_batch_criteria(now)
+        )
+        .values(
+            payment_initiate_attempts=case(
+                (
+                    InitiatePaymentBatchRequest.payment_status
+                    == PaymentStatus.IN_PROGRESS,
+                    InitiatePaymentBatchRequest.payment_initiate_attempts + 1,
+                ),
+                else_=InitiatePaymentBatchRequest.payment_initiate_attempts,
+            ),
+            payment_status=PaymentStatus.IN_PROGRESS,
+            lease_token=lease_token,
+            lease_expires_at=now
+            + timedelta(seconds=_config.payment_batch_lease_seconds),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return lease_token if result.rowcount else None
+
+
+def renew_payment_batch_lease(payment_request_batch_id: str, lease_token: str, session):
+    result = session.execute(
+        update(InitiatePaymentBatchRequest)
+        .where(
+            (InitiatePaymentBatchRequest.batch_id == payment_request_batch_id)
+            & (InitiatePaymentBatchRequest.lease_token == lease_token)
+            & (InitiatePaymentBatchRequest.payment_status == PaymentStatus.IN_PROGRESS)
+        )
+        .values(
+            lease_expires_at=datetime.utcnow()
+            + timedelta(seconds=_config.payment_batch_lease_seconds)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        raise PaymentBatchLeaseLost(f"Lease lost for batch: {payment_request_batch_id}")
+
+
+def release_payment_batch(
+    payment_request_batch_id: str, lease_token: str, failure_reason: str, session
+):
+    """
+    Hands a failed batch back to the producer for another attempt, or marks
+    it FAILED once it has used up payment_initiate_attempts.
+    """
+    session.execute(
+        update(InitiatePaymentBatchRequest)
+        .where(
+            (InitiatePaymentBatchRequest.batch_id == payment_request_batch_id)
+            & (InitiatePaymentBatchRequest.lease_token == lease_token)
+        )
+        .values(
+            payment_status=case(
+                (
+                    InitiatePaymentBatchRequest.payment_initiate_attempts + 1
+                    >= _config.payment_initiate_attempts,
+                    literal(
+                        PaymentStatus.FAILED,
+                        InitiatePaymentBatchRequest.payment_status.type,
+                    ),
+                ),
+                else_=literal(
+                    PaymentStatus.PENDING,
+                    InitiatePaymentBatchRequest.payment_status.type,
+                ),
+            ),
+            payment_initiate_attempts=InitiatePaymentBatchRequest.payment_initiate_attempts
+            + 1,
+            failure_reason=failure_reason,
+            lease_token=None,
+            lease_expires_at=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+
+def get_payment_batch_partitions(
+    initiate_payment_batch_request: InitiatePaymentBatchRequest, session
+) -> List[InitiatePaymentBatchPartition]:
+    batch_id = initiate_payment_batch_request.batch_id
+    partitions = (
+        session.execute(
+            select(InitiatePaymentBatchPartition)
+            .where(InitiatePaymentBatchPartition.batch_id == batch_id)
+            .order_by(InitiatePaymentBatchPartition.partition_number)
+        )
+        .scalars()
+        .all()
+    )
+    # A batch that already started serially is finished serially
+    if partitions or initiate_payment_batch_request.last_processed_payment_request_id:
+        return partitions
+
+    numbered_requests = (
+        select(
+            InitiatePaymentRequest.id,
+            func.row_number()
+            .over(order_by=InitiatePaymentRequest.id)
+            .label("row_number"),
+        )
+        .where(InitiatePaymentRequest.batch_id == batch_id)
+        .subquery()
+    )
+    first_payment_request_ids = (
+        session.execute(
+            select(numbered_requests.c.id)
+            .where(
+                (numbered_requests.c.row_number - 1) % _config.payment_partition_size
+                == 0
+            )
+            .order_by(numbered_requests.c.id)
+        )
+        .scalars()
+        .all()
+    )
+    if len(first_payment_request_ids) <= 1:
+        return []
+
+    last_payment_request_id = session.execute(
+        select(func.max(InitiatePaymentRequest.id)).where(
+            InitiatePaymentRequest.batch_id == batch_id
+        )
+    ).scalar()
+    partitions = [
+        InitiatePaymentBatchPartition(
+            batch_id=batch_id,
+            partition_number=partition_number,
+            first_payment_request_id=first_payment_request_id,
+            last_payment_request_id=(
+                first_payment_request_ids[partition_number + 1] - 1
+                if partition_number + 1 < len(first_payment_request_ids)
+                else last_payment_request_id
+            ),
+            last_processed_payment_request_id=first_payment_request_id - 1,
+            active=True,
+        )
+        for partition_number, first_payment_request_id in enumerate(
+            first_payment_request_ids
+        )
+    ]
+    session.add_all(partitions)
+    session.flush()
+    return partitions
+
+
+def process_payment_requests(
+    payment_request_batch_id: str,
+    checkpoint,
+    lease_token: str,
+    session,
+    last_payment_request_id: Optional[int] = None,
+):
+    """
+    Posts the payment requests of a batch, or of one partition of it, in
+    committed chunks. checkpoint is the batch or partition row whose
+    last_processed_payment_request_id records the progress.
+    """
+    while True:
+        # Resume after the last chunk committed by a previous attempt
+        query = select(InitiatePaymentRequest).where(
+            (InitiatePaymentRequest.batch_id == payment_request_batch_id)
+            & (InitiatePaymentRequest.id > checkpoint.last_processed_payment_request_id)
+        )
+        if last_payment_request_id is not None:
+            query = query.where(InitiatePaymentRequest.id <= last_payment_request_id)
+        initiate_payment_requests = (
+            session.execute(
+                query.order_by(InitiatePaymentRequest.id).limit(
+                    _config.payment_processing_chunk_size
+                )
+            )
+            .scalars()
+            .all()
+        )
+        if not initiate_payment_requests:
+            return
+
+        ledger = BatchLedger(
+            session, net_settlement=_config.payment_net_settlement_enabled
+        )
+        process_payment_chunk(initiate_payment_requests, ledger)
+        ledger.flush()
+        checkpoint.last_processed_payment_request_id = initiate_payment_requests[-1].id
+        # The chunk only commits while this worker still holds the batch lease
+        renew_payment_batch_lease(payment_request_batch_id, lease_token, session)
+        balances = get_balances(ledger.flushed_account_numbers, session)
+        invalidate_balance_snapshots(balances)
+        session.commit()
+        store_balance_snapshots(balances)
+        publish_account_updates(ledger.flushed_account_numbers)
+        _logger.info(
+            f"Processed {len(initiate_payment_requests)} payments for batch: "
+            f"{payment_request_batch_id} up to payment request id: "
+            f"{checkpoint.last_processed_payment_request_id}"
+        )
+
+
+def complete_payment_batch(
+    initiate_payment_batch_request: InitiatePaymentBatchRequest,
+    lease_token: str,
+    session,
+):
+    renew_payment_batch_lease(
+        initiate_payment_batch_request.batch_id, lease_token, session
+    )
+    remitting_account = session.execute(
+        select(InitiatePaymentRequest.remitting_account)
+        .where(
+            InitiatePaymentRequest.batch_id == initiate_payment_batch_request.batch_id
+        )
+        .order_by(InitiatePaymentRequest.id)
+        .limit(1)
+    ).scalar()
+    initiate_payment_batch_request.payment_initiate_attempts += 1
+    initiate_payment_batch_request.payment_status = PaymentStatus.SUCCESS
+    initiate_payment_batch_request.lease_token = None
+    initiate_payment_batch_request.lease_expires_at = None
+    _logger.info(
+        f"Payments processed for batch: {initiate_payment_batch_request.batch_id}"
+    )
+    session.commit()
+    request_pending_statement(remitting_account, session)
+
+
+def process_payment_chunk(
+    initiate_payment_requests: List[InitiatePaymentRequest], ledger: BatchLedger
+):
+    postings = []
+    for initiate_payment_request in initiate_payment_requests:
+        accounting_log_debit: AccountingLog = construct_accounting_log_for_debit(
+            initiate_payment_request
+        )
+        credit_account_details = construct_credit_account_details(
+            initiate_payment_request
+        )
+        accounting_log_credit: AccountingLog = construct_accounting_log_for_credit(
+            initiate_payment_request, credit_account_details[0]
+        )
+        postings.append(
+            (
+                initiate_payment_request,
+                accounting_log_debit,
+                credit_account_details,
+                accounting_log_credit,
+            )
+        )
+
+    ledger.load(
+        [posting[1].account_number for posting in postings]
+        + [posting[3].account_number for posting in postings],
+        [posting[1].corresponding_block_reference_no for posting in postings],
+    )
+
+    failure_logs = []
+    for (
+        initiate_payment_request,
+        accounting_log_debit,
+        (
+            credit_account_number,
+            credit_account_name,
+            credit_account_phone,
+            credit_account_email,
+        ),
+        accounting_log_credit,
+    ) in postings:
+        ledger.update_account_for_debit(
+            accounting_log_debit.account_number,
+            initiate_payment_request.payment_amount,
+        )
+        ledger.update_fund_block(
+            accounting_log_debit.corresponding_block_reference_no,
+            initiate_payment_request.payment_amount,
+        )
+
+        ledger.update_account_for_credit(
+            credit_account_name,
+            credit_account_number,
+            credit_account_phone,
+            credit_account_email,
+            initiate_payment_request.beneficiary_account_currency,
+            initiate_payment_request.payment_amount,
+        )
+        failure_random_number = random.randint(1, 100)
+        if (
+            failure_random_number <= 30
+            and initiate_payment_request.beneficiary_bank_code != "EXAMPLE_BANK"
+        ):
+            failure_logs.append(accounting_log_debit)
+            failure_logs.append(accounting_log_credit)
+
+        ledger.add_accounting_log(accounting_log_debit)
+        ledger.add_accounting_log(accounting_log_credit)
+
+    generate_failures(failure_logs, ledger)
 
 
 def construct_accounting_log_for_debit(
@@ -239,7 +650,7 @@ def construct_credit_account_details(initiate_payment_request: InitiatePaymentRe
             )
 
 
-def generate_failures(failure_logs: List[AccountingLog], session):
+def generate_failures(failure_logs: List[AccountingLog], ledger: BatchLedger):
     _logger.info("Generating failures")
     failure_reasons = [
         "ACCOUNT_CLOSED",
@@ -267,87 +678,21 @@ def generate_failures(failure_logs: List[AccountingLog], session):
             active=True,
         )
         if failure_log.debit_credit == DebitCreditTypes.DEBIT:
-            account = update_account_for_debit(
-                account_log.account_number, account_log.transaction_amount, session
+            ledger.update_account_for_debit(
+                account_log.account_number, account_log.transaction_amount
             )
-            fund_block = update_fund_block(
+            ledger.update_fund_block(
                 failure_log.corresponding_block_reference_no,
                 account_log.transaction_amount,
-                session,
             )
-            session.add(fund_block)
         else:
-            account = update_account_for_credit(
+            ledger.update_account_for_credit(
                 None,
                 account_log.account_number,
                 None,
                 None,
                 None,
                 account_log.transaction_amount,
-                session,
             )
 
-        session.add(account_log)
-        session.add(account)
-
-
-def update_account_for_debit(
-    remitting_account_number, payment_amount, session
-) -> Account:
-    account = (
-        session.execute(
-            select(Account).where(Account.account_number == remitting_account_number)
-        )
-        .scalars()
-        .first()
-    )
-    account.book_balance -= payment_amount
-    account.blocked_amount -= payment_amount
-    account.available_balance = account.book_balance - account.blocked_amount
-    return account
-
-
-def update_account_for_credit(
-    beneficiary_name,
-    credit_account_number,
-    account_holder_phone,
-    account_holder_email,
-    remitting_currency,
-    payment_amount,
-    session,
-) -> Account:
-    account = (
-        session.execute(
-            select(Account).where(Account.account_number == credit_account_number)
-        )
-        .scalars()
-        .first()
-    )
-    if not account:
-        account = Account(
-            account_holder_name=beneficiary_name,
-            account_number=credit_account_number,
-            book_balance=0,
-            available_balance=0,
-            blocked_amount=0,
-            account_holder_phone=account_holder_phone,
-            account_holder_email=account_holder_email,
-            account_currency=remitting_currency,
-            active=True,
-        )
-        session.add(account)
-    account.book_balance += payment_amount
-    account.available_balance = account.book_balance - account.blocked_amount
-    return account
-
-
-def update_fund_block(block_reference_no, payment_amount, session) -> FundBlock:
-    fund_block = (
-        session.execute(
-            select(FundBlock).where(FundBlock.block_reference_no == block_reference_no)
-        )
-        .scalars()
-        .first()
-    )
-    fund_block.amount_released += payment_amount
-    return fund_block
+        ledger.add_accounting_log(account_log)
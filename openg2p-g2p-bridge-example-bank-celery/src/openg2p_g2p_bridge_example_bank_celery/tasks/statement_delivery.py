@@ -0,0 +1,283 @@
+import logging
+import os
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import requests
+from openg2p_g2p_bridge_example_bank_models.models import (
+    AccountStatementPage,
+    StatementDelivery,
+    StatementDeliveryStatus,
+)
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import sessionmaker
+
+from ..app import celery_app, get_engine
+from ..config import Settings
+from ..utils import StatementStore
+
+_config = Settings.get_config()
+_logger = logging.getLogger(_config.logging_default_logger_name)
+
+# Size of the pieces a page is uploaded in
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Due deliveries, oldest first; one taken by a concurrent drain stays locked
+# and is skipped
+_next_due_delivery_stmt = (
+    select(StatementDelivery)
+    .where(
+        StatementDelivery.delivery_status == StatementDeliveryStatus.PENDING,
+        StatementDelivery.next_attempt_at <= bindparam("now"),
+    )
+    .order_by(StatementDelivery.next_attempt_at, StatementDelivery.id)
+    .limit(1)
+    .with_for_update(skip_locked=True)
+)
+_lease_delivery_stmt = (
+    update(StatementDelivery)
+    .where(
+        StatementDelivery.id == bindparam("lease_delivery_id"),
+        StatementDelivery.next_attempt_at == bindparam("due_at"),
+    )
+    .values(next_attempt_at=bindparam("lease_expires_at"))
+    .execution_options(synchronize_session=False)
+)
+_page_storage_key_stmt = select(AccountStatementPage.storage_key).where(
+    AccountStatementPage.account_statement_id == bindparam("account_statement_id"),
+    AccountStatementPage.page_number == bindparam("page_number"),
+)
+
+_http_session = None
+_http_session_pid = None
+
+
+def get_http_session() -> requests.Session:
+    """
+    Returns the HTTP session of the current process, creating it on first
+    use. Its pool keeps connections to the statement callback alive between
+    deliveries; like the database engine, it is never shared across a fork.
+    """
+    global _http_session, _http_session_pid
+    if _http_session is not None and _http_session_pid == os.getpid():
+        return _http_session
+    _http_session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=_config.statement_delivery_pool_size
+    )
+    _http_session.mount("http://", adapter)
+    _http_session.mount("https://", adapter)
+    _http_session_pid = os.getpid()
+    return _http_session
+
+
+def enqueue_statement_delivery(account_statement_id: int, page_count: int, session):
+    """
+    Adds an outbox entry for every page of a statement. The entries commit
+    with the caller's transaction; call request_statement_delivery after
+    the commit to have them delivered right away.
+    """
+    now = datetime.utcnow()
+    session.execute(
+        insert(StatementDelivery),
+        [
+            {
+                "account_statement_id": account_statement_id,
+                "page_number": page_number,
+                "page_count": page_count,
+                "delivery_status": StatementDeliveryStatus.PENDING,
+                "delivery_attempts": 0,
+                "next_attempt_at": now,
+                "active": True,
+            }
+            for page_number in range(1, page_count + 1)
+        ],
+    )
+
+
+def request_statement_delivery():
+    celery_app.send_task("statement_delivery_worker")
+
+
+@celery_app.task(name="statement_delivery_worker")
+def statement_delivery_worker():
+    """
+    Drains the statement delivery outbox, up to statement_delivery_batch_size
+    deliveries per run, uploading statement_delivery_pool_size pages at a
+    time over the pooled connections. Failed deliveries are retried by later
+    runs with exponential backoff, which the beat schedule starts
+    periodically.
+    """
+    # Created here so that the drains share one connection pool
+    get_http_session()
+    # Shared by the drains; next() on a range iterator is atomic
+    delivery_budget = iter(range(_config.statement_delivery_batch_size))
+    with ThreadPoolExecutor(_config.statement_delivery_pool_size) as executor:
+        drained = list(
+            executor.map(
+                lambda _: drain_statement_deliveries(delivery_budget),
+                range(_config.statement_delivery_pool_size),
+            )
+        )
+    if not any(drained):
+        # More deliveries may be due
+        request_statement_delivery()
+
+
+def drain_statement_deliveries(delivery_budget) -> bool:
+    """
+    Delivers due pages one after the other while delivery_budget lasts.
+    Returns whether it stopped because no delivery was due.
+    """
+    session_maker = sessionmaker(bind=get_engine(), expire_on_commit=False)
+    with session_maker() as session:
+        while next(delivery_budget, None) is not None:
+            now = datetime.utcnow()
+            delivery = session.scalar(_next_due_delivery_stmt, {"now": now})
+            if not delivery:
+                return True
+            # Leased to this drain; if the worker dies, the delivery is due
+            # again once the lease runs out. Databases without SKIP LOCKED
+            # may hand the same delivery to two drains; only one leases it.
+            leased = session.execute(
+                _lease_delivery_stmt,
+                {
+                    "lease_delivery_id": delivery.id,
+                    "due_at": delivery.next_attempt_at,
+                    "lease_expires_at": now
+                    + timedelta(seconds=_config.statement_delivery_lease_seconds),
+                },
+            ).rowcount
+            session.commit()
+            if not leased:
+                continue
+            deliver_statement_page(delivery, session)
+            session.commit()
+    return False
+
+
+def deliver_statement_page(delivery: StatementDelivery, session):
+    storage_key = session.scalar(
+        _page_storage_key_stmt,
+        {
+            "account_statement_id": delivery.account_statement_id,
+            "page_number": delivery.page_number,
+        },
+    )
+    delivery.delivery_attempts += 1
+    if storage_key is None:
+        _logger.error(
+            f"Page {delivery.page_number} of account statement "
+            f"{delivery.account_statement_id} not found"
+        )
+        delivery.delivery_status = StatementDeliveryStatus.FAILED
+        delivery.last_error = "Statement page not found"
+        return
+
+    boundary = uuid.uuid4().hex
+    try:
+        with _open_page(storage_key) as (page_reader, is_gzip):
+            response = get_http_session().post(
+                _config.mt940_statement_callback_url,
+                data=_multipart_body(
+                    boundary,
+                    {
+                        "page_number": delivery.page_number,
+                        "page_count": delivery.page_count,
+                    },
+                    page_reader,
+                    is_gzip,
+                ),
+                headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                timeout=(
+                    _config.statement_delivery_connect_timeout,
+                    _config.statement_delivery_read_timeout,
+                ),
+            )
+        response.raise_for_status()
+    # A statement store that cannot be read is retried like the callback
+    except (requests.exceptions.RequestException, OSError) as e:
+        delivery.last_error = str(e)
+        if delivery.delivery_attempts >= _config.statement_delivery_max_attempts:
+            _logger.error(
+                f"Failed to upload MT940 statement page {delivery.page_number}, "
+                f"giving up after {delivery.delivery_attempts} attempts: {e}"
+            )
+            delivery.delivery_status = StatementDeliveryStatus.FAILED
+            return
+        backoff = min(
+            _config.statement_delivery_backoff_seconds
+            * 2 ** (delivery.delivery_attempts - 1),
+            _config.statement_delivery_max_backoff_seconds,
+        )
+        _logger.warning(
+            f"Failed to upload MT940 statement page {delivery.page_number}, "
+            f"retrying in {backoff} seconds: {e}"
+        )
+        delivery.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+        return
+
+    _logger.info(f"MT940 statement page {delivery.page_number} uploaded successfully")
+    delivery.delivery_status = StatementDeliveryStatus.DELIVERED
+    delivery.delivered_at = datetime.utcnow()
+    delivery.last_error = None
+
+
+@contextmanager
+def _open_page(storage_key: str):
+    """
+    Yields a reader of the page's body and whether it is gzip compressed.
+    With statement_delivery_gzip, a body the store keeps compressed is sent
+    as stored.
+    """
+    statement_store = StatementStore.get_component()
+    page_reader = None
+    if _config.statement_delivery_gzip:
+        page_reader = statement_store.open_gzip(storage_key)
+    is_gzip = page_reader is not None
+    if not is_gzip:
+        page_reader = statement_store.open(storage_key)
+    with page_reader:
+        yield page_reader, is_gzip
+
+
+def _multipart_body(boundary: str, fields: dict, page_reader, is_gzip: bool):
+    """
+    Yields the multipart/form-data body of a page upload piece by piece, so
+    that it is sent chunked without building the body in memory. With
+    statement_delivery_gzip the statement file is gzip compressed.
+    """
+    for name, value in fields.items():
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode()
+    if _config.statement_delivery_gzip:
+        file_name, content_type = "statement.mt940.gz", "application/gzip"
+    else:
+        file_name, content_type = "statement.mt940", "text/plain"
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="statement_file"; '
+        f'filename="{file_name}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+    # wbits 31 writes a gzip header and trailer around the deflate stream
+    compressor = (
+        zlib.compressobj(wbits=31)
+        if _config.statement_delivery_gzip and not is_gzip
+        else None
+    )
+    while chunk := page_reader.read(_UPLOAD_CHUNK_SIZE):
+        if compressor:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+    yield f"\r\n--{boundary}--\r\n".encode()
@@ -1,4 +1,18 @@
+from .account_updates import publish_account_updates
+from .balance_snapshot import (
+    get_balances,
+    invalidate_balance_snapshots,
+    store_balance_snapshots,
+)
+from .batch_ledger import BatchLedger
 from .mt940_writer import (
+    Mt940Balance,
+    Mt940Transaction,
     Mt940Writer,
     TransactionType,
 )
+from .statement_store import (
+    FileSystemStatementStore,
+    StatementStore,
+    StoredStatement,
+)
@@ -0,0 +1,34 @@
+import json
+import logging
+from typing import Iterable
+
+import redis
+
+from ..config import Settings
+
+_config = Settings.get_config()
+_logger = logging.getLogger(_config.logging_default_logger_name)
+
+_redis = None
+
+
+def publish_account_updates(account_numbers: Iterable[str]):
+    """
+    Tells the API processes that postings to these accounts were committed,
+    so they drop any cached balances and transactions for them.
+    """
+    global _redis
+    account_numbers = sorted(account_numbers)
+    if not account_numbers or not _config.account_updates_redis_url:
+        return
+    try:
+        if _redis is None:
+            _redis = redis.Redis.from_url(
+                _config.account_updates_redis_url,
+                socket_connect_timeout=_config.account_updates_redis_timeout,
+                socket_timeout=_config.account_updates_redis_timeout,
+            )
+        _redis.publish(_config.account_updates_channel, json.dumps(account_numbers))
+    except Exception as e:
+        # Cached entries still expire on their TTL
+        _logger.error(f"Failed to publish account updates: {e}")
@@ -0,0 +1,130 @@
+import logging
+from typing import Iterable, List
+
+import redis
+from openg2p_g2p_bridge_example_bank_models.models import Account
+from sqlalchemy import Row, select
+from sqlalchemy.orm import Session
+
+from ..config import Settings
+
+_config = Settings.get_config()
+_logger = logging.getLogger(_config.logging_default_logger_name)
+
+# Must match the keys and scripts used by the API's BalanceSnapshot
+_KEY_PREFIX = "example_bank:balance:"
+_STORE_SCRIPT = """
+local version = redis.call('HGET', KEYS[1], 'version')
+if version then
+    version = tonumber(version)
+    local new_version = tonumber(ARGV[1])
+    if version > new_version then
+        return 0
+    end
+    if version == new_version and redis.call('HEXISTS', KEYS[1], 'available_balance') == 1 then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[1], 'available_balance', ARGV[2], 'currency', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+_INVALIDATE_SCRIPT = """
+local version = redis.call('HGET', KEYS[1], 'version')
+if version and tonumber(version) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'version', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_redis = None
+_scripts = {}
+
+
+def get_balances(account_numbers: Iterable[str], session: Session) -> List[Row]:
+    """
+    Reads the balances of these accounts as the session sees them, to
+    invalidate their snapshots before the changes commit and to store them
+    once they have.
+    """
+    account_numbers = set(account_numbers)
+    if not _config.balance_snapshot_enabled or not account_numbers:
+        return []
+    return session.execute(
+        select(
+            Account.account_number,
+            Account.account_currency,
+            Account.available_balance,
+            Account.balance_version,
+        ).where(Account.account_number.in_(account_numbers))
+    ).all()
+
+
+def invalidate_balance_snapshots(accounts: List[Row]):
+    """
+    Invalidates the API's Redis balance snapshots of accounts whose changes
+    are about to commit, so that no reader is served the old balance. A
+    snapshot then only takes a balance of at least the pending version.
+    """
+    _run_script(
+        "invalidate",
+        [
+            (
+                account.account_number,
+                [account.balance_version, _config.balance_snapshot_ttl_seconds],
+            )
+            for account in accounts
+        ],
+    )
+
+
+def store_balance_snapshots(accounts: List[Row]):
+    """
+    Writes the committed balances of these accounts to the API's Redis
+    balance snapshot. Each snapshot is only replaced by a newer
+    balance_version, so this may run after other writers have moved on.
+    """
+    _run_script(
+        "store",
+        [
+            (
+                account.account_number,
+                [
+                    account.balance_version,
+                    repr(float(account.available_balance)),
+                    account.account_currency,
+                    _config.balance_snapshot_ttl_seconds,
+                ],
+            )
+            for account in accounts
+        ],
+    )
+
+
+def _run_script(name: str, calls: List[tuple]):
+    global _redis, _scripts
+    if not calls:
+        return
+    try:
+        if _redis is None:
+            _redis = redis.Redis.from_url(
+                _config.balance_snapshot_redis_url or _config.celery_broker_url,
+                socket_connect_timeout=_config.balance_snapshot_redis_timeout,
+                socket_timeout=_config.balance_snapshot_redis_timeout,
+            )
+            _scripts = {
+                "store": _redis.register_script(_STORE_SCRIPT),
+                "invalidate": _redis.register_script(_INVALIDATE_SCRIPT),
+            }
+        with _redis.pipeline(transaction=False) as pipe:
+            for account_number, args in calls:
+                _scripts[name](
+                    keys=[_KEY_PREFIX + account_number], args=args, client=pipe
+                )
+            pipe.execute()
+    except Exception as e:
+        # Readers fall back to the database once the old snapshot expires
+        _logger.error(f"Failed to {name} balance snapshots: {e}")
@@ -0,0 +1,266 @@
+import logging
+from typing import Dict, Iterable, List, Set
+
+from openg2p_g2p_bridge_example_bank_models.models import (
+    Account,
+    AccountingLog,
+    FundBlock,
+)
+from sqlalchemy import bindparam, func, insert, inspect, select, update
+from sqlalchemy.orm import Session
+
+from ..config import Settings
+
+_config = Settings.get_config()
+_logger = logging.getLogger(_config.logging_default_logger_name)
+
+
+class BatchLedger:
+    """
+    Applies the postings of a payment batch in memory.
+
+    Every account and fund block touched by the batch is loaded with a few
+    IN (...) queries, balances are moved in memory in the same order as the
+    postings arrive, and flush() writes everything back with bulk UPDATE and
+    INSERT statements.
+
+    With net_settlement enabled, movements on existing accounts and fund
+    blocks are summed per row instead, and each row receives its net movement
+    once as a relative UPDATE. Every accounting log is still posted.
+    """
+
+    def __init__(self, session: Session, net_settlement: bool = False):
+        self.session = session
+        self.net_settlement = net_settlement
+        self.accounts: Dict[str, dict] = {}
+        self.fund_blocks: Dict[str, dict] = {}
+        self.new_accounts: Dict[str, dict] = {}
+        self.accounting_logs: List[dict] = []
+        self._dirty_accounts: Dict[str, dict] = {}
+        self._dirty_fund_blocks: Dict[str, dict] = {}
+        self._account_deltas: Dict[str, dict] = {}
+        self._fund_block_deltas: Dict[str, dict] = {}
+        self.flushed_account_numbers: Set[str] = set()
+
+    def load(self, account_numbers: Iterable[str], block_reference_nos: Iterable[str]):
+        account_numbers = set(account_numbers) - self.accounts.keys()
+        if account_numbers:
+            self._load_accounts(account_numbers)
+            missing_account_numbers = account_numbers - self.accounts.keys()
+            # Serialise creation of new accounts across concurrent workers,
+            # then pick up whatever another worker created meanwhile. Other
+            # databases have no advisory locks and serialise writers anyway.
+            if (
+                missing_account_numbers
+                and self.session.get_bind().dialect.name == "postgresql"
+            ):
+                for account_number in sorted(missing_account_numbers):
+                    self.session.execute(
+                        select(
+                            func.pg_advisory_xact_lock(func.hashtext(account_number))
+                        )
+                    )
+                self._load_accounts(missing_account_numbers)
+
+        block_reference_nos = set(block_reference_nos) - self.fund_blocks.keys()
+        if block_reference_nos:
+            query = (
+                select(
+                    FundBlock.id,
+                    FundBlock.block_reference_no,
+                    FundBlock.amount_released,
+                )
+                .where(FundBlock.block_reference_no.in_(block_reference_nos))
+                .order_by(FundBlock.block_reference_no)
+            )
+            if not self.net_settlement:
+                query = query.with_for_update()
+            for fund_block in self.session.execute(query):
+                self.fund_blocks.setdefault(
+                    fund_block.block_reference_no, fund_block._asdict()
+                )
+
+    def _load_accounts(self, account_numbers):
+        query = (
+            select(
+                Account.id,
+                Account.account_number,
+                Account.book_balance,
+                Account.blocked_amount,
+                Account.available_balance,
+                Account.balance_version,
+            )
+            .where(Account.account_number.in_(account_numbers))
+            .order_by(Account.account_number, Account.id)
+        )
+        # Balances are rewritten from the values read here, so the rows stay
+        # locked until the chunk commits. Net settlement only issues relative
+        # updates and does not need the lock.
+        if not self.net_settlement:
+            query = query.with_for_update()
+        for account in self.session.execute(query):
+            self.accounts.setdefault(account.account_number, account._asdict())
+
+    def update_account_for_debit(self, remitting_account_number, payment_amount):
+        account = self.accounts[remitting_account_number]
+        if self._settles_net(remitting_account_number):
+            self._add_account_delta(account, -payment_amount, -payment_amount)
+            return account
+        account["book_balance"] -= payment_amount
+        account["blocked_amount"] -= payment_amount
+        account["available_balance"] = (
+            account["book_balance"] - account["blocked_amount"]
+        )
+        self._dirty_accounts[remitting_account_number] = account
+        return account
+
+    def update_account_for_credit(
+        self,
+        beneficiary_name,
+        credit_account_number,
+        account_holder_phone,
+        account_holder_email,
+        remitting_currency,
+        payment_amount,
+    ):
+        account = self.accounts.get(credit_account_number)
+        if account is None:
+            account = {
+                "account_holder_name": beneficiary_name,
+                "account_number": credit_account_number,
+                "book_balance": 0,
+                "available_balance": 0,
+                "blocked_amount": 0,
+                "account_holder_phone": account_holder_phone,
+                "account_holder_email": account_holder_email,
+                "account_currency": remitting_currency,
+                "active": True,
+            }
+            self.accounts[credit_account_number] = account
+            self.new_accounts[credit_account_number] = account
+        if self._settles_net(credit_account_number):
+            self._add_account_delta(account, payment_amount, 0)
+            return account
+        account["book_balance"] += payment_amount
+        account["available_balance"] = (
+            account["book_balance"] - account["blocked_amount"]
+        )
+        self._dirty_accounts[credit_account_number] = account
+        return account
+
+    def update_fund_block(self, block_reference_no, payment_amount):
+        fund_block = self.fund_blocks[block_reference_no]
+        if self.net_settlement:
+            delta = self._fund_block_deltas.setdefault(
+                block_reference_no,
+                {"_id": fund_block["id"], "amount_released_delta": 0},
+            )
+            delta["amount_released_delta"] += payment_amount
+            return fund_block
+        fund_block["amount_released"] += payment_amount
+        self._dirty_fund_blocks[block_reference_no] = fund_block
+        return fund_block
+
+    def _settles_net(self, account_number) -> bool:
+        # Accounts created by this batch are inserted with their final balance
+        return self.net_settlement and account_number not in self.new_accounts
+
+    def _add_account_delta(self, account, book_balance_delta, blocked_amount_delta):
+        delta = self._account_deltas.setdefault(
+            account["account_number"],
+            {"_id": account["id"], "book_balance_delta": 0, "blocked_amount_delta": 0},
+        )
+        delta["book_balance_delta"] += book_balance_delta
+        delta["blocked_amount_delta"] += blocked_amount_delta
+
+    def add_accounting_log(self, accounting_log: AccountingLog):
+        self.accounting_logs.append(
+            {
+                key: value
+                for key, value in inspect(accounting_log).dict.items()
+                if not key.startswith("_")
+            }
+        )
+
+    def flush(self):
+        account_updates = []
+        for account_number, account in self._dirty_accounts.items():
+            if account_number in self.new_accounts:
+                continue
+            account["balance_version"] += 1
+            account_updates.append(
+                {
+                    "id": account["id"],
+                    "book_balance": account["book_balance"],
+                    "blocked_amount": account["blocked_amount"],
+                    "available_balance": account["available_balance"],
+                    "balance_version": account["balance_version"],
+                }
+            )
+        if account_updates:
+            self.session.execute(update(Account), account_updates)
+        if self._account_deltas:
+            # Sorted so concurrent batches take row locks in the same order
+            self.session.connection().execute(
+                update(Account.__table__)
+                .where(Account.id == bindparam("_id"))
+                .values(
+                    book_balance=Account.book_balance + bindparam("book_balance_delta"),
+                    blocked_amount=Account.blocked_amount
+                    + bindparam("blocked_amount_delta"),
+                    available_balance=(
+                        Account.book_balance + bindparam("book_balance_delta")
+                    )
+                    - (Account.blocked_amount + bindparam("blocked_amount_delta")),
+                    balance_version=Account.balance_version + 1,
+                ),
+                [
+                    self._account_deltas[account_number]
+                    for account_number in sorted(self._account_deltas)
+                ],
+            )
+        if self.new_accounts:
+            self.session.execute(insert(Account), list(self.new_accounts.values()))
+
+        fund_block_updates = [
+            {"id": fund_block["id"], "amount_released": fund_block["amount_released"]}
+            for fund_block in self._dirty_fund_blocks.values()
+        ]
+        if fund_block_updates:
+            self.session.execute(update(FundBlock), fund_block_updates)
+        if self._fund_block_deltas:
+            self.session.connection().execute(
+                update(FundBlock.__table__)
+                .where(FundBlock.id == bindparam("_id"))
+                .values(
+                    amount_released=FundBlock.amount_released
+                    + bindparam("amount_released_delta")
+                ),
+                [
+                    self._fund_block_deltas[block_reference_no]
+                    for block_reference_no in sorted(self._fund_block_deltas)
+                ],
+            )
+
+        if self.accounting_logs:
+            self.session.execute(insert(AccountingLog), self.accounting_logs)
+
+        _logger.info(
+            "Ledger flushed: "
+            f"{len(account_updates) + len(self._account_deltas)} accounts updated, "
+            f"{len(self.new_accounts)} accounts created, "
+            f"{len(fund_block_updates) + len(self._fund_block_deltas)} fund blocks updated, "
+            f"{len(self.accounting_logs)} accounting logs posted"
+        )
+        self.flushed_account_numbers.update(self._dirty_accounts)
+        self.flushed_account_numbers.update(self._account_deltas)
+        self.flushed_account_numbers.update(self.new_accounts)
+        # New accounts now exist in the database; reload them on next use
+        for account_number in self.new_accounts:
+            self.accounts.pop(account_number, None)
+        self.new_accounts.clear()
+        self.accounting_logs.clear()
+        self._dirty_accounts.clear()
+        self._dirty_fund_blocks.clear()
+        self._account_deltas.clear()
+        self._fund_block_deltas.clear()
@@ -1,4 +1,8 @@
+import io
+from datetime import date
 from enum import Enum
+from functools import lru_cache
+from typing import NamedTuple
 
 from openg2p_fastapi_common.service import BaseService
 
@@ -7,6 +11,32 @@ class TransactionType(Enum):
     transfer = "NTRF"
 
 
+class Mt940Transaction(NamedTuple):
+    value_date: date
+    entry_date: date
+    dr_cr: str
+    funds_code: str
+    transaction_amount: object
+    transaction_type: TransactionType
+    customer_reference: str
+    bank_reference: str
+    supplementary_details: object
+    additional_info: object
+
+
+class Mt940Balance(NamedTuple):
+    amount: object
+    date: date
+    currency_code: str
+
+
+# Postings of a statement share few distinct days, so each day is formatted
+# once instead of running strftime for every line
+@lru_cache(maxsize=4096)
+def _format_day(day_ordinal: int) -> str:
+    return date.fromordinal(day_ordinal).strftime("%y%m%d")
+
+
 class Mt940Writer(BaseService):
     def create_transaction(
         self,
@@ -21,33 +51,28 @@ class Mt940Writer(BaseService):
         supplementary_details=None,
         additional_info=None,
     ):
-        transaction = {
-            "value_date": value_date,
-            "entry_date": entry_date,
-            "dr_cr": dr_cr,
-            "funds_code": funds_code,
-            "transaction_amount": transaction_amount,
-            "transaction_type": transaction_type,
-            "customer_reference": customer_reference,
-            "bank_reference": f"//{bank_reference}",
-            "supplementary_details": supplementary_details,
-            "additional_info": additional_info,
-        }
-        return transaction
+        return Mt940Transaction(
+            value_date,
+            entry_date,
+            dr_cr,
+            funds_code,
+            transaction_amount,
+            transaction_type,
+            customer_reference,
+            f"//{bank_reference}",
+            supplementary_details,
+            additional_info,
+        )
 
     def format_transaction(self, transaction):
-        return "{value_date}{entry_date}{dr_cr}{funds_code}{transaction_amount}{transaction_type}{customer_reference}{bank_reference}{supplementary_details}".format(
-            value_date=transaction["value_date"].strftime("%y%m%d"),
-            entry_date=transaction["entry_date"].strftime("%m%d"),
-            dr_cr=transaction["dr_cr"],
-            funds_code=transaction["funds_code"],
-            transaction_amount="{:015.2f}".format(
-                transaction["transaction_amount"]
-            ).replace(".", ","),
-            transaction_type=transaction["transaction_type"].value,
-            customer_reference=transaction["customer_reference"],
-            bank_reference=transaction["bank_reference"],
-            supplementary_details=transaction["supplementary_details"],
+        amount = f"{transaction.transaction_amount:015.2f}".replace(".", ",")
+        return (
+            f"{_format_day(transaction.value_date.toordinal())}"
+            f"{_format_day(transaction.entry_date.toordinal())[2:]}"
+            f"{transaction.dr_cr}{transaction.funds_code}{amount}"
+            f"{transaction.transaction_type.value}"
+            f"{transaction.customer_reference}{transaction.bank_reference}"
+            f"{transaction.supplementary_details}"
         )
 
     def create_statement(
@@ -70,30 +95,74 @@ class Mt940Writer(BaseService):
         return statement
 
     def format_statement(self, statement):
-        result = []
-        result.append(f':20:{statement["reference_number"]}')
-        result.append(f':25:{statement["account"]}')
-        result.append(f':28C:{statement["statement_number"]}')
-        result.append(f':60F:{self.format_balance(statement["opening_balance"])}')
-        for transaction in statement["transactions"]:
-            result.append(f":61:{self.format_transaction(transaction)}")
-            if transaction["additional_info"]:
-                result.append(f':86:{transaction["additional_info"]}')
-        result.append(f':62F:{self.format_balance(statement["closing_balance"])}')
-        return "\n".join(result)
+        result = io.StringIO()
+        self.write_statement_header(
+            result,
+            statement["reference_number"],
+            statement["account"],
+            statement["statement_number"],
+            statement["opening_balance"],
+        )
+        self.write_transactions(result, statement["transactions"])
+        self.write_statement_footer(result, statement["closing_balance"])
+        return result.getvalue()
+
+    def write_statement_header(
+        self,
+        file,
+        reference_number,
+        account,
+        statement_number,
+        opening_balance,
+        opening_balance_tag="60F",
+    ):
+        """
+        The write_* methods write a statement into a text file piece by piece,
+        so that the transactions never have to be held in memory together.
+        The result is the same as format_statement. Pages of a statement
+        split over several messages use the intermediate balance tags 60M
+        and 62M.
+        """
+        file.write(
+            f":20:{reference_number}"
+            f"\n:25:{account}"
+            f"\n:28C:{statement_number}"
+            f"\n:{opening_balance_tag}:{self.format_balance(opening_balance)}"
+        )
+
+    def format_transaction_lines(self, transaction):
+        """Returns the :61: and :86: lines of a transaction, each after a newline."""
+        if transaction.additional_info:
+            return (
+                f"\n:61:{self.format_transaction(transaction)}"
+                f"\n:86:{transaction.additional_info}"
+            )
+        return f"\n:61:{self.format_transaction(transaction)}"
+
+    def write_transaction(self, file, transaction):
+        file.write(self.format_transaction_lines(transaction))
+
+    def write_transactions(self, file, transactions, buffer_size=1000):
+        """Writes transactions, buffer_size of them per file.write call."""
+        format_transaction_lines = self.format_transaction_lines
+        lines = []
+        for transaction in transactions:
+            lines.append(format_transaction_lines(transaction))
+            if len(lines) >= buffer_size:
+                file.write("".join(lines))
+                lines.clear()
+        file.write("".join(lines))
+
+    def write_statement_footer(self, file, closing_balance, closing_balance_tag="62F"):
+        file.write(f"\n:{closing_balance_tag}:{self.format_balance(closing_balance)}")
 
     def create_balance(self, amount, date, currency_code):
-        balance = {
-            "amount": amount,
-            "date": date,
-            "currency_code": currency_code,
-        }
-        return balance
+        return Mt940Balance(amount, date, currency_code)
 
     def format_balance(self, balance):
-        return "{category}{date}{currency_code}{amount}".format(
-            category="C" if balance["amount"] >= 0 else "D",
-            date=balance["date"].strftime("%y%m%d"),
-            currency_code=balance["currency_code"],
-            amount=f'{balance["amount"]:0.2f}'.replace(".", ",").replace("-", ""),
+        amount = f"{balance.amount:0.2f}".replace(".", ",").replace("-", "")
+        return (
+            f'{"C" if balance.amount >= 0 else "D"}'
+            f"{_format_day(balance.date.toordinal())}"
+            f"{balance.currency_code}{amount}"
         )
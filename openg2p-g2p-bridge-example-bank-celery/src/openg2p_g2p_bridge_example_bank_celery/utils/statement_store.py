@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, NamedTuple, Optional
+
+from openg2p_fastapi_common.service import BaseService
+
+from ..config import Settings
+
+_config = Settings.get_config()
+
+# Size of the pieces a statement is stored in
+_CHUNK_SIZE = 64 * 1024
+
+
+class StoredStatement(NamedTuple):
+    storage_key: str
+    # Of the statement as written, before compression
+    content_size: int
+    content_sha256: str
+
+
+class StatementStore(BaseService):
+    """
+    Keeps statement bodies outside the database; their rows only keep the
+    StoredStatement. Tasks use whichever store is registered, so another
+    backend, such as an object store, replaces the filesystem store by
+    registering its own subclass in its place in app.py.
+    """
+
+    def put(self, file) -> StoredStatement:
+        """Stores the statement read from a text or binary file."""
+        raise NotImplementedError()
+
+    def open(self, storage_key: str) -> BinaryIO:
+        """Returns a reader of the statement's bytes."""
+        raise NotImplementedError()
+
+    def open_gzip(self, storage_key: str) -> Optional[BinaryIO]:
+        """
+        Returns a reader of the statement gzip compressed, or None if the
+        store would have to compress it for this.
+        """
+        return None
+
+
+class FileSystemStatementStore(StatementStore):
+    """
+    Content-addressed store of gzip compressed statements in a directory
+    shared by every worker. A statement's key is the SHA-256 of its
+    content, so storing the same statement again writes nothing.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.root = _config.statement_store_path
+
+    def put(self, file) -> StoredStatement:
+        os.makedirs(self.root, exist_ok=True)
+        sha256 = hashlib.sha256()
+        content_size = 0
+        # Written next to its final place, so that it can be renamed into it
+        with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as temp_file:
+            try:
+                with gzip.GzipFile(
+                    fileobj=temp_file,
+                    mode="wb",
+                    compresslevel=_config.statement_store_compress_level,
+                    mtime=0,
+                ) as gzip_file:
+                    while chunk := file.read(_CHUNK_SIZE):
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode()
+                        sha256.update(chunk)
+                        content_size += len(chunk)
+                        gzip_file.write(chunk)
+            except BaseException:
+                os.remove(temp_file.name)
+                raise
+        storage_key = sha256.hexdigest()
+        path = self._path(storage_key)
+        if os.path.exists(path):
+            os.remove(temp_file.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_file.name, path)
+        return StoredStatement(storage_key, content_size, storage_key)
+
+    def open(self, storage_key: str) -> BinaryIO:
+        return gzip.open(self._path(storage_key), "rb")
+
+    def open_gzip(self, storage_key: str) -> Optional[BinaryIO]:
+        return open(self._path(storage_key), "rb")
+
+    def _path(self, storage_key: str) -> str:
+        # Spread over 256 directories, so none of them grows too large
+        return os.path.join(self.root, storage_key[:2], f"{storage_key}.mt940.gz")
@@ -0,0 +1,139 @@
+import io
+import os
+
+import pytest
+
+# Tests do not run a Redis server to publish account updates to
+os.environ.setdefault("EXAMPLE_BANK_CELERY_ACCOUNT_UPDATES_REDIS_URL", "")
+
+from openg2p_g2p_bridge_example_bank_celery import app  # noqa: E402
+from openg2p_g2p_bridge_example_bank_celery.tasks import (  # noqa: E402
+    statement_delivery,
+)
+from openg2p_g2p_bridge_example_bank_celery.utils import StatementStore  # noqa: E402
+from openg2p_g2p_bridge_example_bank_models.models import (  # noqa: E402
+    Account,
+    AccountStatementPage,
+    FundBlock,
+    InitiatePaymentBatchRequest,
+    InitiatePaymentRequest,
+)
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from stub_receiver import StubReceiver  # noqa: E402
+
+
+@pytest.fixture
+def sent_tasks(monkeypatch):
+    """Tasks sent to the broker, which tests run directly instead."""
+    sent_tasks = []
+    monkeypatch.setattr(
+        app.celery_app,
+        "send_task",
+        lambda name, args=(), **kwargs: sent_tasks.append((name, tuple(args))),
+    )
+    return sent_tasks
+
+
+@pytest.fixture
+def bank_engine(bank_database, monkeypatch, sent_tasks):
+    """Engine of the bank database, used by every task."""
+    engine = create_engine(f"sqlite:///{bank_database}")
+    monkeypatch.setattr(app, "_engine", engine)
+    monkeypatch.setattr(app, "_engine_pid", os.getpid())
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def seed_payment_batch(bank_engine):
+    """
+    Returns a function storing a pending batch of payments from account 1001,
+    given as (beneficiary_account, beneficiary_bank_code, amount). Their
+    total is blocked on the account in fund block FB-<batch_id>.
+    """
+
+    def seed_payment_batch(batch_id, payments):
+        total = sum(amount for _, _, amount in payments)
+        with sessionmaker(bank_engine)() as session:
+            account = session.scalar(
+                select(Account).where(Account.account_number == "1001")
+            )
+            account.blocked_amount += total
+            account.available_balance -= total
+            session.add(
+                FundBlock(
+                    block_reference_no=f"FB-{batch_id}",
+                    account_number="1001",
+                    currency="USD",
+                    amount=total,
+                    amount_released=0,
+                    active=True,
+                )
+            )
+            session.add(InitiatePaymentBatchRequest(batch_id=batch_id, active=True))
+            session.add_all(
+                InitiatePaymentRequest(
+                    batch_id=batch_id,
+                    payment_reference_number=f"{batch_id}-{index}",
+                    remitting_account="1001",
+                    remitting_account_currency="USD",
+                    payment_amount=amount,
+                    payment_date="2024-01-01",
+                    funds_blocked_reference_number=f"FB-{batch_id}",
+                    beneficiary_name=f"Beneficiary {beneficiary_account}",
+                    beneficiary_account=beneficiary_account,
+                    beneficiary_account_currency="USD",
+                    beneficiary_account_type="BANK_ACCOUNT",
+                    beneficiary_bank_code=beneficiary_bank_code,
+                    beneficiary_branch_code="001",
+                    beneficiary_phone_no=f"9{beneficiary_account}",
+                    beneficiary_email=f"{beneficiary_account}@example.org",
+                    active=True,
+                )
+                for index, (beneficiary_account, beneficiary_bank_code, amount) in (
+                    enumerate(payments)
+                )
+            )
+            session.commit()
+
+    return seed_payment_batch
+
+
+@pytest.fixture
+def statement_store(tmp_path, monkeypatch):
+    statement_store = StatementStore.get_component()
+    monkeypatch.setattr(statement_store, "root", str(tmp_path / "statements"))
+    return statement_store
+
+
+@pytest.fixture
+def stored_page(bank_engine, statement_store):
+    """Page 1 of statement 1, stored and queued for delivery."""
+    stored_page = statement_store.put(
+        io.StringIO(":20:1\n:25:1001\n:28C:1/1\n:61:...\n:62F:...")
+    )
+    with sessionmaker(bank_engine)() as session:
+        session.add(
+            AccountStatementPage(
+                account_statement_id=1,
+                page_number=1,
+                transaction_count=2,
+                storage_key=stored_page.storage_key,
+                content_size=stored_page.content_size,
+                content_sha256=stored_page.content_sha256,
+                active=True,
+            )
+        )
+        statement_delivery.enqueue_statement_delivery(1, 1, session)
+        session.commit()
+    return stored_page
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    with StubReceiver() as receiver:
+        monkeypatch.setattr(
+            statement_delivery._config, "mt940_statement_callback_url", receiver.url
+        )
+        yield receiver
@@ -0,0 +1,115 @@
+"""
+Local stand-in for the MT940 statement callback, recording every upload.
+
+    python tests/stub_receiver.py --port 8000
+"""
+
+import argparse
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, NamedTuple, Optional
+
+
+class StubUpload(NamedTuple):
+    fields: dict
+    file_name: str
+    content_type: str
+    content: bytes
+    chunked: bool
+    client_address: tuple
+
+
+class _UploadHandler(BaseHTTPRequestHandler):
+    # Keeps connections open, like the callbacks statements are delivered to
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        chunked = self.headers.get("Transfer-Encoding", "").lower() == "chunked"
+        body = (
+            self._read_chunked()
+            if chunked
+            else self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        )
+        message = BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        fields = {}
+        upload = None
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                upload = (
+                    part.get_filename(),
+                    part.get_content_type(),
+                    part.get_payload(decode=True),
+                )
+            else:
+                fields[name] = part.get_payload(decode=True).decode()
+        self.server.uploads.append(
+            StubUpload(fields, *upload, chunked, self.client_address)
+        )
+
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _read_chunked(self) -> bytes:
+        body = bytearray()
+        while True:
+            size = int(self.rfile.readline().split(b";")[0], 16)
+            if size == 0:
+                self.rfile.readline()
+                return bytes(body)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubReceiver:
+    """
+    Receives statement uploads on a local port in a background thread.
+    Responds with the queued statuses first, then with 200.
+    """
+
+    def __init__(self, port: int = 0, statuses: Optional[List[int]] = None):
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _UploadHandler)
+        self._server.uploads = []
+        self._server.statuses = list(statuses or [])
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/upload_mt940_statement"
+
+    @property
+    def uploads(self) -> List[StubUpload]:
+        return self._server.uploads
+
+    @property
+    def statuses(self) -> List[int]:
+        return self._server.statuses
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    with StubReceiver(args.port) as receiver:
+        print(f"Receiving statements on {receiver.url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            for upload in receiver.uploads:
+                print(upload.fields, upload.file_name, len(upload.content))
@@ -0,0 +1,240 @@
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from openg2p_g2p_bridge_example_bank_models.models import (
+    Account,
+    AccountBalanceCheckpoint,
+    AccountingLog,
+    AccountStatement,
+    AccountStatementPage,
+    AccountStatementStatus,
+    DebitCreditTypes,
+    StatementDelivery,
+)
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+# The tasks package exports the task under the same name as its module
+account_statement_generator = sys.modules[
+    "openg2p_g2p_bridge_example_bank_celery.tasks.account_statement_generator"
+]
+
+AMOUNTS = [100, -30, 45.5, -12.25, 80, -200, 7]
+
+
+@pytest.fixture
+def post_logs(bank_engine):
+    """
+    Returns a function posting amounts to account 1001, credits positive and
+    debits negative, and moving its book balance along.
+    """
+
+    def post_logs(amounts, transaction_date=datetime(2024, 1, 1)):
+        with sessionmaker(bank_engine)() as session:
+            account = session.scalar(
+                select(Account).where(Account.account_number == "1001")
+            )
+            first_reference = session.scalar(select(func.count(AccountingLog.id)))
+            for index, amount in enumerate(amounts, start=first_reference):
+                session.add(
+                    AccountingLog(
+                        reference_no=f"REF-{index}",
+                        customer_reference_no=f"CUST-{index}",
+                        debit_credit=(
+                            DebitCreditTypes.CREDIT
+                            if amount > 0
+                            else DebitCreditTypes.DEBIT
+                        ),
+                        account_number="1001",
+                        transaction_amount=abs(amount),
+                        transaction_date=transaction_date,
+                        transaction_currency="USD",
+                        active=True,
+                    )
+                )
+                account.book_balance += amount
+            session.commit()
+
+    return post_logs
+
+
+def generate_statement(engine, **statement) -> int:
+    with sessionmaker(engine)() as session:
+        account_statement = AccountStatement(
+            account_number="1001", active=True, **statement
+        )
+        session.add(account_statement)
+        session.commit()
+        account_statement_id = account_statement.id
+    account_statement_generator.account_statement_generator(account_statement_id)
+    return account_statement_id
+
+
+def parse_balance(line: str) -> Decimal:
+    # :60F:C240101USD1000,00
+    value = line.split(":", 2)[2]
+    amount = Decimal(value[10:].replace(",", "."))
+    return amount if value[0] == "C" else -amount
+
+
+def get_pages(engine, statement_store, account_statement_id):
+    """Returns the opening and closing balance lines of every page."""
+    with sessionmaker(engine)() as session:
+        storage_keys = session.scalars(
+            select(AccountStatementPage.storage_key)
+            .where(AccountStatementPage.account_statement_id == account_statement_id)
+            .order_by(AccountStatementPage.page_number)
+        ).all()
+    pages = []
+    for storage_key in storage_keys:
+        with statement_store.open(storage_key) as page_reader:
+            lines = page_reader.read().decode().splitlines()
+        opening, closing = (
+            next(line for line in lines if line.startswith(tags))
+            for tags in ((":60F:", ":60M:"), (":62F:", ":62M:"))
+        )
+        pages.append(
+            (
+                opening[1:4],
+                parse_balance(opening),
+                closing[1:4],
+                parse_balance(closing),
+                sum(line.startswith(":61:") for line in lines),
+            )
+        )
+    return pages
+
+
+@pytest.mark.parametrize(
+    "page_max_bytes, page_count", [(4 * 1024 * 1024, 3), (257, len(AMOUNTS))]
+)
+def test_pages_chain_balances_actually_written(
+    bank_engine,
+    statement_store,
+    post_logs,
+    sent_tasks,
+    monkeypatch,
+    page_max_bytes,
+    page_count,
+):
+    monkeypatch.setattr(
+        account_statement_generator._config, "statement_page_max_transactions", 3
+    )
+    monkeypatch.setattr(
+        account_statement_generator._config, "statement_page_max_bytes", page_max_bytes
+    )
+    post_logs(AMOUNTS)
+
+    account_statement_id = generate_statement(bank_engine)
+    pages = get_pages(bank_engine, statement_store, account_statement_id)
+
+    closing_balance = Decimal(1000) + sum(Decimal(str(a)) for a in AMOUNTS)
+    assert len(pages) == page_count
+    assert sum(page[4] for page in pages) == len(AMOUNTS)
+    assert [page[0] for page in pages] == ["60F"] + ["60M"] * (page_count - 1)
+    assert [page[2] for page in pages] == ["62M"] * (page_count - 1) + ["62F"]
+    assert pages[0][1] == 1000
+    # Every page opens where the one before it closed
+    assert [page[1] for page in pages[1:]] == [page[3] for page in pages[:-1]]
+    assert pages[-1][3] == closing_balance
+    with sessionmaker(bank_engine)() as session:
+        checkpoint = session.scalar(select(AccountBalanceCheckpoint))
+        unreported = session.scalar(
+            select(func.count(AccountingLog.id)).where(
+                AccountingLog.reported_in_mt940.is_(False)
+            )
+        )
+        deliveries = session.scalar(select(func.count(StatementDelivery.id)))
+    assert Decimal(str(checkpoint.balance)) == closing_balance
+    assert checkpoint.last_log_id == len(AMOUNTS)
+    assert unreported == 0
+    assert deliveries == page_count
+
+
+def test_next_statement_opens_from_checkpoint(
+    bank_engine, statement_store, post_logs, sent_tasks
+):
+    post_logs(AMOUNTS[:4])
+    first_id = generate_statement(bank_engine)
+    post_logs(AMOUNTS[4:])
+    # The book balance no longer matches the postings, so an opening worked
+    # back from it would differ from one carried over from the checkpoint
+    with sessionmaker(bank_engine)() as session:
+        session.scalar(
+            select(Account).where(Account.account_number == "1001")
+        ).book_balance += 500
+        session.commit()
+    second_id = generate_statement(bank_engine)
+
+    first = get_pages(bank_engine, statement_store, first_id)
+    second = get_pages(bank_engine, statement_store, second_id)
+    with sessionmaker(bank_engine)() as session:
+        checkpoints = session.execute(
+            select(
+                AccountBalanceCheckpoint.account_statement_id,
+                AccountBalanceCheckpoint.last_log_id,
+                AccountBalanceCheckpoint.balance,
+            ).order_by(AccountBalanceCheckpoint.last_log_id)
+        ).all()
+
+    assert first == [("60F", Decimal(1000), "62F", Decimal("1103.25"), 4)]
+    assert second == [("60F", Decimal("1103.25"), "62F", Decimal("990.25"), 3)]
+    assert checkpoints == [(first_id, 4, 1103.25), (second_id, 7, 990.25)]
+
+
+def test_date_range_statement_opens_and_closes_at_range_bounds(
+    bank_engine, statement_store, post_logs, sent_tasks
+):
+    post_logs([100, -30], datetime(2024, 1, 5))
+    post_logs([45.5, -12.25], datetime(2024, 1, 10))
+    post_logs([80], datetime(2024, 1, 20, 18))
+    post_logs([-200, 7], datetime(2024, 1, 21))
+
+    account_statement_id = generate_statement(
+        bank_engine, from_date=datetime(2024, 1, 10), to_date=datetime(2024, 1, 20)
+    )
+    pages = get_pages(bank_engine, statement_store, account_statement_id)
+
+    # Postings after the range are taken back off the book balance
+    assert pages == [("60F", Decimal(1070), "62F", Decimal("1183.25"), 3)]
+    with sessionmaker(bank_engine)() as session:
+        # Re-reporting a range neither marks postings nor moves the checkpoint
+        assert session.scalar(select(AccountBalanceCheckpoint)) is None
+        assert not session.scalar(
+            select(func.count(AccountingLog.id)).where(
+                AccountingLog.reported_in_mt940.is_(True)
+            )
+        )
+
+
+def test_statement_waits_while_its_account_is_locked(
+    bank_engine, statement_store, post_logs, sent_tasks, monkeypatch
+):
+    post_logs(AMOUNTS)
+    # Another run holds the account's lock the first time round
+    lock_results = [False]
+    monkeypatch.setattr(
+        account_statement_generator,
+        "_lock_account",
+        lambda connection, account_number: lock_results.pop() if lock_results else True,
+    )
+
+    generate_statement(bank_engine)
+    with sessionmaker(bank_engine)() as session:
+        waiting = session.get(AccountStatement, 1)
+    account_statement_generator.account_statement_generator(1)
+    # A repeated run delivers the stored statement again instead of
+    # generating it twice
+    account_statement_generator.account_statement_generator(1)
+
+    assert waiting.statement_status == AccountStatementStatus.PENDING
+    assert sent_tasks[0] == ("account_statement_generator", (1,))
+    with sessionmaker(bank_engine)() as session:
+        assert (
+            session.get(AccountStatement, 1).statement_status
+            == AccountStatementStatus.COMPLETED
+        )
+        assert session.scalar(select(func.count(AccountStatementPage.id))) == 1
+        assert session.scalar(select(func.count(StatementDelivery.id))) == 2
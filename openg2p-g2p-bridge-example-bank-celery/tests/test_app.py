@@ -0,0 +1,29 @@
+import os
+
+from celery.signals import worker_process_init
+from openg2p_g2p_bridge_example_bank_celery import app
+
+
+def test_forked_worker_process_builds_its_own_engine(bank_database, monkeypatch):
+    monkeypatch.setattr(app._config, "db_datasource", f"sqlite:///{bank_database}")
+    monkeypatch.setattr(app, "_engine", None)
+    monkeypatch.setattr(app, "_engine_pid", None)
+    parent_engine = app.get_engine()
+    disposals = []
+    monkeypatch.setattr(
+        parent_engine, "dispose", lambda close=True: disposals.append(close)
+    )
+
+    reused = app.get_engine()
+    # A prefork child starts with the parent's engine in its globals
+    child_pid = os.getpid() + 1
+    monkeypatch.setattr(app.os, "getpid", lambda: child_pid)
+    worker_process_init.send(sender=None)
+    child_engine = app.get_engine()
+    app.dispose_engine()
+
+    assert reused is parent_engine
+    assert child_engine is not parent_engine
+    assert app._engine is None
+    # The parent's pool is dropped without closing the parent's connections
+    assert disposals == [False]
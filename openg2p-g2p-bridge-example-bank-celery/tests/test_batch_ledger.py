@@ -0,0 +1,162 @@
+import itertools
+import random
+import shutil
+from types import SimpleNamespace
+
+import pytest
+from openg2p_g2p_bridge_example_bank_celery.tasks import process_payment
+from openg2p_g2p_bridge_example_bank_celery.utils import BatchLedger
+from openg2p_g2p_bridge_example_bank_models.models import (
+    Account,
+    AccountingLog,
+    FundBlock,
+    InitiatePaymentRequest,
+)
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+# Credits to accounts of this bank, new and existing, and to the clearing
+# accounts of other banks, whose payments fail at random
+PAYMENTS = [
+    ("1001", "EXAMPLE_BANK", 10.5),
+    ("2001", "EXAMPLE_BANK", 20.25),
+    ("2001", "EXAMPLE_BANK", 5),
+    ("3001", "OTHER_BANK", 30),
+    ("3002", "THIRD_BANK", 12.75),
+    ("3003", "OTHER_BANK", 8),
+    ("2002", "EXAMPLE_BANK", 40),
+]
+
+
+class PerRowLedger:
+    """
+    The per-row posting the batch ledger replaced: every movement reads its
+    row and updates it through the ORM.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def load(self, account_numbers, block_reference_nos):
+        pass
+
+    def _account(self, account_number):
+        return self.session.scalar(
+            select(Account).where(Account.account_number == account_number)
+        )
+
+    def update_account_for_debit(self, account_number, payment_amount):
+        account = self._account(account_number)
+        account.book_balance -= payment_amount
+        account.blocked_amount -= payment_amount
+        account.available_balance = account.book_balance - account.blocked_amount
+
+    def update_account_for_credit(
+        self,
+        beneficiary_name,
+        account_number,
+        account_holder_phone,
+        account_holder_email,
+        currency,
+        payment_amount,
+    ):
+        account = self._account(account_number)
+        if not account:
+            account = Account(
+                account_holder_name=beneficiary_name,
+                account_number=account_number,
+                book_balance=0,
+                available_balance=0,
+                blocked_amount=0,
+                account_holder_phone=account_holder_phone,
+                account_holder_email=account_holder_email,
+                account_currency=currency,
+                active=True,
+            )
+            self.session.add(account)
+        account.book_balance += payment_amount
+        account.available_balance = account.book_balance - account.blocked_amount
+
+    def update_fund_block(self, block_reference_no, payment_amount):
+        self.session.scalar(
+            select(FundBlock).where(FundBlock.block_reference_no == block_reference_no)
+        ).amount_released += payment_amount
+
+    def add_accounting_log(self, accounting_log):
+        self.session.add(accounting_log)
+
+    def flush(self):
+        self.session.flush()
+
+
+def post_batch(engine, make_ledger, monkeypatch):
+    # Both paths draw the same failures and reference numbers
+    monkeypatch.setattr(process_payment, "random", random.Random(7))
+    monkeypatch.setattr(
+        process_payment, "uuid", SimpleNamespace(uuid4=itertools.count().__next__)
+    )
+    with sessionmaker(engine)() as session:
+        initiate_payment_requests = session.scalars(
+            select(InitiatePaymentRequest).order_by(InitiatePaymentRequest.id)
+        ).all()
+        ledger = make_ledger(session)
+        process_payment.process_payment_chunk(initiate_payment_requests, ledger)
+        ledger.flush()
+        session.commit()
+
+        return (
+            session.execute(
+                select(
+                    Account.account_number,
+                    Account.account_holder_name,
+                    Account.account_currency,
+                    Account.book_balance,
+                    Account.blocked_amount,
+                    Account.available_balance,
+                ).order_by(Account.account_number)
+            ).all(),
+            session.execute(
+                select(FundBlock.block_reference_no, FundBlock.amount_released)
+            ).all(),
+            session.execute(
+                select(
+                    AccountingLog.reference_no,
+                    AccountingLog.corresponding_block_reference_no,
+                    AccountingLog.customer_reference_no,
+                    AccountingLog.debit_credit,
+                    AccountingLog.account_number,
+                    AccountingLog.transaction_amount,
+                    AccountingLog.narrative_6,
+                ).order_by(AccountingLog.reference_no)
+            ).all(),
+        )
+
+
+@pytest.mark.parametrize("net_settlement", [False, True])
+def test_batch_ledger_matches_per_row_posting(
+    bank_database,
+    bank_engine,
+    seed_payment_batch,
+    tmp_path,
+    monkeypatch,
+    net_settlement,
+):
+    seed_payment_batch("B1", PAYMENTS)
+    per_row_engine = create_engine(
+        f"sqlite:///{shutil.copy(bank_database, tmp_path / 'per_row.db')}"
+    )
+
+    expected = post_batch(per_row_engine, PerRowLedger, monkeypatch)
+    posted = post_batch(
+        bank_engine,
+        lambda session: BatchLedger(session, net_settlement=net_settlement),
+        monkeypatch,
+    )
+    per_row_engine.dispose()
+
+    accounts, fund_blocks, accounting_logs = posted
+    assert posted == expected
+    # Some payments failed, were reversed and gave their release back
+    assert any(amount < 0 for *_, amount, _ in accounting_logs)
+    assert fund_blocks[0][1] < sum(amount for *_, amount in PAYMENTS)
+    assert {account.account_number for account in accounts} >= {"2001", "2002"}
@@ -0,0 +1,83 @@
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from openg2p_g2p_bridge_example_bank_celery.utils import Mt940Writer, TransactionType
+
+mt940_writer = Mt940Writer()
+# A debit with narratives and a reversed credit without, on dates that span
+# a year end
+WITH_86 = mt940_writer.create_transaction(
+    datetime(2024, 3, 5, 10, 30),
+    datetime(2024, 3, 5, 10, 30),
+    "D",
+    Decimal("1234.5"),
+    TransactionType.transfer,
+    "DISB-1",
+    "REF-1",
+    "",
+    "",
+    "DISB-1\nBEN-1\nPRG\nCYCLE1\nNone\nNone",
+)
+WITHOUT_86 = mt940_writer.create_transaction(
+    datetime(2024, 12, 31),
+    datetime(2025, 1, 2),
+    "RC",
+    Decimal("0.07"),
+    TransactionType.transfer,
+    "DISB-2",
+    "REF-2",
+    "",
+    "",
+    None,
+)
+
+
+@pytest.mark.parametrize(
+    "opening_amount, transactions, expected",
+    [
+        # Output of the writer before it was optimized
+        (
+            Decimal("1000"),
+            [WITH_86, WITHOUT_86],
+            ":20:7\n:25:1001\n:28C:1/1\n:60F:C240305USD1000,00"
+            "\n:61:2403050305D000000001234,50NTRFDISB-1//REF-1"
+            "\n:86:DISB-1\nBEN-1\nPRG\nCYCLE1\nNone\nNone"
+            "\n:61:2412310102RC000000000000,07NTRFDISB-2//REF-2"
+            "\n:62F:D250102USD234,57",
+        ),
+        (
+            Decimal("-0.5"),
+            [WITHOUT_86],
+            ":20:7\n:25:1001\n:28C:1/1\n:60F:D240305USD0,50"
+            "\n:61:2412310102RC000000000000,07NTRFDISB-2//REF-2"
+            "\n:62F:D250102USD234,57",
+        ),
+        (
+            Decimal("1000"),
+            [],
+            ":20:7\n:25:1001\n:28C:1/1\n:60F:C240305USD1000,00"
+            "\n:62F:D250102USD234,57",
+        ),
+    ],
+)
+def test_statement_output_is_unchanged(opening_amount, transactions, expected):
+    opening_balance = mt940_writer.create_balance(
+        opening_amount, datetime(2024, 3, 5), "USD"
+    )
+    closing_balance = mt940_writer.create_balance(
+        Decimal("-234.57"), datetime(2025, 1, 2), "USD"
+    )
+    statement = mt940_writer.create_statement(
+        7, "1001", "1/1", opening_balance, closing_balance, transactions
+    )
+    statement_file = io.StringIO()
+    mt940_writer.write_statement_header(
+        statement_file, 7, "1001", "1/1", opening_balance
+    )
+    mt940_writer.write_transactions(statement_file, transactions, buffer_size=1)
+    mt940_writer.write_statement_footer(statement_file, closing_balance)
+
+    assert mt940_writer.format_statement(statement) == expected
+    assert statement_file.getvalue() == expected
@@ -0,0 +1,276 @@
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+from openg2p_g2p_bridge_example_bank_celery.tasks import process_payment
+from openg2p_g2p_bridge_example_bank_celery.utils import balance_snapshot
+from openg2p_g2p_bridge_example_bank_models.models import (
+    Account,
+    AccountingLog,
+    FundBlock,
+    InitiatePaymentBatchPartition,
+    InitiatePaymentBatchRequest,
+    PaymentStatus,
+)
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+# Payments to accounts of this bank, which never fail at random
+PAYMENTS = [(f"20{index:02d}", "EXAMPLE_BANK", 10 + index) for index in range(7)]
+TOTAL = sum(amount for _, _, amount in PAYMENTS)
+
+
+@pytest.fixture
+def run_chords(monkeypatch):
+    """Runs the partitions of a chord one after the other, then its callback."""
+
+    def chord(header):
+        return lambda callback: callback([signature() for signature in header])
+
+    monkeypatch.setattr(process_payment, "chord", chord)
+
+
+def get_batch(engine, batch_id) -> InitiatePaymentBatchRequest:
+    with sessionmaker(engine)() as session:
+        return session.scalar(
+            select(InitiatePaymentBatchRequest).where(
+                InitiatePaymentBatchRequest.batch_id == batch_id
+            )
+        )
+
+
+def get_ledger(engine):
+    with sessionmaker(engine)() as session:
+        return (
+            session.scalar(select(Account).where(Account.account_number == "1001")),
+            session.scalar(select(FundBlock)),
+            dict(
+                session.execute(
+                    select(AccountingLog.customer_reference_no, func.count())
+                    .where(AccountingLog.account_number == "1001")
+                    .group_by(AccountingLog.customer_reference_no)
+                ).all()
+            ),
+        )
+
+
+@pytest.mark.parametrize("net_settlement", [False, True])
+def test_partitions_settle_batch_once_all_are_done(
+    bank_engine, seed_payment_batch, sent_tasks, run_chords, monkeypatch, net_settlement
+):
+    monkeypatch.setattr(process_payment._config, "payment_partition_size", 3)
+    monkeypatch.setattr(process_payment._config, "payment_processing_chunk_size", 2)
+    monkeypatch.setattr(
+        process_payment._config, "payment_net_settlement_enabled", net_settlement
+    )
+    seed_payment_batch("B1", PAYMENTS)
+    failing_payment_amount = PAYMENTS[4][2]
+    process_payment_chunk = process_payment.process_payment_chunk
+
+    def fail_partition_once(initiate_payment_requests, ledger):
+        if any(
+            request.payment_amount == failing_payment_amount
+            for request in initiate_payment_requests
+        ):
+            monkeypatch.setattr(
+                process_payment, "process_payment_chunk", process_payment_chunk
+            )
+            raise RuntimeError("Partition failed")
+        process_payment_chunk(initiate_payment_requests, ledger)
+
+    monkeypatch.setattr(process_payment, "process_payment_chunk", fail_partition_once)
+
+    process_payment.process_payments_worker("B1")
+    failed_batch = get_batch(bank_engine, "B1")
+    statement_requests_after_failure = len(sent_tasks)
+    process_payment.process_payments_worker("B1")
+
+    with sessionmaker(bank_engine)() as session:
+        partitions = session.execute(
+            select(
+                InitiatePaymentBatchPartition.first_payment_request_id,
+                InitiatePaymentBatchPartition.last_payment_request_id,
+                InitiatePaymentBatchPartition.payment_status,
+            ).order_by(InitiatePaymentBatchPartition.partition_number)
+        ).all()
+    account, fund_block, debits = get_ledger(bank_engine)
+    batch = get_batch(bank_engine, "B1")
+
+    # The failed partition hands the batch back; the others keep their work
+    assert failed_batch.payment_status == PaymentStatus.PENDING
+    assert failed_batch.payment_initiate_attempts == 1
+    assert statement_requests_after_failure == 0
+    assert [partition[:2] for partition in partitions] == [(1, 3), (4, 6), (7, 7)]
+    assert {partition.payment_status for partition in partitions} == {
+        PaymentStatus.SUCCESS
+    }
+    assert batch.payment_status == PaymentStatus.SUCCESS
+    assert batch.lease_token is None
+    assert sent_tasks == [("account_statement_generator", (1,))]
+    # Every payment was posted exactly once
+    assert debits == {f"B1-{index}": 1 for index in range(len(PAYMENTS))}
+    assert account.book_balance == 1000 - TOTAL
+    assert account.blocked_amount == 0
+    assert account.available_balance == 1000 - TOTAL
+    assert fund_block.amount_released == TOTAL
+
+
+def test_producer_leases_each_pending_batch_once(
+    bank_engine, seed_payment_batch, sent_tasks
+):
+    seed_payment_batch("B1", PAYMENTS[:2])
+    seed_payment_batch("B2", PAYMENTS[2:])
+
+    process_payment.process_payments_beat_producer()
+    # Both batches are leased, so a second run dispatches nothing
+    process_payment.process_payments_beat_producer()
+    dispatched = list(sent_tasks)
+    leased = get_batch(bank_engine, "B1")
+
+    # A worker that died lets its lease expire, and the batch is claimed again
+    with sessionmaker(bank_engine)() as session:
+        session.execute(
+            update(InitiatePaymentBatchRequest)
+            .where(InitiatePaymentBatchRequest.batch_id == "B1")
+            .values(lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+        )
+        session.commit()
+    process_payment.process_payments_beat_producer()
+    reclaimed = get_batch(bank_engine, "B1")
+
+    assert [(name, args[0]) for name, args in dispatched] == [
+        ("process_payments_worker", "B1"),
+        ("process_payments_worker", "B2"),
+    ]
+    assert dispatched[0][1][1] == leased.lease_token
+    assert leased.payment_status == PaymentStatus.IN_PROGRESS
+    assert leased.lease_expires_at > datetime.utcnow()
+    assert sent_tasks[2:] == [
+        ("process_payments_worker", ("B1", reclaimed.lease_token))
+    ]
+    assert reclaimed.lease_token != leased.lease_token
+    assert reclaimed.payment_initiate_attempts == 1
+
+    # The worker holding the expired lease no longer posts anything
+    process_payment.process_payments_worker("B1", leased.lease_token)
+    assert get_ledger(bank_engine)[2] == {}
+
+
+def test_serial_batch_resumes_after_last_committed_chunk(
+    bank_engine, seed_payment_batch, sent_tasks, monkeypatch
+):
+    monkeypatch.setattr(process_payment._config, "payment_partition_size", 100)
+    monkeypatch.setattr(process_payment._config, "payment_processing_chunk_size", 2)
+    seed_payment_batch("B1", PAYMENTS)
+    process_payment_chunk = process_payment.process_payment_chunk
+    chunks = []
+
+    def fail_second_chunk_once(initiate_payment_requests, ledger):
+        chunks.append([request.id for request in initiate_payment_requests])
+        if len(chunks) == 2:
+            raise RuntimeError("Worker lost")
+        process_payment_chunk(initiate_payment_requests, ledger)
+
+    monkeypatch.setattr(
+        process_payment, "process_payment_chunk", fail_second_chunk_once
+    )
+
+    process_payment.process_payments_worker("B1")
+    failed_batch = get_batch(bank_engine, "B1")
+    process_payment.process_payments_worker("B1")
+    account, fund_block, debits = get_ledger(bank_engine)
+
+    assert failed_batch.payment_status == PaymentStatus.PENDING
+    assert failed_batch.last_processed_payment_request_id == 2
+    # The retry starts at the chunk that failed
+    assert chunks == [[1, 2], [3, 4], [3, 4], [5, 6], [7]]
+    assert get_batch(bank_engine, "B1").payment_status == PaymentStatus.SUCCESS
+    assert debits == {f"B1-{index}": 1 for index in range(len(PAYMENTS))}
+    assert account.book_balance == 1000 - TOTAL
+    assert fund_block.amount_released == TOTAL
+
+
+def test_batch_fails_once_attempts_are_used_up(
+    bank_engine, seed_payment_batch, sent_tasks, monkeypatch
+):
+    monkeypatch.setattr(process_payment._config, "payment_initiate_attempts", 2)
+    seed_payment_batch("B1", PAYMENTS[:2])
+    seed_payment_batch("B2", PAYMENTS[2:])
+
+    def fail_chunk(initiate_payment_requests, ledger):
+        raise RuntimeError("Ledger unavailable")
+
+    monkeypatch.setattr(process_payment, "process_payment_chunk", fail_chunk)
+
+    process_payment.process_payments_worker("B1")
+    retried = get_batch(bank_engine, "B1")
+    process_payment.process_payments_worker("B1")
+    # B2's worker dies holding the lease of its last attempt
+    with sessionmaker(bank_engine)() as session:
+        session.execute(
+            update(InitiatePaymentBatchRequest)
+            .where(InitiatePaymentBatchRequest.batch_id == "B2")
+            .values(
+                payment_status=PaymentStatus.IN_PROGRESS,
+                payment_initiate_attempts=1,
+                lease_token="dead-worker",
+                lease_expires_at=datetime.utcnow() - timedelta(seconds=1),
+            )
+        )
+        session.commit()
+    process_payment.process_payments_beat_producer()
+    process_payment.process_payments_worker("B2")
+
+    assert retried.payment_status == PaymentStatus.PENDING
+    assert retried.payment_initiate_attempts == 1
+    assert [
+        (
+            batch.payment_status,
+            batch.payment_initiate_attempts,
+            batch.failure_reason,
+            batch.lease_token,
+        )
+        for batch in (get_batch(bank_engine, "B1"), get_batch(bank_engine, "B2"))
+    ] == [
+        (PaymentStatus.FAILED, 2, "Ledger unavailable", None),
+        (PaymentStatus.FAILED, 2, "Lease expired", None),
+    ]
+    assert sent_tasks == []
+
+
+def test_balance_snapshot_is_invalidated_before_chunk_commits(
+    bank_engine, seed_payment_batch, sent_tasks, monkeypatch
+):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        balance_snapshot.redis.Redis,
+        "from_url",
+        lambda *args, **kwargs: fakeredis.FakeRedis(server=server),
+    )
+    monkeypatch.setattr(balance_snapshot, "_redis", None)
+    monkeypatch.setattr(process_payment._config, "balance_snapshot_enabled", True)
+    seed_payment_batch("B1", PAYMENTS[:2])
+    redis = fakeredis.FakeRedis(server=server)
+    redis.hset(
+        "example_bank:balance:1001",
+        mapping={"version": 0, "available_balance": 1000, "currency": "USD"},
+    )
+    snapshots_at_commit = []
+    commit = Session.commit
+
+    def record_snapshot_and_commit(session):
+        snapshots_at_commit.append(redis.hgetall("example_bank:balance:1001"))
+        commit(session)
+
+    monkeypatch.setattr(Session, "commit", record_snapshot_and_commit)
+
+    process_payment.process_payments_worker("B1")
+    account = get_ledger(bank_engine)[0]
+
+    # The pending version is marked before the chunk commits, without a balance
+    assert {b"version": str(account.balance_version).encode()} in snapshots_at_commit
+    assert redis.hgetall("example_bank:balance:1001") == {
+        b"version": str(account.balance_version).encode(),
+        b"available_balance": repr(account.available_balance).encode(),
+        b"currency": b"USD",
+    }
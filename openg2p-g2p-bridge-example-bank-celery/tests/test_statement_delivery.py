@@ -0,0 +1,138 @@
+import gzip
+import threading
+from datetime import datetime
+
+from openg2p_g2p_bridge_example_bank_celery.tasks import statement_delivery
+from openg2p_g2p_bridge_example_bank_models.models import (
+    AccountStatementPage,
+    StatementDelivery,
+    StatementDeliveryStatus,
+)
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import sessionmaker
+
+_PAGE = b":20:1\n:25:1001\n:28C:1/1\n:61:...\n:62F:..."
+
+
+def get_delivery(engine) -> StatementDelivery:
+    with sessionmaker(engine)() as session:
+        return session.scalars(select(StatementDelivery)).one()
+
+
+def make_due(engine):
+    with sessionmaker(engine)() as session:
+        session.execute(
+            update(StatementDelivery).values(next_attempt_at=datetime.utcnow())
+        )
+        session.commit()
+
+
+def test_failed_delivery_is_retried_with_backoff(bank_engine, stored_page, receiver):
+    receiver.statuses.append(503)
+
+    statement_delivery.statement_delivery_worker()
+    failed = get_delivery(bank_engine)
+    # Not due again before its backoff runs out
+    statement_delivery.statement_delivery_worker()
+    make_due(bank_engine)
+    statement_delivery.statement_delivery_worker()
+    delivered = get_delivery(bank_engine)
+
+    assert failed.delivery_status == StatementDeliveryStatus.PENDING
+    assert failed.delivery_attempts == 1
+    assert failed.next_attempt_at > datetime.utcnow()
+    assert "503" in failed.last_error
+    assert delivered.delivery_status == StatementDeliveryStatus.DELIVERED
+    assert delivered.delivery_attempts == 2
+    assert len(receiver.uploads) == 2
+    upload = receiver.uploads[-1]
+    assert upload.fields == {"page_number": "1", "page_count": "1"}
+    assert (upload.file_name, upload.content) == ("statement.mt940", _PAGE)
+    assert upload.chunked
+    # Both attempts went over the same pooled connection
+    assert receiver.uploads[0].client_address == upload.client_address
+
+
+def test_delivery_gives_up_after_max_attempts(
+    bank_engine, stored_page, receiver, monkeypatch
+):
+    monkeypatch.setattr(
+        statement_delivery._config, "statement_delivery_max_attempts", 2
+    )
+    receiver.statuses.extend([500, 500])
+
+    statement_delivery.statement_delivery_worker()
+    make_due(bank_engine)
+    statement_delivery.statement_delivery_worker()
+
+    delivery = get_delivery(bank_engine)
+    assert delivery.delivery_status == StatementDeliveryStatus.FAILED
+    assert delivery.delivery_attempts == 2
+
+
+def test_gzip_delivery(bank_engine, stored_page, receiver, monkeypatch):
+    monkeypatch.setattr(statement_delivery._config, "statement_delivery_gzip", True)
+
+    statement_delivery.statement_delivery_worker()
+
+    upload = receiver.uploads[0]
+    assert (upload.file_name, upload.content_type) == (
+        "statement.mt940.gz",
+        "application/gzip",
+    )
+    assert gzip.decompress(upload.content) == _PAGE
+    assert (
+        get_delivery(bank_engine).delivery_status == StatementDeliveryStatus.DELIVERED
+    )
+
+
+def test_pages_are_uploaded_concurrently_up_to_pool_size(
+    bank_engine, stored_page, receiver, monkeypatch
+):
+    monkeypatch.setattr(statement_delivery._config, "statement_delivery_pool_size", 3)
+    with sessionmaker(bank_engine)() as session:
+        for page_number in range(2, 7):
+            session.add(
+                AccountStatementPage(
+                    account_statement_id=1,
+                    page_number=page_number,
+                    transaction_count=2,
+                    storage_key=stored_page.storage_key,
+                    content_size=stored_page.content_size,
+                    content_sha256=stored_page.content_sha256,
+                    active=True,
+                )
+            )
+        # The statement is now six pages long
+        session.execute(delete(StatementDelivery))
+        statement_delivery.enqueue_statement_delivery(1, 6, session)
+        session.commit()
+    # Each upload waits until as many are in flight as the pool holds
+    uploads_in_flight = threading.Barrier(3, timeout=10)
+    deliver_statement_page = statement_delivery.deliver_statement_page
+
+    def deliver_alongside_others(delivery, session):
+        uploads_in_flight.wait()
+        deliver_statement_page(delivery, session)
+
+    monkeypatch.setattr(
+        statement_delivery, "deliver_statement_page", deliver_alongside_others
+    )
+
+    statement_delivery.statement_delivery_worker()
+
+    with sessionmaker(bank_engine)() as session:
+        deliveries = session.scalars(select(StatementDelivery)).all()
+    assert {delivery.delivery_status for delivery in deliveries} == {
+        StatementDeliveryStatus.DELIVERED
+    }
+    assert {delivery.delivery_attempts for delivery in deliveries} == {1}
+    assert sorted(int(upload.fields["page_number"]) for upload in receiver.uploads) == [
+        1,
+        2,
+        3,
+        4,
+        5,
+        6,
+    ]
+    assert len({upload.client_address for upload in receiver.uploads}) == 3
@@ -0,0 +1,22 @@
+import gzip
+import hashlib
+import io
+import os
+
+
+def test_statements_are_stored_once_compressed(statement_store):
+    statement = ":20:1\n:25:1001\n:28C:1/1\n" + ":61:240101C100,00NTRF\n" * 1000
+
+    stored = statement_store.put(io.StringIO(statement))
+    stored_again = statement_store.put(io.BytesIO(statement.encode()))
+    path = statement_store._path(stored.storage_key)
+
+    assert stored == stored_again
+    assert stored.content_size == len(statement)
+    assert stored.content_sha256 == hashlib.sha256(statement.encode()).hexdigest()
+    assert os.path.getsize(path) < stored.content_size
+    assert sum(len(files) for _, _, files in os.walk(statement_store.root)) == 1
+    with statement_store.open(stored.storage_key) as reader:
+        assert reader.read().decode() == statement
+    with statement_store.open_gzip(stored.storage_key) as reader:
+        assert gzip.decompress(reader.read()).decode() == statement
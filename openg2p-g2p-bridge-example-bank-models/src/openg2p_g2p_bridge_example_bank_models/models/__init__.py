@@ -2,13 +2,24 @@ from .account import (
     Account,
 )
 from .account_statement import (
+    AccountBalanceCheckpoint,
     AccountingLog,
     AccountStatement,
+    AccountStatementPage,
+    AccountStatementStatus,
     DebitCreditTypes,
 )
+from .idempotency_key import (
+    IdempotencyKey,
+)
 from .payment_request import (
     FundBlock,
+    InitiatePaymentBatchPartition,
     InitiatePaymentBatchRequest,
     InitiatePaymentRequest,
     PaymentStatus,
 )
+from .statement_delivery import (
+    StatementDelivery,
+    StatementDeliveryStatus,
+)
@@ -1,5 +1,5 @@
 from openg2p_fastapi_common.models import BaseORMModelWithTimes
-from sqlalchemy import Float, String
+from sqlalchemy import Float, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 
@@ -13,3 +13,5 @@ class Account(BaseORMModelWithTimes):
     book_balance: Mapped[float] = mapped_column(Float)
     available_balance: Mapped[float] = mapped_column(Float)
     blocked_amount: Mapped[float] = mapped_column(Float, default=0)
+    # Incremented by every balance change; orders cached balance snapshots
+    balance_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
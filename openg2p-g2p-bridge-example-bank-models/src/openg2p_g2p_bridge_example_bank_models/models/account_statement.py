@@ -2,7 +2,7 @@ from datetime import datetime
 from enum import Enum
 
 from openg2p_fastapi_common.models import BaseORMModelWithTimes
-from sqlalchemy import Boolean, DateTime, Float, String, Text
+from sqlalchemy import Boolean, DateTime, Float, Index, Integer, String, Text
 from sqlalchemy import Enum as SqlEnum
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -12,13 +12,53 @@ class DebitCreditTypes(Enum):
     CREDIT = "credit"
 
 
+class AccountStatementStatus(Enum):
+    PENDING = "PENDING"
+    GENERATING = "GENERATING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+
 class AccountStatement(BaseORMModelWithTimes):
     __tablename__ = "account_statements"
     account_number: Mapped[str] = mapped_column(String, index=True)
+    # Body of statements generated before they were split into pages; new
+    # statements keep their pages in the statement store
     account_statement_lob: Mapped[str] = mapped_column(Text, nullable=True)
     account_statement_date: Mapped[datetime.date] = mapped_column(
         DateTime, default=datetime.date(datetime.utcnow())
     )
+    page_count: Mapped[int] = mapped_column(Integer, nullable=True)
+    # Both set for a statement of the postings of a date range, inclusive
+    from_date: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    to_date: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    statement_status: Mapped[AccountStatementStatus] = mapped_column(
+        SqlEnum(AccountStatementStatus, native_enum=False),
+        nullable=True,
+        default=AccountStatementStatus.PENDING,
+    )
+
+
+class AccountBalanceCheckpoint(BaseORMModelWithTimes):
+    """Balance of an account right after posting last_log_id was applied."""
+
+    __tablename__ = "account_balance_checkpoints"
+    account_number: Mapped[str] = mapped_column(String)
+    account_statement_id: Mapped[int] = mapped_column(Integer)
+    last_log_id: Mapped[int] = mapped_column(Integer)
+    balance: Mapped[float] = mapped_column(Float)
+    checkpoint_date: Mapped[datetime] = mapped_column(DateTime)
+
+
+class AccountStatementPage(BaseORMModelWithTimes):
+    __tablename__ = "account_statement_pages"
+    account_statement_id: Mapped[int] = mapped_column(Integer, index=True)
+    page_number: Mapped[int] = mapped_column(Integer)
+    transaction_count: Mapped[int] = mapped_column(Integer)
+    # The page body is kept in the statement store under storage_key
+    storage_key: Mapped[str] = mapped_column(String)
+    content_size: Mapped[int] = mapped_column(Integer)
+    content_sha256: Mapped[str] = mapped_column(String)
 
 
 class AccountingLog(BaseORMModelWithTimes):
@@ -44,3 +84,50 @@ class AccountingLog(BaseORMModelWithTimes):
         String, nullable=True
     )  # beneficiary phone number
     reported_in_mt940: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+# Latest postings of an account, read without sorting all of its rows
+Index(
+    "ix_accounting_logs_account_number_id_desc",
+    AccountingLog.account_number,
+    AccountingLog.id.desc(),
+)
+# At most one pending statement of the unreported postings per account, which
+# later requests for the account are merged into
+Index(
+    "ux_account_statements_pending_account_number",
+    AccountStatement.account_number,
+    unique=True,
+    postgresql_where=(
+        (AccountStatement.statement_status == AccountStatementStatus.PENDING)
+        & AccountStatement.from_date.is_(None)
+    ),
+    sqlite_where=(
+        (AccountStatement.statement_status == AccountStatementStatus.PENDING)
+        & AccountStatement.from_date.is_(None)
+    ),
+)
+
+# Postings of an account in a date range
+Index(
+    "ix_accounting_logs_account_number_transaction_date",
+    AccountingLog.account_number,
+    AccountingLog.transaction_date,
+)
+
+# Postings not yet reported in a statement, which stay few however long the
+# account's history grows
+Index(
+    "ix_accounting_logs_unreported_account_number_id",
+    AccountingLog.account_number,
+    AccountingLog.id,
+    postgresql_where=AccountingLog.reported_in_mt940.is_(False),
+    sqlite_where=AccountingLog.reported_in_mt940.is_(False),
+)
+
+# Latest checkpoint of an account
+Index(
+    "ix_account_balance_checkpoints_account_number_last_log_id",
+    AccountBalanceCheckpoint.account_number,
+    AccountBalanceCheckpoint.last_log_id.desc(),
+)
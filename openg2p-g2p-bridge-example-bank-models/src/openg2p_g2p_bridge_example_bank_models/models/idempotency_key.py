@@ -0,0 +1,18 @@
+from openg2p_fastapi_common.models import BaseORMModelWithTimes
+from sqlalchemy import String, Text, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class IdempotencyKey(BaseORMModelWithTimes):
+    __tablename__ = "idempotency_keys"
+    endpoint: Mapped[str] = mapped_column(String)
+    idempotency_key: Mapped[str] = mapped_column(String)
+    response: Mapped[str] = mapped_column(Text)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "endpoint",
+            "idempotency_key",
+            name="uq_idempotency_keys_endpoint_idempotency_key",
+        ),
+    )
@@ -1,13 +1,15 @@
+from datetime import datetime
 from enum import Enum
 
 from openg2p_fastapi_common.models import BaseORMModelWithTimes
+from sqlalchemy import DateTime, Float, Integer, String
 from sqlalchemy import Enum as SqlEnum
-from sqlalchemy import Float, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 
 class PaymentStatus(Enum):
     PENDING = "PENDING"
+    IN_PROGRESS = "IN_PROGRESS"
     SUCCESS = "SUCCESS"
     FAILED = "FAILED"
 
@@ -28,6 +30,27 @@ class InitiatePaymentBatchRequest(BaseORMModelWithTimes):
     payment_status: Mapped[PaymentStatus] = mapped_column(
         SqlEnum(PaymentStatus), default=PaymentStatus.PENDING
     )
+    last_processed_payment_request_id: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+    lease_token: Mapped[str] = mapped_column(String, nullable=True)
+    lease_expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    # Why the latest attempt failed
+    failure_reason: Mapped[str] = mapped_column(String, nullable=True)
+
+
+class InitiatePaymentBatchPartition(BaseORMModelWithTimes):
+    __tablename__ = "initiate_payment_batch_partitions"
+    batch_id: Mapped[str] = mapped_column(String, index=True)
+    partition_number: Mapped[int] = mapped_column(Integer)
+    first_payment_request_id: Mapped[int] = mapped_column(Integer)
+    last_payment_request_id: Mapped[int] = mapped_column(Integer)
+    last_processed_payment_request_id: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
+    payment_status: Mapped[PaymentStatus] = mapped_column(
+        SqlEnum(PaymentStatus), default=PaymentStatus.PENDING
+    )
 
 
 class InitiatePaymentRequest(BaseORMModelWithTimes):
@@ -0,0 +1,41 @@
+from datetime import datetime
+from enum import Enum
+
+from openg2p_fastapi_common.models import BaseORMModelWithTimes
+from sqlalchemy import DateTime, Index, Integer, Text
+from sqlalchemy import Enum as SqlEnum
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class StatementDeliveryStatus(Enum):
+    PENDING = "PENDING"
+    DELIVERED = "DELIVERED"
+    FAILED = "FAILED"
+
+
+class StatementDelivery(BaseORMModelWithTimes):
+    """Outbox entry of a statement page to upload to the statement callback."""
+
+    __tablename__ = "statement_deliveries"
+    account_statement_id: Mapped[int] = mapped_column(Integer, index=True)
+    page_number: Mapped[int] = mapped_column(Integer)
+    page_count: Mapped[int] = mapped_column(Integer)
+    delivery_status: Mapped[StatementDeliveryStatus] = mapped_column(
+        SqlEnum(StatementDeliveryStatus, native_enum=False),
+        default=StatementDeliveryStatus.PENDING,
+    )
+    delivery_attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    delivered_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+# Deliveries due, which stay few however many were delivered before
+Index(
+    "ix_statement_deliveries_pending_next_attempt_at",
+    StatementDelivery.next_attempt_at,
+    postgresql_where=(
+        StatementDelivery.delivery_status == StatementDeliveryStatus.PENDING
+    ),
+    sqlite_where=(StatementDelivery.delivery_status == StatementDeliveryStatus.PENDING),
+)
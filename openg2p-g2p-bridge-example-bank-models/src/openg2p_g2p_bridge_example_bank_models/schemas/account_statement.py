@@ -1,3 +1,4 @@
+from datetime import date
 from typing import Optional
 
 from pydantic import BaseModel
@@ -5,6 +6,10 @@ from pydantic import BaseModel
 
 class AccountStatementRequest(BaseModel):
     program_account_number: str
+    # Both or neither; without them the statement reports every posting
+    # not reported yet
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
 
 
 class AccountStatementResponse(BaseModel):
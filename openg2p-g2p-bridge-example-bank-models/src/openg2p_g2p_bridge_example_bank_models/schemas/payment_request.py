@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -36,3 +36,6 @@ class InitiatePaymentPayload(BaseModel):
 class InitiatePaymentResponse(BaseModel):
     status: str
     error_message: Optional[str] = None
+    # Payloads skipped because their payment reference number was already
+    # used, by an earlier request or earlier in the same one
+    duplicate_payment_reference_numbers: List[str] = []
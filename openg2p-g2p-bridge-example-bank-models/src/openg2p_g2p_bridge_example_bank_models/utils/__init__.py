@@ -0,0 +1,3 @@
+from .account_statement import (
+    get_or_create_pending_statement,
+)
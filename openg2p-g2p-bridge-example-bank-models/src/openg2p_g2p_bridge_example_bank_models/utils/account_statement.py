@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from typing import Tuple
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models import AccountStatement, AccountStatementStatus
+
+_pending_statement_stmt = select(
+    AccountStatement.id, AccountStatement.created_at
+).where(
+    AccountStatement.account_number == bindparam("account_number"),
+    AccountStatement.statement_status == AccountStatementStatus.PENDING,
+    AccountStatement.from_date.is_(None),
+)
+
+
+def get_or_create_pending_statement(
+    session: Session, account_number: str, redispatch_after: timedelta
+) -> Tuple[int, bool]:
+    """
+    Returns the id of the account's pending statement of its unreported
+    postings, committed, and whether its generation has to be scheduled.
+    That is when this call created it, or when it has been pending for
+    longer than redispatch_after, so that its generation task was lost.
+    The unique index on pending statements makes concurrent callers agree
+    on one, and only one generation run claims it.
+
+    Shared by the API and the celery workers; an AsyncSession calls it
+    through run_sync.
+    """
+    pending_statement = session.execute(
+        _pending_statement_stmt, {"account_number": account_number}
+    ).first()
+    if pending_statement:
+        return (
+            pending_statement.id,
+            pending_statement.created_at < datetime.utcnow() - redispatch_after,
+        )
+
+    account_statement = AccountStatement(account_number=account_number, active=True)
+    session.add(account_statement)
+    try:
+        session.commit()
+    except IntegrityError:
+        # A concurrent request created the pending statement first
+        session.rollback()
+        return get_or_create_pending_statement(
+            session, account_number, redispatch_after
+        )
+    return account_statement.id, True